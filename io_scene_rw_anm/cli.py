@@ -0,0 +1,219 @@
+"""Convert and inspect RenderWare animations without Blender.
+
+    python -m io_scene_rw_anm.cli info PATH...
+    python -m io_scene_rw_anm.cli convert PATH... -o OUTPUT_DIR -f FORMAT
+"""
+
+import argparse
+import multiprocessing
+import numpy as np
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from os import path
+
+from .parse_rw_anm import get_file_size, read_rw_animations
+from .types.anm import Anm, ANM_CHUNK_ID, ANM_ANIMATION_VERSION
+from .types.common import RWAnmChunk, AnmAnimation, KeyframeType, get_rw_keyframe_order, pack_rw_lib_id, \
+    unpack_rw_lib_id
+from .types.pool import get_workers_num
+from .types.ska import Ska
+
+OUTPUT_FORMATS = {
+    "uncompressed": KeyframeType.UNCOMPRESSED,
+    "compressed": KeyframeType.COMPRESSED,
+    "tm-compressed-rot": KeyframeType.TM_COMPRESSED_ROT,
+    "climax": KeyframeType.CLIMAX,
+    "ska": None,
+}
+
+DEFAULT_RW_VERSION = pack_rw_lib_id(3, 5, 0, 1)
+
+
+def is_animation_file(filepath):
+    ext = path.splitext(filepath)[-1].lower()
+    return ext in (".ska", ".tmo") or ext[-3:] == "anm"
+
+
+def find_animation_files(paths):
+    """Return (filepath, path relative to its input) of the animation files in paths, directories are walked"""
+    files = []
+    for input_path in paths:
+        if not path.isdir(input_path):
+            files.append((input_path, path.basename(input_path)))
+            continue
+
+        for root, dirs, filenames in os.walk(input_path):
+            dirs.sort()
+            for filename in sorted(filenames):
+                filepath = path.join(root, filename)
+                if is_animation_file(filepath):
+                    files.append((filepath, path.relpath(filepath, input_path)))
+    return files
+
+
+def get_keyframe_type_name(keyframe_type):
+    try:
+        return KeyframeType(keyframe_type).name
+    except ValueError:
+        return "0x%X" % keyframe_type
+
+
+def get_animation_stats(rw_animation: AnmAnimation):
+    arrays = rw_animation.arrays
+    bone_keys = np.unique(arrays.bone_ids, return_counts=True)[1]
+    return "%d keyframes, %d bones (%d-%d keys), %d with position, %d with rotation, time %.4g-%.4g" % (
+        len(arrays), len(bone_keys),
+        bone_keys.min() if len(bone_keys) else 0, bone_keys.max() if len(bone_keys) else 0,
+        np.count_nonzero(arrays.has_pos), np.count_nonzero(arrays.has_rot),
+        arrays.times.min() if len(arrays) else 0.0, arrays.times.max() if len(arrays) else 0.0)
+
+
+def inspect_file(filepath):
+    """Return the report lines of headers and keyframe stats of each animation in the file"""
+    rw_animations, rw_version = read_rw_animations(filepath)
+
+    lines = ["%s: %d animations" % (filepath, len(rw_animations))]
+    if rw_version is not None:
+        lines[0] += ", RW version %x.%x.%x.%x" % unpack_rw_lib_id(rw_version)
+
+    for anim_idx, rw_anim in enumerate(rw_animations):
+        lines.append("  [%d] type %s, version 0x%X, flags 0x%X, duration %.4g" % (
+            anim_idx, get_keyframe_type_name(rw_anim.keyframe_type), rw_anim.version, rw_anim.flags, rw_anim.duration))
+        lines.append("      " + get_animation_stats(rw_anim))
+    return lines
+
+
+def get_rw_ordered_arrays(rw_animation: AnmAnimation):
+    """Keyframes in the order of RW blocks, as the exporter writes them. Merged AKI keyframes are sorted by time
+    and bone, the writers rebuild the previous keyframe offsets from this order"""
+    arrays = rw_animation.arrays
+    return arrays.take(get_rw_keyframe_order(arrays.times, arrays.bone_ids))
+
+
+def convert_file(filepath, output_path, output_format, rw_version=None):
+    """Write the animations of the file in output_format, return the report lines"""
+    rw_animations, file_rw_version = read_rw_animations(filepath)
+    if not rw_animations:
+        return ["%s: no animations, skipped" % filepath]
+
+    for rw_anim in rw_animations:
+        if rw_anim.is_pose_space() or not rw_anim.is_indexed_bones():
+            raise ValueError("%s keyframes are not stored per bone index and can not be converted" %
+                             get_keyframe_type_name(rw_anim.keyframe_type))
+        # Rotation-only keyframes would be written with zero positions
+        if output_format != "tm-compressed-rot" and not rw_anim.arrays.has_pos.all():
+            raise ValueError("%s keyframes have no positions and can only be converted to tm-compressed-rot" %
+                             get_keyframe_type_name(rw_anim.keyframe_type))
+
+    os.makedirs(path.dirname(output_path) or ".", exist_ok=True)
+
+    if output_format == "ska":
+        base_path = path.splitext(output_path)[0]
+        output_paths = [base_path + ".ska"] if len(rw_animations) == 1 else \
+            ["%s_%d.ska" % (base_path, anim_idx) for anim_idx in range(len(rw_animations))]
+        for rw_anim, anim_path in zip(rw_animations, output_paths):
+            Ska(AnmAnimation(0, 0, rw_anim.flags, rw_anim.duration, get_rw_ordered_arrays(rw_anim))).save(anim_path)
+
+    else:
+        if rw_version is None:
+            rw_version = DEFAULT_RW_VERSION if file_rw_version is None else file_rw_version
+        output_paths = [path.splitext(output_path)[0] + ".anm"]
+        keyframe_type = OUTPUT_FORMATS[output_format]
+        Anm([RWAnmChunk(ANM_CHUNK_ID, rw_version, AnmAnimation(
+            ANM_ANIMATION_VERSION, keyframe_type, rw_anim.flags, rw_anim.duration, get_rw_ordered_arrays(rw_anim)))
+            for rw_anim in rw_animations]).save(output_paths[0])
+
+    return ["%s -> %s" % (filepath, ", ".join(output_paths))]
+
+
+def find_output_collisions(files):
+    """Return the lists of input files written to the same output path, outputs are named after the input stem"""
+    output_files = {}
+    for filepath, rel_path in files:
+        output_files.setdefault(path.normcase(path.splitext(rel_path)[0]), []).append(filepath)
+    return [filepaths for filepaths in output_files.values() if len(filepaths) > 1]
+
+
+def run_file_task(func, filepath, *args):
+    """Run func on the file in a worker, exceptions are returned as the report of the file"""
+    try:
+        return True, func(filepath, *args)
+    except Exception as e:
+        return False, ["%s: error: %s" % (filepath, e)]
+
+
+def run_file_tasks(func, filepaths, args_list, workers):
+    """Yield (success, lines) of func for each file in the order of filepaths as soon as each file is ready"""
+    workers = get_workers_num(workers, [get_file_size(filepath) for filepath in filepaths])
+    if workers == 1:
+        for filepath, args in zip(filepaths, args_list):
+            yield run_file_task(func, filepath, *args)
+        return
+
+    with ProcessPoolExecutor(workers, multiprocessing.get_context('spawn')) as executor:
+        # Batches of files keep the overhead low for thousands of small clips
+        chunksize = max(1, min(64, len(filepaths) // (workers * 8)))
+        yield from executor.map(run_file_task, repeat(func), filepaths, *zip(*args_list), chunksize=chunksize)
+
+
+def parse_rw_version(text):
+    parts = text.split(".")
+    if len(parts) != 4 or not all(len(p) == 1 and p.isdigit() for p in parts):
+        raise argparse.ArgumentTypeError("RW version must look like 3.5.0.1")
+    return pack_rw_lib_id(*map(int, parts))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m io_scene_rw_anm.cli",
+                                     description="Convert and inspect RenderWare animations (.anm, .ska, .tmo)")
+    parser.add_argument("-j", "--workers", type=int, default=0,
+                        help="number of processes across files, 0 uses all CPU cores (default: 0)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    info_parser = subparsers.add_parser("info", help="print chunk headers and keyframe stats")
+    info_parser.add_argument("paths", nargs="+", help="animation files or directories")
+
+    convert_parser = subparsers.add_parser("convert", help="convert files to another keyframe type or to .ska")
+    convert_parser.add_argument("paths", nargs="+", help="animation files or directories")
+    convert_parser.add_argument("-o", "--output", required=True,
+                                help="output directory, the layout of input directories is kept")
+    convert_parser.add_argument("-f", "--format", required=True, choices=tuple(OUTPUT_FORMATS),
+                                help="keyframe type of written .anm files or ska")
+    convert_parser.add_argument("--rw-version", type=parse_rw_version,
+                                help="RW version of written .anm files, e.g. 3.5.0.1 (default: version of the input)")
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    files = find_animation_files(args.paths)
+    filepaths = [filepath for filepath, _ in files]
+
+    if args.command == "info":
+        results = run_file_tasks(inspect_file, filepaths, [()] * len(files), args.workers)
+    else:
+        collisions = find_output_collisions(files)
+        for colliding_filepaths in collisions:
+            print("error: %s would be written to the same output" % ", ".join(colliding_filepaths), file=sys.stderr)
+        if collisions:
+            return 1
+
+        args_list = [(path.join(args.output, rel_path), args.format, args.rw_version) for _, rel_path in files]
+        results = run_file_tasks(convert_file, filepaths, args_list, args.workers)
+
+    failed_num = 0
+    for success, lines in results:
+        failed_num += not success
+        print("\n".join(lines), file=sys.stdout if success else sys.stderr, flush=True)
+
+    print("%d files, %d failed" % (len(files), failed_num), file=sys.stderr)
+    return 1 if failed_num else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,36 +1,113 @@
 import bpy
+import numpy as np
 
-from dataclasses import dataclass
-from mathutils import Matrix, Quaternion, Vector
+from mathutils import Euler
 from os import path
 
-from .types.common import RWAnmChunk, AnmAnimation, AnmKeyframe
+from .math_utils import (
+    find_needed_keys,
+    interpolate_keys,
+    lerp,
+    position_errors,
+    quaternion_multiply,
+    quaternion_normalized,
+    quaternion_slerp,
+    rotation_errors,
+    transform_points,
+)
+from .rest_pose import get_armature_rest_pose
+from .types.common import RWAnmChunk, AnmAnimation, AnmKeyframeArrays, get_rw_keyframe_order
 from .types.anm import Anm, ANM_CHUNK_ID, ANM_ANIMATION_VERSION
 from .types.ska import Ska
 
 
-def basis_to_local_matrix(basis_matrix, global_matrix, parent_matrix):
-    return parent_matrix.inverted() @ global_matrix @ basis_matrix
+# Pose sample layout: location (x, y, z), rotation quaternion (w, x, y, z)
+POSE_SAMPLE_SIZE = 7
 
 
 def is_bone_taged(bone):
     return bone.get('bone_id') is not None
 
 
-@dataclass
-class PoseBoneTransform:
-    pos: Vector
-    rot: Quaternion
+def get_keyframe_times(curve):
+    co = np.empty(len(curve.keyframe_points) * 2, dtype=np.float32)
+    curve.keyframe_points.foreach_get('co', co)
+    return co[0::2]
 
-    def lerp(self, trans, factor):
-        return PoseBoneTransform(self.pos.lerp(trans.pos, factor), self.rot.slerp(trans.rot, factor))
+
+def get_sample_frames(times_map):
+    """Map each integer frame used to interpolate the keyframe times to the bones it is needed for"""
+    frames_map = {}
+    for time, bids in times_map.items():
+        for frame in (int(time), int(time + 1)):
+            if frame not in frames_map:
+                frames_map[frame] = set()
+            frames_map[frame].update(bids)
+    return frames_map
+
+
+def get_pose_bone_sample(pose_bone, pos, rot_quaternion, rot_euler):
+    if pose_bone.rotation_mode == 'QUATERNION':
+        rot = rot_quaternion
+    else:
+        rot = Euler(rot_euler, pose_bone.rotation_euler.order).to_quaternion()
+    return (*pos, *rot)
+
+
+def sample_scene_poses(context, arm_obj, frames, frames_map, samples):
+    old_frame = context.scene.frame_current
+
+    for frame_idx, frame in enumerate(frames):
+        context.scene.frame_set(frame)
+        context.view_layer.update()
+        for b in frames_map[frame]:
+            pose_bone = arm_obj.pose.bones[b]
+            samples[frame_idx, b] = get_pose_bone_sample(
+                pose_bone, pose_bone.location, pose_bone.rotation_quaternion, pose_bone.rotation_euler)
+
+    context.scene.frame_set(old_frame)
+
+
+def can_evaluate_fcurves(arm_obj, act):
+    """Check that pose channels at a frame are exactly the action curve values,
+    so they can be evaluated without setting the scene frame"""
+    animation_data = arm_obj.animation_data
+    if animation_data.drivers:
+        return False
+    if animation_data.use_nla and any(not track.mute for track in animation_data.nla_tracks):
+        return False
+    if getattr(animation_data, 'action_influence', 1.0) != 1.0:
+        return False
+    if getattr(animation_data, 'action_blend_type', 'REPLACE') != 'REPLACE':
+        return False
+    return not any(curve.mute or (curve.group and curve.group.mute) for curve in act.fcurves)
+
+
+def sample_fcurve_poses(arm_obj, act, frames, frames_map, samples):
+    curves = {(curve.data_path, curve.array_index): curve for curve in act.fcurves}
+
+    def evaluate_channels(pose_bone, prop, frame):
+        data_path = pose_bone.path_from_id(prop)
+        values = getattr(pose_bone, prop)
+        return [curves[data_path, i].evaluate(frame) if (data_path, i) in curves else v for i, v in enumerate(values)]
+
+    for frame_idx, frame in enumerate(frames):
+        for b in frames_map[frame]:
+            pose_bone = arm_obj.pose.bones[b]
+            samples[frame_idx, b] = get_pose_bone_sample(
+                pose_bone,
+                evaluate_channels(pose_bone, 'location', frame),
+                evaluate_channels(pose_bone, 'rotation_quaternion', frame),
+                evaluate_channels(pose_bone, 'rotation_euler', frame),
+            )
 
 
-def get_pose_transforms(context, arm_obj, act):
+def get_pose_transforms(context, arm_obj, act, reporter):
     frame_start = context.scene.frame_start
     frame_end = context.scene.frame_end + 1
 
     bone_ids = [b for b, bone in enumerate(arm_obj.data.bones) if is_bone_taged(bone)]
+    tagged_bone_ids = set(bone_ids)
     times_map = {}
     for curve in act.fcurves:
         if 'pose.bones' not in curve.data_path:
@@ -38,13 +115,11 @@ def get_pose_transforms(context, arm_obj, act):
 
         bone_name = curve.data_path.split('"')[1]
         bone_id = arm_obj.data.bones.find(bone_name)
-        if bone_id not in bone_ids:
+        if bone_id not in tagged_bone_ids:
             continue
 
-        for kp in curve.keyframe_points:
-            time = kp.co[0]
-            if not frame_start <= time < frame_end:
-                continue
+        times = get_keyframe_times(curve)
+        for time in times[(frame_start <= times) & (times < frame_end)].tolist():
             if time not in times_map:
                 times_map[time] = set()
             times_map[time].add(bone_id)
@@ -52,80 +127,106 @@ def get_pose_transforms(context, arm_obj, act):
     times_map[min(times_map)] = bone_ids
     times_map[max(times_map)] = bone_ids
 
-    old_frame = context.scene.frame_current
+    frames_map = get_sample_frames(times_map)
+    frames = sorted(frames_map)
+    samples = np.zeros((len(frames), len(arm_obj.data.bones), POSE_SAMPLE_SIZE), dtype=np.float32)
+    samples[:, :, 3] = 1.0
 
-    bone_transforms_map = {}
-    for frame in range(frame_start, frame_end + 1):
-        bone_transforms_map[frame] = {}
-        context.scene.frame_set(frame)
-        context.view_layer.update()
-        for b in bone_ids:
-            pose_bone = arm_obj.pose.bones[b]
-            pos = pose_bone.location.copy()
-            if pose_bone.rotation_mode == 'QUATERNION':
-                rot = pose_bone.rotation_quaternion.copy()
-            else:
-                rot = pose_bone.rotation_euler.to_quaternion()
-            transform = PoseBoneTransform(pos, rot)
-            bone_transforms_map[frame][b] = transform
+    if can_evaluate_fcurves(arm_obj, act):
+        sample_fcurve_poses(arm_obj, act, frames, frames_map, samples)
+        reporter.info("Action %s sampled from F-curves" % act.name)
+    else:
+        sample_scene_poses(context, arm_obj, frames, frames_map, samples)
+        reporter.info("Action %s sampled with scene evaluation (drivers, NLA or muted curves)" % act.name)
 
-    context.scene.frame_set(old_frame)
+    reporter.info("Pose samples of %s: %d frames x %d bones, %.1f MiB" % (
+        act.name, samples.shape[0], samples.shape[1], samples.nbytes / (1 << 20)))
 
-    pose_transforms = []
-    for time, bids in times_map.items():
-        for bone_id in bids:
-            prev_time, next_time = int(time), int(time + 1)
-            prev_transform = bone_transforms_map[prev_time][bone_id]
-            next_transform = bone_transforms_map[next_time][bone_id]
-            pose_transforms.append((bone_id, time, prev_transform.lerp(next_transform, time - prev_time)))
+    times = np.array([time for time, bids in times_map.items() for _ in bids], dtype=np.float64)
+    bone_ids = np.array([b for bids in times_map.values() for b in bids], dtype=np.int64)
 
-    return pose_transforms
+    # Interpolate between the integer frames around each keyframe time
+    prev_frames, next_frames = np.trunc(times), np.trunc(times + 1.0)
+    prev_samples = samples[np.searchsorted(frames, prev_frames), bone_ids]
+    next_samples = samples[np.searchsorted(frames, next_frames), bone_ids]
+    factors = times - prev_frames
 
+    positions = prev_samples[:, :3] + (next_samples[:, :3] - prev_samples[:, :3]) * factors[:, np.newaxis]
+    rotations = quaternion_slerp(prev_samples[:, 3:], next_samples[:, 3:], factors)
 
-def sort_pose_transforms(pose_transforms):
-    sorted_pose_transforms_s1 = sorted(pose_transforms)
-    curr_bone_id = sorted_pose_transforms_s1[0][0]
-    prev_time = sorted_pose_transforms_s1[0][1] - 1.0
+    return times, bone_ids, positions, rotations
 
-    sorted_pose_transforms_s2 = []
-    for bone_id, time, pose_transform in sorted_pose_transforms_s1:
-        if bone_id != curr_bone_id:
-            curr_bone_id = bone_id
-            prev_time = time - 1.0
 
-        sorted_pose_transforms_s2.append((prev_time, bone_id, time, pose_transform))
-        prev_time = time
+def interpolate_pose_keys(a, b, factors):
+    """Interpolate (x, y, z, w, x, y, z) keys the way the game does, linear locations and slerp rotations"""
+    return np.concatenate((lerp(a[:, :3], b[:, :3], factors), quaternion_slerp(a[:, 3:], b[:, 3:], factors)), axis=1)
 
-    sorted_pose_transforms = [(bone_id, time, pose_transform) for _, bone_id, time, pose_transform in sorted(sorted_pose_transforms_s2)]
-    return sorted_pose_transforms
 
+def decimate_pose_transforms(times, bone_ids, positions, rotations, location_tolerance, rotation_tolerance):
+    """Return the mask of keyframes to keep and the largest location and rotation errors of the removed ones.
+    Removed keyframes are reproduced within the tolerances by interpolation between the kept keyframes of their bone"""
+    values = np.concatenate((positions, rotations), axis=1)
 
-def create_anm_animation(context, arm_obj, act, fps, keyframe_type):
-    keyframes = []
-    sorted_pose_transforms = sort_pose_transforms(get_pose_transforms(context, arm_obj, act))
-    duration = 0.0
-    frame_start = context.scene.frame_start
+    # Positive where a channel is out of its tolerance
+    def get_excess(a, b):
+        return np.maximum(position_errors(a[:, :3], b[:, :3]) - location_tolerance,
+                          rotation_errors(a[:, 3:], b[:, 3:]) - rotation_tolerance)
+
+    keep = np.ones(len(times), dtype=bool)
+    max_location_error = max_rotation_error = 0.0
+
+    kf_ids = np.lexsort((times, bone_ids))
+    bone_starts = np.flatnonzero(np.diff(bone_ids[kf_ids], prepend=-1))
+
+    for bone_kf_ids in np.split(kf_ids, bone_starts[1:]):
+        bone_times, bone_values = times[bone_kf_ids], values[bone_kf_ids]
+        bone_keep = find_needed_keys(bone_times, bone_values, 0.0, get_excess, interpolate_pose_keys)
+        keep[bone_kf_ids] = bone_keep
+
+        approx = interpolate_keys(bone_times, bone_values, bone_keep, interpolate_pose_keys)
+        max_location_error = max(max_location_error, float(position_errors(approx[:, :3], bone_values[:, :3]).max()))
+        max_rotation_error = max(max_rotation_error, float(rotation_errors(approx[:, 3:], bone_values[:, 3:]).max()))
+
+    return keep, max_location_error, max_rotation_error
+
+
+def create_anm_animation(context, arm_obj, act, options, reporter):
+    fps = options["fps"]
+    times, bone_ids, positions, rotations = get_pose_transforms(context, arm_obj, act, reporter)
+
+    times = times - context.scene.frame_start
+    duration = max(0.0, float(times.max()))
+
+    rest_pose = get_armature_rest_pose(arm_obj)
+    loc_positions = np.empty_like(positions)
+    loc_rotations = np.empty_like(rotations)
 
-    for bone_id, time, pose_transform in sorted_pose_transforms:
-        bone = arm_obj.data.bones[bone_id]
-        time = time - frame_start
+    kf_ids = np.argsort(bone_ids, kind='stable')
+    bones_used, bone_starts = np.unique(bone_ids[kf_ids], return_index=True)
 
-        rest_mat = bone.matrix_local
-        if bone.parent:
-            parent_mat = bone.parent.matrix_local
-        else:
-            parent_mat = Matrix.Identity(4)
+    for bone_id, bone_kf_ids in zip(bones_used.tolist(), np.split(kf_ids, bone_starts[1:])):
+        bone_rest_pose = rest_pose.bones[bone_id]
+        loc_positions[bone_kf_ids] = transform_points(bone_rest_pose.basis_to_local, positions[bone_kf_ids])
+        loc_rotations[bone_kf_ids] = quaternion_multiply(
+            tuple(bone_rest_pose.local_rot), quaternion_normalized(rotations[bone_kf_ids]))
 
-        basis_mat = Matrix.Translation(pose_transform.pos) @ pose_transform.rot.to_matrix().to_4x4()
-        loc_mat = basis_to_local_matrix(basis_mat, rest_mat, parent_mat)
+    # Keep the non-negative W of Matrix.to_quaternion
+    loc_rotations[loc_rotations[:, 0] < 0.0] *= -1.0
 
-        kf_pos, kf_rot = loc_mat.to_translation(), loc_mat.to_quaternion()
+    if options["decimate"]:
+        keep, max_location_error, max_rotation_error = decimate_pose_transforms(
+            times, bone_ids, loc_positions, loc_rotations, options["location_tolerance"], options["rotation_tolerance"])
+        reporter.info("Action %s decimated to %d of %d keyframes (%.1f%%), max error %.6f location, %.4f degrees rotation" % (
+            act.name, np.count_nonzero(keep), len(keep), np.count_nonzero(keep) * 100.0 / len(keep),
+            max_location_error, np.degrees(max_rotation_error)))
+        times, bone_ids, loc_positions, loc_rotations = times[keep], bone_ids[keep], loc_positions[keep], loc_rotations[keep]
 
-        keyframes.append(AnmKeyframe(time / fps, bone_id, kf_pos, kf_rot))
-        if time > duration:
-            duration = time
+    # Removed keyframes change the previous keyframes the order depends on, so it is computed last
+    order = get_rw_keyframe_order(times, bone_ids)
+    times, bone_ids, loc_positions, loc_rotations = times[order], bone_ids[order], loc_positions[order], loc_rotations[order]
 
-    return AnmAnimation(ANM_ANIMATION_VERSION, keyframe_type, 0, duration / fps, keyframes)
+    keyframes = AnmKeyframeArrays.from_columns(times / fps, bone_ids, loc_positions, loc_rotations)
+    return AnmAnimation(ANM_ANIMATION_VERSION, options["keyframe_type"], 0, duration / fps, keyframes)
 
 
 def save(context, filepath, options, reporter):
@@ -147,7 +248,7 @@ def save(context, filepath, options, reporter):
         reporter.error("No tagged bones in armature. To export animation, you must first import the dff model or set 'bone_id' property")
         return {'CANCELLED'}
 
-    anm_animation = create_anm_animation(context, arm_obj, act, options["fps"], options["keyframe_type"])
+    anm_animation = create_anm_animation(context, arm_obj, act, options, reporter)
 
     ext = path.splitext(filepath)[-1].lower()
     if ext == ".ska":
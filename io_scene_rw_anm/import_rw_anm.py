@@ -1,28 +1,57 @@
 import bpy
+import numpy as np
 
-from mathutils import Matrix
 from os import path
 
-from .types.anm import Anm, AnmAnimation
-from .types.ska import Ska
-from .types.tmo import Tmo
+from .math_utils import (
+    find_needed_keys,
+    make_quaternions_continuous,
+    position_errors,
+    quaternion_multiply,
+    rotation_errors,
+    transform_points,
+)
+from .rest_pose import get_armature_rest_pose
+from .parse_cache import ParseCache
+from .parse_rw_anm import read_rw_animations_files
+from .types.common import AnmAnimation
 
 POSEDATA_PREFIX = 'pose.bones["%s"].'
+LINEAR_INTERPOLATION = bpy.types.Keyframe.bl_rna.properties['interpolation'].enum_items['LINEAR'].value
 
 
-def set_keyframe(curves, frame, values):
+def set_keyframes(curves, frames, values):
+    keyframes_num = len(frames)
+    values = np.asarray(values, dtype=np.float32)
+    co = np.empty((keyframes_num, 2), dtype=np.float32)
+    co[:, 0] = frames
+    interpolation = [LINEAR_INTERPOLATION] * keyframes_num
+
     for i, c in enumerate(curves):
-        c.keyframe_points.add(1)
-        c.keyframe_points[-1].co = frame, values[i]
-        c.keyframe_points[-1].interpolation = 'LINEAR'
+        co[:, 1] = values[:, i]
+        c.keyframe_points.add(keyframes_num)
+        c.keyframe_points.foreach_set('co', co.ravel())
+        c.keyframe_points.foreach_set('interpolation', interpolation)
 
 
-def translation_matrix(v):
-    return Matrix.Translation(v)
+def create_bone_curves(act, arm_obj, pos_bones, rot_bones):
+    """Create grouped location curves of pos_bones and rotation curves of rot_bones, in the order of bones"""
+    curves_loc, curves_rot = {}, {}
 
+    for bone_id, bone in enumerate(arm_obj.data.bones):
+        if bone_id not in pos_bones and bone_id not in rot_bones:
+            continue
 
-def local_to_basis_matrix(local_matrix, global_matrix, parent_matrix):
-    return global_matrix.inverted() @ (parent_matrix @ local_matrix)
+        g = act.groups.new(name=bone.name)
+        if bone_id in pos_bones:
+            curves_loc[bone_id] = [act.fcurves.new(data_path=(POSEDATA_PREFIX % bone.name) + 'location', index=i) for i in range(3)]
+        if bone_id in rot_bones:
+            curves_rot[bone_id] = [act.fcurves.new(data_path=(POSEDATA_PREFIX % bone.name) + 'rotation_quaternion', index=i) for i in range(4)]
+
+        for c in curves_loc.get(bone_id, []) + curves_rot.get(bone_id, []):
+            c.group = g
+
+    return curves_loc, curves_rot
 
 
 def create_action(act_name, arm_obj, rw_animation: AnmAnimation, options, reporter):
@@ -30,88 +59,81 @@ def create_action(act_name, arm_obj, rw_animation: AnmAnimation, options, report
     location_scale = options["location_scale"]
 
     act = bpy.data.actions.new(act_name)
-    curves_loc, curves_rot = [], []
-    prev_rots = {}
-    bones_map = {}
+    rest_pose = get_armature_rest_pose(arm_obj)
+    bones_num = len(arm_obj.data.bones)
 
     missing_bones = set()
     need_bones_num = 0
 
-    for bone_id, bone in enumerate(arm_obj.data.bones):
-        g = act.groups.new(name=bone.name)
-        cl = [act.fcurves.new(data_path=(POSEDATA_PREFIX % bone.name) + 'location', index=i) for i in range(3)]
-        cr = [act.fcurves.new(data_path=(POSEDATA_PREFIX % bone.name) + 'rotation_quaternion', index=i) for i in range(4)]
+    arrays = rw_animation.arrays
+    if rw_animation.is_indexed_bones():
+        bone_ids = arrays.bone_ids.astype(np.int64)
+        if len(bone_ids) and bone_ids.max() >= bones_num:
+            need_bones_num = int(bone_ids.max()) + 1 - bones_num
+            bone_ids[bone_ids >= bones_num] = -1
+    else:
+        bone_ids = np.array([rest_pose.bones_map.get(b, -1) for b in arrays.bone_ids.tolist()], dtype=np.int64)
+        missing_bones.update(arrays.bone_ids[bone_ids < 0].tolist())
 
-        for c in cl + cr:
-            c.group = g
+    if options["animated_bones_only"]:
+        # Channels of bones with at least one position or rotation keyframe
+        pos_bones = set(np.unique(bone_ids[arrays.has_pos & (bone_ids >= 0)]).tolist())
+        rot_bones = set(np.unique(bone_ids[arrays.has_rot & (bone_ids >= 0)]).tolist())
+    else:
+        pos_bones = rot_bones = set(range(bones_num))
+
+    curves_loc, curves_rot = create_bone_curves(act, arm_obj, pos_bones, rot_bones)
 
-        curves_loc.append(cl)
-        curves_rot.append(cr)
+    if options["animated_bones_only"]:
+        reporter.info("Action %s animates %d of %d bones, %d F-curves" % (
+            act.name, len(pos_bones | rot_bones), bones_num, len(pos_bones) * 3 + len(rot_bones) * 4))
 
-        pose_bone = arm_obj.pose.bones[bone.name]
+    for pose_bone in arm_obj.pose.bones:
         pose_bone.rotation_mode = 'QUATERNION'
         pose_bone.location = (0, 0, 0)
         pose_bone.rotation_quaternion = (1, 0, 0, 0)
 
-        prev_rots[bone] = None
+    frames = arrays.times.astype(np.float64) * fps
 
-        bone_tag = bone.get("bone_id")
-        if bone_tag is not None:
-            bones_map[bone_tag] = bone_id
+    removed_keys_num = 0
 
-    for kf in rw_animation.keyframes:
+    # Keyframes of each bone keep their order from the file
+    kf_ids = np.argsort(bone_ids, kind='stable')
+    bones_used, bone_starts = np.unique(bone_ids[kf_ids], return_index=True)
 
-        if kf.is_indexed_bones():
-            bone_id = kf.bone_id
-            if bone_id >= len(arm_obj.data.bones):
-                need_bones_num = max(need_bones_num, bone_id + 1 - len(arm_obj.data.bones))
-                continue
+    for bone_id, bone_kf_ids in zip(bones_used.tolist(), np.split(kf_ids, bone_starts[1:])):
+        if bone_id < 0:
+            continue
 
-        else:
-            bone_id = bones_map.get(kf.bone_id)
-            if bone_id is None:
-                missing_bones.add(kf.bone_id)
-                continue
-
-        bone = arm_obj.data.bones[bone_id]
-        frame = kf.time * fps
-        pos, rot = None, None
-
-        if not kf.is_pose_space():
-            rest_mat = bone.matrix_local
-            if bone.parent:
-                parent_mat = bone.parent.matrix_local
-                local_rot = (parent_mat.inverted_safe() @ rest_mat).to_quaternion()
-            else:
-                parent_mat = Matrix.Identity(4)
-                local_rot = rest_mat.to_quaternion()
-
-            if kf.pos is not None:
-                mat = translation_matrix(kf.pos)
-                mat_basis = local_to_basis_matrix(mat, rest_mat, parent_mat)
-                pos = mat_basis.to_translation()
-
-            if kf.rot is not None:
-                rot = local_rot.rotation_difference(kf.rot)
+        pos_ids = bone_kf_ids[arrays.has_pos[bone_kf_ids]]
+        rot_ids = bone_kf_ids[arrays.has_rot[bone_kf_ids]]
 
+        if rw_animation.is_pose_space():
+            pos = arrays.pos[pos_ids] * location_scale
+            rot = arrays.rot[rot_ids]
         else:
-            pos = kf.pos * location_scale
-            rot = kf.rot
+            bone_rest_pose = rest_pose.bones[bone_id]
+            pos = transform_points(bone_rest_pose.local_to_basis, arrays.pos[pos_ids])
+            rot = quaternion_multiply(bone_rest_pose.local_rot_inverted, arrays.rot[rot_ids])
+
+        # Correction opposite direction of rotation
+        rot = make_quaternions_continuous(rot)
 
-        if pos is not None:
-            set_keyframe(curves_loc[bone_id], frame, pos)
+        if options["remove_redundant_keys"]:
+            pos_keep = find_needed_keys(frames[pos_ids], pos, options["location_tolerance"], position_errors)
+            rot_keep = find_needed_keys(frames[rot_ids], rot, options["rotation_tolerance"], rotation_errors)
+            removed_keys_num += len(pos_ids) + len(rot_ids) - np.count_nonzero(pos_keep) - np.count_nonzero(rot_keep)
+            pos_ids, pos = pos_ids[pos_keep], pos[pos_keep]
+            rot_ids, rot = rot_ids[rot_keep], rot[rot_keep]
 
-        if rot is not None:
-            # Correction opposite direction of rotation
-            prev_rot = prev_rots[bone]
-            if prev_rot:
-                alt_rot = rot.copy()
-                alt_rot.negate()
-                if rot.rotation_difference(prev_rot).angle > alt_rot.rotation_difference(prev_rot).angle:
-                    rot = alt_rot
-            prev_rots[bone] = rot
+        if len(pos_ids):
+            set_keyframes(curves_loc[bone_id], frames[pos_ids], pos)
+        if len(rot_ids):
+            set_keyframes(curves_rot[bone_id], frames[rot_ids], rot)
 
-            set_keyframe(curves_rot[bone_id], frame, rot)
+    if options["remove_redundant_keys"]:
+        reporter.info("Removed %d of %d redundant keys from action %s" % (
+            removed_keys_num, np.count_nonzero(arrays.has_pos) + np.count_nonzero(arrays.has_rot), act.name))
 
     if need_bones_num:
         reporter.warning("The armature is missing %d bones for action" % need_bones_num, act.name)
@@ -122,49 +144,8 @@ def create_action(act_name, arm_obj, rw_animation: AnmAnimation, options, report
     return act
 
 
-def load(context, filepath, options, reporter):
-    arm_obj = context.view_layer.objects.active
-    if not arm_obj or type(arm_obj.data) != bpy.types.Armature:
-        return
-
-    rw_animations = []
-    rw_version = None
-
-    ext = path.splitext(filepath)[-1].lower()
-    if ext == ".ska":
-        ska = Ska.load(filepath)
-        rw_animations = [ska.animation]
-        rw_version = None
-
-    elif ext == ".tmo":
-        tmo = Tmo.load(filepath)
-        if tmo.chunks:
-            rw_animations = [chunk.animation for chunk in tmo.chunks]
-            rw_version = tmo.chunks[0].version
-
-    else:
-        anm = Anm.load(filepath)
-        if anm.chunks:
-            chunk_idx, chunks_num = 0, len(anm.chunks)
-            while chunk_idx < chunks_num:
-                next_chunk_idx = chunk_idx + 1
-                rw_anim = anm.chunks[chunk_idx].animation
-
-                if next_chunk_idx < chunks_num:
-                    next_rw_anim = anm.chunks[next_chunk_idx].animation
-
-                    if rw_anim.is_mergable_with(next_rw_anim):
-                        rw_anim.merge_with(next_rw_anim)
-                        next_chunk_idx += 1
-
-                rw_animations.append(rw_anim)
-                chunk_idx = next_chunk_idx
-
-            rw_version = anm.chunks[0].version
-
-    if not rw_animations:
-        return
-
+def create_actions(context, arm_obj, filepath, rw_animations, rw_version, options, reporter):
+    """Create an action for each animation of the iterable rw_animations as it is reached"""
     animation_data = arm_obj.animation_data
     if not animation_data:
         animation_data = arm_obj.animation_data_create()
@@ -172,14 +153,53 @@ def load(context, filepath, options, reporter):
     bpy.ops.object.mode_set(mode='POSE')
 
     context.scene.frame_start = 0
-    for anim in rw_animations:
-        act = create_action(path.basename(filepath), arm_obj, anim, options, reporter)
-        animation_data.action = act
-        context.scene.frame_end = int(anim.duration * options["fps"])
+    try:
+        for anim in rw_animations:
+            act = create_action(path.basename(filepath), arm_obj, anim, options, reporter)
+            animation_data.action = act
+            context.scene.frame_end = int(anim.duration * options["fps"])
+
+            if rw_version is not None:
+                act['dragonff_rw_version'] = rw_version
 
-        if rw_version is not None:
-            act['dragonff_rw_version'] = rw_version
+            reporter.imported_actions_num += 1
+    finally:
+        bpy.ops.object.mode_set(mode='OBJECT')
 
-    bpy.ops.object.mode_set(mode='OBJECT')
 
-    reporter.imported_actions_num += len(rw_animations)
+def load(context, filepaths, options, reporter):
+    arm_obj = context.view_layer.objects.active
+    if not arm_obj or type(arm_obj.data) != bpy.types.Armature:
+        return
+
+    cache = ParseCache(max_size=options["cache_size"] << 20) if options["use_cache"] else None
+    cache_hits_num = cache_misses_num = 0
+
+    # Files are parsed in worker processes, actions are created here as parsed files arrive
+    parsed_files = read_rw_animations_files(filepaths, options["chunks"], options["workers"], cache, options["streaming"])
+    for filepath, result, error, cached in parsed_files:
+        if cached:
+            cache_hits_num += 1
+        else:
+            cache_misses_num += 1
+
+        if error:
+            reporter.error("Failed to read %s: %s" % (path.basename(filepath), error))
+            continue
+
+        rw_animations, rw_version = result
+        if not rw_animations:
+            continue
+
+        try:
+            create_actions(context, arm_obj, filepath, rw_animations, rw_version, options, reporter)
+        except Exception as e:
+            # Streamed files are decoded while their actions are created
+            reporter.error("Failed to import %s: %s" % (path.basename(filepath), e))
+        finally:
+            # Streamed animations keep their file mapped until the iterator is closed
+            if hasattr(rw_animations, "close"):
+                rw_animations.close()
+
+    if cache:
+        reporter.info("Parse cache: %d hits, %d misses" % (cache_hits_num, cache_misses_num))
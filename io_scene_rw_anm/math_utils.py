@@ -0,0 +1,123 @@
+import numpy as np
+
+# Quaternion arrays are stored as (w, x, y, z) in the last axis
+
+
+def quaternion_multiply(a, b):
+    aw, ax, ay, az = np.moveaxis(np.asarray(a, dtype=np.float64), -1, 0)
+    bw, bx, by, bz = np.moveaxis(np.asarray(b, dtype=np.float64), -1, 0)
+    return np.stack((
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+    ), axis=-1)
+
+
+def quaternion_inverted(q):
+    q = np.asarray(q, dtype=np.float64)
+    return q * np.array((1.0, -1.0, -1.0, -1.0)) / np.sum(q * q, axis=-1, keepdims=True)
+
+
+def transform_points(matrix, points):
+    matrix = np.asarray(matrix, dtype=np.float64)
+    return np.asarray(points, dtype=np.float64) @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+def make_quaternions_continuous(quats):
+    """Flip signs so that each quaternion is in the same hemisphere as the previous one"""
+    quats = np.array(quats, dtype=np.float64)
+    if len(quats) > 1:
+        dots = np.einsum('ij,ij->i', quats[1:], quats[:-1])
+        quats[1:] *= np.cumprod(np.where(dots < 0.0, -1.0, 1.0))[:, np.newaxis]
+    return quats
+
+
+def quaternion_normalized(q):
+    q = np.asarray(q, dtype=np.float64)
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def quaternion_slerp(a, b, factors):
+    """Interpolate quaternions the same way as mathutils Quaternion.slerp"""
+    a = np.array(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    factors = np.asarray(factors, dtype=np.float64)
+
+    # Rotate around shortest angle
+    cosom = np.einsum('ij,ij->i', a, b)
+    flip = cosom < 0.0
+    a[flip] *= -1.0
+    cosom = np.abs(cosom)
+
+    # Fall back to linear interpolation for nearly aligned quaternions
+    w0, w1 = 1.0 - factors, factors.copy()
+    spherical = cosom < 1.0 - 1e-4
+    omega = np.arccos(cosom[spherical])
+    sinom = np.sin(omega)
+    w0[spherical] = np.sin(w0[spherical] * omega) / sinom
+    w1[spherical] = np.sin(w1[spherical] * omega) / sinom
+
+    return a * w0[:, np.newaxis] + b * w1[:, np.newaxis]
+
+
+def position_errors(a, b):
+    return np.linalg.norm(np.asarray(a, dtype=np.float64) - b, axis=-1)
+
+
+def rotation_errors(a, b):
+    """Angles between quaternions after normalization, q and -q are the same rotation"""
+    dots = np.einsum('ij,ij->i', quaternion_normalized(a), quaternion_normalized(b))
+    return 2.0 * np.arccos(np.clip(np.abs(dots), 0.0, 1.0))
+
+
+def lerp(a, b, factors):
+    return a + (b - a) * factors[:, np.newaxis]
+
+
+def interpolate_keys(times, values, keep, interpolate_func=lerp):
+    """Interpolate every key from the kept keys around it, kept keys keep their values"""
+    kept_ids = np.flatnonzero(keep)
+    next_ids = kept_ids[np.clip(np.searchsorted(kept_ids, np.arange(len(times))), 0, len(kept_ids) - 1)]
+    prev_ids = kept_ids[np.clip(np.searchsorted(kept_ids, np.arange(len(times)), side='right') - 1, 0, len(kept_ids) - 1)]
+
+    spans = times[next_ids] - times[prev_ids]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factors = np.where(spans > 0.0, (times - times[prev_ids]) / spans, 0.0)
+    return interpolate_func(values[prev_ids], values[next_ids], factors)
+
+
+def find_needed_keys(times, values, tolerance, errors_func, interpolate_func=lerp):
+    """Return the mask of keys to keep so that interpolation between the kept keys, linear by default,
+    reproduces every removed key within tolerance. Keys reproduced by their neighbours are dropped,
+    then the worst dropped key of each span that is out of tolerance is restored until all of them fit.
+    The first and last key and keys at repeated times are always kept"""
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    keys_num = len(times)
+
+    keep = np.ones(keys_num, dtype=bool)
+    if keys_num > 2:
+        spans = times[2:] - times[:-2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factors = np.where(spans > 0.0, (times[1:-1] - times[:-2]) / spans, 0.0)
+        approx = interpolate_func(values[:-2], values[2:], factors)
+        keep[1:-1] = ~(spans > 0.0) | ~(errors_func(approx, values[1:-1]) <= tolerance)
+
+        # Keys sharing their time with a neighbour form steps, all of them are kept
+        repeated = np.diff(times) == 0.0
+        keep[1:] |= repeated
+        keep[:-1] |= repeated
+
+    key_ids = np.arange(keys_num)
+    while True:
+        errors = errors_func(interpolate_keys(times, values, keep, interpolate_func), values)
+        violated = np.flatnonzero(~keep & ~(errors <= tolerance))
+        if not len(violated):
+            return keep
+
+        # Spans are identified by their first kept key
+        span_ids = np.maximum.accumulate(np.where(keep, key_ids, 0))[violated]
+        order = np.lexsort((-errors[violated], span_ids))
+        violated, span_ids = violated[order], span_ids[order]
+        keep[violated[np.diff(span_ids, prepend=-1) != 0]] = True
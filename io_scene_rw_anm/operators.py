@@ -0,0 +1,419 @@
+import bpy
+from bpy.props import (
+        BoolProperty,
+        CollectionProperty,
+        EnumProperty,
+        FloatProperty,
+        IntProperty,
+        StringProperty,
+        )
+from bpy_extras.io_utils import (
+        ImportHelper,
+        ExportHelper,
+        )
+from pathlib import Path
+from .reporter import Reporter
+from .types.common import unpack_rw_lib_id, pack_rw_lib_id
+
+
+class ImportRenderWareAnm(bpy.types.Operator, ImportHelper):
+    bl_idname = "import_scene.renderware_anm"
+    bl_label = "Import RenderWare Animation"
+    bl_options = {'PRESET', 'UNDO'}
+
+    filter_glob: StringProperty(default="*.*anm;*.ska;*.tmo", options={'HIDDEN'})
+    filename_ext = ".anm"
+
+    fps: FloatProperty(
+        name="FPS",
+        description="Value by which the keyframe time is multiplied",
+        default=30.0,
+    )
+
+    location_scale: FloatProperty(
+        name="Location Scale",
+        description="Bone location vector multiplier",
+        default=8.0,
+        step=100.0,
+        min=0.0,
+    )
+
+    chunks: StringProperty(
+        name="Chunks",
+        description="Indices of chunks to import from multi-chunk files, e.g. \"0, 2-4\". Leave empty to import all",
+        default="",
+    )
+
+    workers: IntProperty(
+        name="Workers",
+        description="Number of processes reading the selected files, or the chunks of a single file. "
+                    "0 uses all CPU cores. Small imports are read without extra processes",
+        default=1,
+        min=0,
+    )
+
+    animated_bones_only: BoolProperty(
+        name="Animated Bones Only",
+        description="Create F-curves only for the bones and channels that have keyframes in the animation",
+        default=False,
+    )
+
+    remove_redundant_keys: BoolProperty(
+        name="Remove Redundant Keys",
+        description="Skip keys that linear interpolation between the remaining keys reproduces within the tolerances",
+        default=False,
+    )
+
+    location_tolerance: FloatProperty(
+        name="Location Tolerance",
+        description="Largest location error of a removed key",
+        default=0.0001,
+        min=0.0,
+        precision=5,
+        subtype='DISTANCE',
+    )
+
+    rotation_tolerance: FloatProperty(
+        name="Rotation Tolerance",
+        description="Largest rotation angle error of a removed key",
+        default=0.001,
+        min=0.0,
+        precision=4,
+        subtype='ANGLE',
+    )
+
+    streaming: BoolProperty(
+        name="Stream Chunks",
+        description="Read files one by one and create the action of each chunk before the next is decoded, "
+                    "so only a few chunks of a large bank are in memory at a time",
+        default=False,
+    )
+
+    use_cache: BoolProperty(
+        name="Use Parse Cache",
+        description="Keep parsed files on disk and reuse them until a file changes",
+        default=False,
+    )
+
+    cache_size: IntProperty(
+        name="Cache Size (MiB)",
+        description="Size above which the least recently used files are removed from the parse cache",
+        default=512,
+        min=1,
+    )
+
+    files: CollectionProperty(type=bpy.types.PropertyGroup)
+
+    def draw(self, context):
+        layout = self.layout
+
+        layout.prop(self, "fps")
+        layout.prop(self, "chunks")
+        layout.prop(self, "animated_bones_only")
+        layout.prop(self, "remove_redundant_keys")
+        col = layout.column()
+        col.enabled = self.remove_redundant_keys
+        col.prop(self, "location_tolerance")
+        col.prop(self, "rotation_tolerance")
+        layout.prop(self, "workers")
+        layout.prop(self, "streaming")
+        layout.prop(self, "use_cache")
+        row = layout.row()
+        row.enabled = self.use_cache
+        row.prop(self, "cache_size")
+        layout.separator()
+
+        box = layout.box()
+        box.label(text="8ing")
+        box.prop(self, "location_scale")
+
+    def execute(self, context):
+        from . import import_rw_anm
+        from .parse_rw_anm import parse_chunk_indices
+
+        reporter = Reporter("Import Report")
+
+        options = {
+            "fps": self.fps,
+            "location_scale": self.location_scale,
+            "chunks": self.chunks,
+            "animated_bones_only": self.animated_bones_only,
+            "remove_redundant_keys": self.remove_redundant_keys,
+            "location_tolerance": self.location_tolerance,
+            "rotation_tolerance": self.rotation_tolerance,
+            "workers": self.workers,
+            "streaming": self.streaming,
+            "use_cache": self.use_cache,
+            "cache_size": self.cache_size,
+        }
+
+        arm_obj = context.view_layer.objects.active
+        if not arm_obj or type(arm_obj.data) != bpy.types.Armature:
+            reporter.error("You need to select the armature to import animation")
+            reporter.show()
+            return {'CANCELLED'}
+
+        try:
+            parse_chunk_indices(self.chunks)
+        except ValueError:
+            reporter.error("Invalid chunk selection:", self.chunks)
+            reporter.show()
+            return {'CANCELLED'}
+
+        files_dir = Path(self.filepath)
+        file_paths = []
+        for selection in self.files:
+            file_path = Path(files_dir.parent, selection.name)
+            file_ext = file_path.suffix.lower()
+            if file_ext in (".ska", ".tmo") or file_ext[-3:] == "anm":
+                file_paths.append(file_path)
+
+        import_rw_anm.load(context, file_paths, options, reporter)
+
+        reporter.show()
+        return {'FINISHED'}
+
+
+class ExportRenderWareAnm(bpy.types.Operator, ExportHelper):
+    bl_idname = "export_scene.renderware_anm"
+    bl_label = "Export RenderWare Animation (.anm)"
+    bl_options = {'PRESET'}
+
+    filter_glob: StringProperty(default="*.anm", options={'HIDDEN'})
+    filename_ext = ".anm"
+
+    export_version: StringProperty(
+        maxlen=7,
+        default="3.5.0.1",
+        name="Version Export"
+    )
+
+    keyframe_type: EnumProperty(
+        name="Keyframe Type",
+        items=(
+            ("0x0001", "Uncompressed", "Uncompressed"),
+            ("0x0002", "Compressed", "Compressed"),
+            ("0x0100", "TM Compressed Rotations (rotanm)", "TM Compressed Rotations (0x100)"),
+            ("0x1103", "Climax", "Climax (0x1103)"),
+        )
+    )
+
+    fps: FloatProperty(
+        name="FPS",
+        description="Value by which the keyframe time is divided",
+        default=30.0,
+    )
+
+    decimate: BoolProperty(
+        name="Decimate",
+        description="Remove keyframes that interpolation between the remaining keyframes reproduces within the tolerances",
+        default=False,
+    )
+
+    location_tolerance: FloatProperty(
+        name="Location Tolerance",
+        description="Largest location error of a removed keyframe",
+        default=0.0001,
+        min=0.0,
+        precision=5,
+        subtype='DISTANCE',
+    )
+
+    rotation_tolerance: FloatProperty(
+        name="Rotation Tolerance",
+        description="Largest rotation angle error of a removed keyframe",
+        default=0.001,
+        min=0.0,
+        precision=4,
+        subtype='ANGLE',
+    )
+
+    def draw(self, context):
+        layout = self.layout
+        col = layout.column()
+        col.alignment = 'CENTER'
+
+        col.alert = not self.verify_rw_version()
+        icon = "ERROR" if col.alert else "NONE"
+        col.prop(self, "export_version", icon=icon)
+
+        col = layout.column()
+        col.alignment = 'CENTER'
+        col.prop(self, "keyframe_type")
+        col.prop(self, "fps")
+
+        col = layout.column()
+        col.prop(self, "decimate")
+        sub = col.column()
+        sub.enabled = self.decimate
+        sub.prop(self, "location_tolerance")
+        sub.prop(self, "rotation_tolerance")
+
+    def execute(self, context):
+        from . import export_rw_anm
+
+        reporter = Reporter("Export Report")
+
+        if not self.verify_rw_version():
+            self.report({"ERROR_INVALID_INPUT"}, "Invalid RW Version")
+            return {'CANCELLED'}
+
+        options = {
+            "fps": self.fps,
+            "rw_version": self.get_selected_rw_version(),
+            "keyframe_type": int(self.keyframe_type, 16),
+            "decimate": self.decimate,
+            "location_tolerance": self.location_tolerance,
+            "rotation_tolerance": self.rotation_tolerance,
+        }
+
+        res = export_rw_anm.save(context, self.filepath, options, reporter)
+        reporter.show()
+        return res
+
+    def invoke(self, context, event):
+        arm_obj = context.view_layer.objects.active
+        if arm_obj and type(arm_obj.data) == bpy.types.Armature:
+            animation_data = arm_obj.animation_data
+            if animation_data and animation_data.action and 'dragonff_rw_version' in animation_data.action:
+                rw_version = animation_data.action['dragonff_rw_version']
+                self.export_version = '%x.%x.%x.%x' % unpack_rw_lib_id(rw_version)
+
+        if not self.filepath:
+            if context.blend_data.filepath:
+                self.filepath = context.blend_data.filepath
+            else:
+                self.filepath = "untitled"
+
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def verify_rw_version(self):
+        if len(self.export_version) != 7:
+            return False
+
+        for i, c in enumerate(self.export_version):
+            if i % 2 == 0 and not c.isdigit():
+                return False
+            if i % 2 == 1 and not c == '.':
+                return False
+
+        return True
+
+    def get_selected_rw_version(self):
+        ver = self.export_version
+        return pack_rw_lib_id(*map(lambda c: int('0x%c' % c, 0), (ver[0], ver[2], ver[4], ver[6])))
+
+
+class ExportRenderWareSka(bpy.types.Operator, ExportHelper):
+    bl_idname = "export_scene.renderware_ska"
+    bl_label = "Export RenderWare Animation (.ska)"
+    bl_options = {'PRESET'}
+
+    filter_glob: StringProperty(default="*.ska", options={'HIDDEN'})
+    filename_ext = ".ska"
+
+    fps: FloatProperty(
+        name="FPS",
+        description="Value by which the keyframe time is divided",
+        default=30.0,
+    )
+
+    decimate: BoolProperty(
+        name="Decimate",
+        description="Remove keyframes that interpolation between the remaining keyframes reproduces within the tolerances",
+        default=False,
+    )
+
+    location_tolerance: FloatProperty(
+        name="Location Tolerance",
+        description="Largest location error of a removed keyframe",
+        default=0.0001,
+        min=0.0,
+        precision=5,
+        subtype='DISTANCE',
+    )
+
+    rotation_tolerance: FloatProperty(
+        name="Rotation Tolerance",
+        description="Largest rotation angle error of a removed keyframe",
+        default=0.001,
+        min=0.0,
+        precision=4,
+        subtype='ANGLE',
+    )
+
+    def draw(self, context):
+        layout = self.layout
+        col = layout.column()
+        col.alignment = 'CENTER'
+        col.prop(self, "keyframe_type")
+        col.prop(self, "fps")
+
+        col = layout.column()
+        col.prop(self, "decimate")
+        sub = col.column()
+        sub.enabled = self.decimate
+        sub.prop(self, "location_tolerance")
+        sub.prop(self, "rotation_tolerance")
+
+    def execute(self, context):
+        from . import export_rw_anm
+
+        reporter = Reporter("Export Report")
+
+        options = {
+            "fps": self.fps,
+            "rw_version": 0,
+            "keyframe_type": 0,
+            "decimate": self.decimate,
+            "location_tolerance": self.location_tolerance,
+            "rotation_tolerance": self.rotation_tolerance,
+        }
+
+        res = export_rw_anm.save(context, self.filepath, options, reporter)
+        reporter.show()
+        return res
+
+
+class OBJECT_MT_RWAnimExportChoice(bpy.types.Menu):
+    bl_label = "RenderWare Animation (.anm, .ska)"
+
+    def draw(self, context):
+            self.layout.operator(ExportRenderWareAnm.bl_idname,
+                                text="RenderWare Animation (.anm)")
+            self.layout.operator(ExportRenderWareSka.bl_idname,
+                                text="RenderWare Animation (.ska)")
+
+
+def menu_func_import(self, context):
+    self.layout.operator(ImportRenderWareAnm.bl_idname,
+                         text="RenderWare Animation (.anm, .ska, .tmo)")
+
+
+def menu_func_export(self, context):
+    self.layout.menu("OBJECT_MT_RWAnimExportChoice", text=OBJECT_MT_RWAnimExportChoice.bl_label)
+
+
+classes = (
+    ImportRenderWareAnm,
+    ExportRenderWareAnm,
+    ExportRenderWareSka,
+    OBJECT_MT_RWAnimExportChoice,
+)
+
+
+def register():
+    for cls in classes:
+        bpy.utils.register_class(cls)
+
+    bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
+    bpy.types.TOPBAR_MT_file_export.append(menu_func_export)
+
+
+def unregister():
+    bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
+    bpy.types.TOPBAR_MT_file_export.remove(menu_func_export)
+
+    for cls in classes:
+        bpy.utils.unregister_class(cls)
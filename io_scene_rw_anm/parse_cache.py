@@ -0,0 +1,176 @@
+import hashlib
+import mmap
+import numpy as np
+import os
+import struct
+import sys
+
+from os import path
+from typing import List, Optional, Tuple
+
+from .types.binary_utils import BinaryReader, BinaryWriter, write_array
+from .types.common import AnmAnimation, AnmKeyframe, AnmKeyframeArrays
+from .types.vendors.eighting import Anm8ingKeyframe
+
+CACHE_MAGIC = b'RWAC'
+CACHE_FORMAT_VERSION = 1
+CACHE_FILE_EXT = ".rwac"
+
+# magic, format version, RW version (-1 for none), animations number
+CACHE_HEADER_STRUCT = struct.Struct('<4sIqI')
+# version, keyframe type, flags, duration, keyframes number, keyframe class
+CACHE_ANIMATION_STRUCT = struct.Struct('<IIIdII')
+
+CACHE_COLUMNS = (
+    ('times', np.dtype('<f4'), ()),
+    ('bone_ids', np.dtype('<i4'), ()),
+    ('pos', np.dtype('<f4'), (3, )),
+    ('rot', np.dtype('<f4'), (4, )),
+    ('has_pos', np.dtype('?'), ()),
+    ('has_rot', np.dtype('?'), ()),
+)
+
+KEYFRAME_CLASSES = (AnmKeyframe, Anm8ingKeyframe)
+
+DEFAULT_CACHE_SIZE = 512 << 20
+
+
+def get_default_cache_dir():
+    if sys.platform == "win32":
+        base_dir = os.environ.get("LOCALAPPDATA") or path.expanduser("~")
+    elif sys.platform == "darwin":
+        base_dir = path.expanduser("~/Library/Caches")
+    else:
+        base_dir = os.environ.get("XDG_CACHE_HOME") or path.expanduser("~/.cache")
+    return path.join(base_dir, "io_scene_rw_anm")
+
+
+def get_plugin_version():
+    from . import bl_info
+    return bl_info["version"]
+
+
+def write_padding(fd, alignment=8):
+    fd.write(bytes(-fd.tell() % alignment))
+
+
+def write_cache_entry(fd, rw_animations: List[AnmAnimation], rw_version):
+    """Write animations as a header followed by the 8-byte aligned columns of each animation"""
+    fd.pack(CACHE_HEADER_STRUCT, CACHE_MAGIC, CACHE_FORMAT_VERSION,
+            -1 if rw_version is None else rw_version, len(rw_animations))
+
+    for rw_anim in rw_animations:
+        arrays = rw_anim.arrays
+        fd.pack(CACHE_ANIMATION_STRUCT, rw_anim.version, rw_anim.keyframe_type, rw_anim.flags, rw_anim.duration,
+                len(arrays), KEYFRAME_CLASSES.index(arrays.keyframe_cls))
+
+        for name, dtype, shape in CACHE_COLUMNS:
+            write_padding(fd)
+            write_array(fd, np.ascontiguousarray(getattr(arrays, name), dtype=dtype))
+
+
+def read_cache_entry(buffer) -> Tuple[List[AnmAnimation], Optional[int]]:
+    """Read animations written by write_cache_entry, columns are views of buffer"""
+    fd = BinaryReader(buffer)
+    magic, format_version, rw_version, animations_num = fd.unpack(CACHE_HEADER_STRUCT)
+    if magic != CACHE_MAGIC or format_version != CACHE_FORMAT_VERSION:
+        raise ValueError("Unknown parse cache format")
+
+    rw_animations = []
+    for _ in range(animations_num):
+        version, keyframe_type, flags, duration, keyframes_num, cls_idx = fd.unpack(CACHE_ANIMATION_STRUCT)
+
+        columns = []
+        for name, dtype, shape in CACHE_COLUMNS:
+            fd.seek(fd.tell() + (-fd.tell() % 8))
+            count = keyframes_num * int(np.prod(shape, dtype=np.int64))
+            column = np.frombuffer(buffer, dtype=dtype, count=count, offset=fd.tell())
+            columns.append(column.reshape((keyframes_num, ) + shape))
+            fd.seek(fd.tell() + column.nbytes)
+
+        arrays = AnmKeyframeArrays(*columns, KEYFRAME_CLASSES[cls_idx])
+        rw_animations.append(AnmAnimation(version, keyframe_type, flags, duration, arrays))
+
+    return rw_animations, None if rw_version < 0 else rw_version
+
+
+class ParseCache:
+    """On-disk cache of parsed files keyed by path, size, mtime, chunk selection and plugin version.
+    Entries are memory-mapped on a hit, the least recently used ones are removed above max_size bytes"""
+
+    def __init__(self, directory=None, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory or get_default_cache_dir()
+        self.max_size = max_size
+
+    def get_entry_path(self, filepath, chunks_selection=""):
+        stat = os.stat(filepath)
+        key = repr((path.abspath(filepath), stat.st_size, stat.st_mtime_ns, chunks_selection,
+                    get_plugin_version(), CACHE_FORMAT_VERSION))
+        return path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + CACHE_FILE_EXT)
+
+    def get(self, filepath, chunks_selection=""):
+        """Return the cached (rw_animations, rw_version) of the file or None"""
+        try:
+            entry_path = self.get_entry_path(filepath, chunks_selection)
+        except OSError:
+            return None
+
+        try:
+            with open(entry_path, 'rb') as fd:
+                # Copy on write keeps the arrays writable without touching the entry
+                buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_COPY)
+            result = read_cache_entry(buffer)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, IndexError, struct.error):
+            self.remove(entry_path)
+            return None
+
+        # Entry modification time orders the entries for eviction
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return result
+
+    def put(self, filepath, chunks_selection, result):
+        rw_animations, rw_version = result
+        entry_path = self.get_entry_path(filepath, chunks_selection)
+
+        fd = BinaryWriter(64 + sum(rw_anim.keyframes_num * 40 + 64 for rw_anim in rw_animations))
+        write_cache_entry(fd, rw_animations, rw_version)
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = "%s.%d.tmp" % (entry_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(fd.getbuffer())
+        os.replace(tmp_path, entry_path)
+
+        self.evict()
+
+    def remove(self, entry_path):
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits max_size"""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(CACHE_FILE_EXT):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            # Entries mapped by another import can not be removed on Windows
+            self.remove(entry_path)
+            total_size -= size
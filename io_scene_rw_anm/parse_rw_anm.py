@@ -0,0 +1,177 @@
+from os import path
+
+from .types.anm import Anm, LazyRWAnmChunk, decode_chunks
+from .types.pool import get_workers_num, run_tasks
+from .types.ska import Ska
+from .types.tmo import Tmo
+
+
+def parse_chunk_indices(text):
+    indices = set()
+    for part in text.replace(' ', '').split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        indices.update(range(int(first), int(last or first) + 1))
+    return indices
+
+
+def select_chunks(chunks, selection):
+    if not selection:
+        return chunks
+    indices = parse_chunk_indices(selection)
+    return [chunk for chunk_idx, chunk in enumerate(chunks) if chunk_idx in indices]
+
+
+def release_chunks(chunks):
+    for chunk in chunks:
+        if isinstance(chunk, LazyRWAnmChunk):
+            chunk.release()
+
+
+def iter_chunk_animations(chunks, release=False):
+    """Yield animations of chunks, AKI rotation and position chunks following each other are merged.
+    With release lazy chunks drop their animations after they are yielded, so at most two are decoded at a time"""
+    chunk_idx, chunks_num = 0, len(chunks)
+    while chunk_idx < chunks_num:
+        next_chunk_idx = chunk_idx + 1
+        rw_anim = chunks[chunk_idx].animation
+
+        if next_chunk_idx < chunks_num:
+            next_rw_anim = chunks[next_chunk_idx].animation
+
+            if rw_anim.is_mergable_with(next_rw_anim):
+                rw_anim.merge_with(next_rw_anim)
+                next_chunk_idx += 1
+
+        yield rw_anim
+
+        if release:
+            release_chunks(chunks[chunk_idx:next_chunk_idx])
+        chunk_idx = next_chunk_idx
+
+
+def merge_chunk_animations(chunks):
+    """Return animations of chunks, AKI rotation and position chunks following each other are merged"""
+    return list(iter_chunk_animations(chunks))
+
+
+def read_rw_animations(filepath, chunks_selection="", workers=1):
+    """Parse the animations of a file and the RW version of its chunks, does not need bpy.
+    With more than one worker the selected chunks are decoded in a process pool"""
+    rw_animations = []
+    rw_version = None
+
+    ext = path.splitext(filepath)[-1].lower()
+    if ext == ".ska":
+        ska = Ska.load(filepath)
+        rw_animations = [ska.animation]
+
+    elif ext == ".tmo":
+        with Tmo.load(filepath, workers != 1, lazy=True) as tmo:
+            chunks = select_chunks(tmo.chunks, chunks_selection)
+            if workers != 1:
+                decode_chunks(filepath, chunks, workers)
+            if chunks:
+                rw_animations = [chunk.animation for chunk in chunks]
+                rw_version = chunks[0].version
+
+    else:
+        with Anm.load(filepath, workers != 1, lazy=True) as anm:
+            chunks = select_chunks(anm.chunks, chunks_selection)
+            if workers != 1:
+                decode_chunks(filepath, chunks, workers)
+            if chunks:
+                rw_animations = merge_chunk_animations(chunks)
+                rw_version = chunks[0].version
+
+    return rw_animations, rw_version
+
+
+def iter_tmo_animations(chunks):
+    for chunk in chunks:
+        yield chunk.animation
+        release_chunks((chunk, ))
+
+
+def iter_and_close(bank, rw_animations):
+    """Yield rw_animations, the file of bank is closed when they are exhausted or the iterator is closed"""
+    with bank:
+        yield from rw_animations
+
+
+def stream_rw_animations(filepath, chunks_selection=""):
+    """Like read_rw_animations, but the animations are an iterator that decodes each chunk
+    from a memory map of the file when it is reached and releases it afterwards.
+    The map is closed when the iterator is exhausted or closed"""
+    rw_animations = []
+    rw_version = None
+
+    ext = path.splitext(filepath)[-1].lower()
+    if ext == ".ska":
+        rw_animations = [Ska.load(filepath).animation]
+
+    elif ext == ".tmo":
+        tmo = Tmo.load(filepath, True, lazy=True)
+        chunks = select_chunks(tmo.chunks, chunks_selection)
+        if chunks:
+            rw_animations = iter_and_close(tmo, iter_tmo_animations(chunks))
+            rw_version = chunks[0].version
+        else:
+            tmo.close()
+
+    else:
+        anm = Anm.load(filepath, True, lazy=True)
+        chunks = select_chunks(anm.chunks, chunks_selection)
+        if chunks:
+            rw_animations = iter_and_close(anm, iter_chunk_animations(chunks, True))
+            rw_version = chunks[0].version
+        else:
+            anm.close()
+
+    return rw_animations, rw_version
+
+
+def get_file_size(filepath):
+    try:
+        return path.getsize(filepath)
+    except OSError:
+        return 0
+
+
+def read_and_cache_rw_animations(filepath, chunks_selection="", workers=1, cache=None):
+    """read_rw_animations that stores the result in cache, failing to write the cache does not fail the file"""
+    result = read_rw_animations(filepath, chunks_selection, workers)
+    if cache:
+        try:
+            cache.put(filepath, chunks_selection, result)
+        except Exception:
+            # The file is parsed, only the cache entry is missing
+            pass
+    return result
+
+
+def read_rw_animations_files(filepaths, chunks_selection="", workers=1, cache=None, streaming=False):
+    """Parse files, yield (filepath, result, error, cached) in the order of filepaths as soon as each file is ready.
+    Files are parsed in a process pool when more than one worker is asked for and the files are large enough,
+    workers set to 0 use all CPU cores. Files found in cache are not parsed, a single parsed file gets
+    the workers to decode its chunks instead. With streaming the files that are not in cache are read one by one
+    with stream_rw_animations and are not stored in cache, decoding errors are then raised while iterating the animations"""
+    cached_results = [cache.get(filepath, chunks_selection) if cache else None for filepath in filepaths]
+    parsed_filepaths = [str(filepath) for filepath, result in zip(filepaths, cached_results) if result is None]
+
+    if streaming:
+        parsed_files = run_tasks(stream_rw_animations, [(filepath, chunks_selection) for filepath in parsed_filepaths])
+    elif len(parsed_filepaths) == 1:
+        parsed_files = run_tasks(read_and_cache_rw_animations, [(parsed_filepaths[0], chunks_selection, workers, cache)])
+    else:
+        files_workers = get_workers_num(workers, [get_file_size(filepath) for filepath in parsed_filepaths])
+        parsed_files = run_tasks(read_and_cache_rw_animations,
+                                 [(filepath, chunks_selection, 1, cache) for filepath in parsed_filepaths], files_workers)
+
+    for filepath, result in zip(filepaths, cached_results):
+        if result is not None:
+            yield filepath, result, None, True
+        else:
+            result, error = next(parsed_files)
+            yield filepath, result, error, False
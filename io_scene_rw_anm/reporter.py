@@ -6,9 +6,15 @@ class Reporter:
         self.title = title
         self.imported_actions_num = 0
         self.exported_actions_num = 0
+        self._infos = []
         self._warnings = []
         self._errors = []
 
+    def info(self, *string):
+        message = " ".join(str(s) for s in string)
+        print("INFO:", message)
+        self._infos.append(message)
+
     def warning(self, *string):
         message = " ".join(str(s) for s in string)
         print("WARNING:", message)
@@ -38,6 +44,9 @@ class Reporter:
         if self.exported_actions_num:
             layout.label(text="Exported %d actions" % self.exported_actions_num, icon='INFO')
 
+        for msg in self._infos:
+            layout.label(text=msg, icon='INFO')
+
     def show(self):
         if not bpy.app.background:
             bpy.context.window_manager.popup_menu(self.draw_layout, title=self.title)
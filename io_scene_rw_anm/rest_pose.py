@@ -0,0 +1,82 @@
+import numpy as np
+
+from dataclasses import dataclass
+from mathutils import Matrix, Quaternion
+from typing import Dict, List
+
+from .math_utils import quaternion_inverted
+
+
+@dataclass
+class BoneRestPose:
+    rest_matrix: Matrix
+    rest_matrix_inverted: Matrix
+    parent_matrix: Matrix
+    parent_matrix_inverted: Matrix
+    local_rot: Quaternion
+    local_to_basis: np.ndarray
+    basis_to_local: np.ndarray
+    local_rot_inverted: np.ndarray
+
+
+@dataclass
+class ArmatureRestPose:
+    signature: tuple
+    bones: List[BoneRestPose]
+    bones_map: Dict[int, int]
+
+
+_rest_poses: Dict[int, ArmatureRestPose] = {}
+
+
+def get_armature_signature(arm):
+    bones = arm.bones
+    matrices = np.empty(len(bones) * 16, dtype=np.float32)
+    bones.foreach_get('matrix_local', matrices)
+
+    return (
+        tuple((bone.name, bone.parent.name if bone.parent else None, bone.get("bone_id")) for bone in bones),
+        matrices.tobytes(),
+    )
+
+
+def create_armature_rest_pose(arm, signature) -> ArmatureRestPose:
+    bones = []
+    bones_map = {}
+
+    for bone_id, bone in enumerate(arm.bones):
+        rest_mat = bone.matrix_local.copy()
+        if bone.parent:
+            parent_mat = bone.parent.matrix_local.copy()
+            local_rot = (parent_mat.inverted_safe() @ rest_mat).to_quaternion()
+        else:
+            parent_mat = Matrix.Identity(4)
+            local_rot = rest_mat.to_quaternion()
+
+        # Degenerate bones have no inverse, inverted_safe keeps them importable
+        rest_mat_inv = rest_mat.inverted_safe()
+        parent_mat_inv = parent_mat.inverted_safe()
+        bones.append(BoneRestPose(
+            rest_mat, rest_mat_inv, parent_mat, parent_mat_inv, local_rot,
+            np.array(rest_mat_inv @ parent_mat), np.array(parent_mat_inv @ rest_mat), quaternion_inverted(local_rot),
+        ))
+
+        bone_tag = bone.get("bone_id")
+        if bone_tag is not None:
+            bones_map[bone_tag] = bone_id
+
+    return ArmatureRestPose(signature, bones, bones_map)
+
+
+def get_armature_rest_pose(arm_obj) -> ArmatureRestPose:
+    """Return rest matrices of the armature bones, cached until bones or their rest pose change"""
+    arm = arm_obj.data
+    key = arm.as_pointer()
+    signature = get_armature_signature(arm)
+
+    rest_pose = _rest_poses.get(key)
+    if rest_pose is None or rest_pose.signature != signature:
+        rest_pose = create_armature_rest_pose(arm, signature)
+        _rest_poses[key] = rest_pose
+
+    return rest_pose
@@ -1,10 +1,12 @@
+import numpy as np
+
 from dataclasses import dataclass
-from mathutils import Quaternion, Vector
 from os import SEEK_SET, SEEK_CUR, SEEK_END
 from typing import List
 
 from . binary_utils import *
 from . common import *
+from . pool import get_workers_num, run_tasks
 
 from . vendors.aki import *
 from . vendors.eighting import *
@@ -14,99 +16,69 @@ from . vendors.trashmasters import *
 ANM_CHUNK_ID = 0x1b
 ANM_ANIMATION_VERSION = 0x100
 
+UNCOMPRESSED_KEYFRAME_DTYPE = np.dtype([
+    ('time', '<f4'),
+    ('rot', '<f4', 4),
+    ('pos', '<f4', 3),
+    ('prev_frame_off', '<u4'),
+])
 
-def read_keyframes_uncompressed(fd, keyframes_num) -> List[AnmKeyframe]:
-    keyframes: List[AnmKeyframe] = []
-    frame_offs = []
-    bone_id = -1
-
-    for kf_id in range(keyframes_num):
-        frame_offs.append(kf_id * 36)
-        time = read_float32(fd)
-        rot = read_float32(fd, 4)
-        rot = Quaternion((rot[3], rot[0], rot[1], rot[2]))
-        pos = Vector(read_float32(fd, 3))
-        prev_frame_off = read_uint32(fd)
-
-        if prev_frame_off & 0x3F000000:
-            bone_id = bone_id + 1 if time == 0.0 else 0
-        else:
-            prev_kf_id = frame_offs.index(prev_frame_off)
-            bone_id = keyframes[prev_kf_id].bone_id
-
-        keyframes.append(AnmKeyframe(time, bone_id, pos, rot))
+# Stored as 22 bytes, keyframe offsets use the 24-byte runtime stride
+COMPRESSED_KEYFRAME_DTYPE = np.dtype([
+    ('time', '<f4'),
+    ('rot', '<u2', 4),
+    ('pos', '<u2', 3),
+    ('prev_frame_off', '<u4'),
+])
 
-    return keyframes
 
+def read_keyframes_uncompressed(fd, keyframes_num) -> AnmKeyframeArrays:
+    data = read_array(fd, UNCOMPRESSED_KEYFRAME_DTYPE, keyframes_num)
+    block = KeyframeBlock(data['time'], data['prev_frame_off'], data['rot'][:, (3, 0, 1, 2)], data['pos'])
 
-def read_keyframes_compressed(fd, keyframes_num) -> List[AnmKeyframe]:
-    keyframes: List[AnmKeyframe] = []
-    frame_offs = []
-    bone_id = -1
+    roots = (block.prev_frame_offs & 0x3F000000) != 0
+    bone_ids = resolve_bone_ids(block.times, block.prev_frame_offs, roots, 36)
 
-    for kf_id in range(keyframes_num):
-        frame_offs.append(kf_id * 24)
-        time = read_float32(fd)
-        rot = read_float16(fd, 4)
-        rot = Quaternion((rot[3], rot[0], rot[1], rot[2]))
-        pos = Vector(read_float16(fd, 3))
-        prev_frame_off = read_uint32(fd)
+    return block.to_arrays(bone_ids)
 
-        if prev_frame_off & 0x3F000000:
-            bone_id = bone_id + 1 if time == 0.0 else 0
-        else:
-            prev_kf_id = frame_offs.index(prev_frame_off)
-            bone_id = keyframes[prev_kf_id].bone_id
 
-        keyframes.append(AnmKeyframe(time, bone_id, pos, rot))
+def read_keyframes_compressed(fd, keyframes_num) -> AnmKeyframeArrays:
+    data = read_array(fd, COMPRESSED_KEYFRAME_DTYPE, keyframes_num)
+    pos_offset = np.array(read_float32(fd, 3), dtype=np.float32)
+    pos_scale = np.array(read_float32(fd, 3), dtype=np.float32)
 
-    pos_offset = Vector(read_float32(fd, 3))
-    pos_scale = Vector(read_float32(fd, 3))
-    for kf in keyframes:
-        kf.pos *= pos_scale
-        kf.pos += pos_offset
+    rots = decode_float16_array(data['rot'][:, (3, 0, 1, 2)])
+    positions = decode_float16_array(data['pos']).astype(np.float32) * pos_scale + pos_offset
+    block = KeyframeBlock(data['time'], data['prev_frame_off'], rots, positions)
 
-    return keyframes
+    roots = (block.prev_frame_offs & 0x3F000000) != 0
+    bone_ids = resolve_bone_ids(block.times, block.prev_frame_offs, roots, 24)
 
+    return block.to_arrays(bone_ids)
 
-def write_keyframes_uncompressed(fd, keyframes: List[AnmKeyframe]):
-    prev_frame_offs = {}
 
-    for kf_id, kf in enumerate(keyframes):
-        write_float32(fd, kf.time)
-        write_float32(fd, (kf.rot.x, kf.rot.y, kf.rot.z, kf.rot.w))
-        write_float32(fd, kf.pos)
+def write_keyframes_uncompressed(fd, keyframes: AnmKeyframeArrays):
+    data = np.empty(len(keyframes), dtype=UNCOMPRESSED_KEYFRAME_DTYPE)
+    data['time'] = keyframes.times
+    data['rot'] = keyframes.rot[:, (1, 2, 3, 0)]
+    data['pos'] = keyframes.pos
+    data['prev_frame_off'] = get_prev_frame_offs(keyframes.bone_ids, 36)
 
-        if kf.bone_id not in prev_frame_offs:
-            write_uint32(fd, KEYFRAME_PARENT_NONE_OFFSET)
-        else:
-            write_uint32(fd, prev_frame_offs[kf.bone_id])
-        prev_frame_offs[kf.bone_id] = kf_id * 36
+    write_array(fd, data)
 
 
-def write_keyframes_compressed(fd, keyframes: List[AnmKeyframe]):
-    prev_frame_offs = {}
+def write_keyframes_compressed(fd, keyframes: AnmKeyframeArrays):
+    positions, pos_offset, pos_scale = quantize_linear(keyframes.pos, *calculate_linear_scale_array(keyframes.pos))
 
-    pos_offset_x, pos_scale_x = calculate_linear_scale(tuple(kf.pos.x for kf in keyframes))
-    pos_offset_y, pos_scale_y = calculate_linear_scale(tuple(kf.pos.y for kf in keyframes))
-    pos_offset_z, pos_scale_z = calculate_linear_scale(tuple(kf.pos.z for kf in keyframes))
+    data = np.empty(len(keyframes), dtype=COMPRESSED_KEYFRAME_DTYPE)
+    data['time'] = keyframes.times
+    data['rot'] = encode_float16_array(keyframes.rot[:, (1, 2, 3, 0)])
+    data['pos'] = encode_float16_array(positions)
+    data['prev_frame_off'] = get_prev_frame_offs(keyframes.bone_ids, 24)
 
-    pos_offset = Vector((pos_offset_x, pos_offset_y, pos_offset_z))
-    pos_scale = Vector((pos_scale_x, pos_scale_y, pos_scale_z))
-
-    for kf_id, kf in enumerate(keyframes):
-        write_float32(fd, kf.time)
-        write_float16(fd, (kf.rot.x, kf.rot.y, kf.rot.z, kf.rot.w))
-        write_float16(fd, Vector((v1/v2 for v1, v2 in zip(kf.pos - pos_offset, pos_scale))))
-
-        if kf.bone_id not in prev_frame_offs:
-            write_uint32(fd, KEYFRAME_PARENT_NONE_OFFSET)
-        else:
-            write_uint32(fd, prev_frame_offs[kf.bone_id])
-        prev_frame_offs[kf.bone_id] = kf_id * 24
-
-    write_float32(fd, pos_offset)
-    write_float32(fd, pos_scale)
+    write_array(fd, data)
+    write_float32(fd, pos_offset.tolist())
+    write_float32(fd, pos_scale.tolist())
 
 
 def read_anm_animation(fd) -> AnmAnimation:
@@ -137,7 +109,7 @@ def read_anm_animation(fd) -> AnmAnimation:
 
 
 def write_anm_animation(fd, animation: AnmAnimation):
-    write_uint32(fd, (animation.version, animation.keyframe_type, len(animation.keyframes), animation.flags))
+    write_uint32(fd, (animation.version, animation.keyframe_type, animation.keyframes_num, animation.flags))
     write_float32(fd, animation.duration)
 
     writer_func = {
@@ -150,7 +122,7 @@ def write_anm_animation(fd, animation: AnmAnimation):
         KeyframeType.CLIMAX: write_keyframes_climax,
     }[animation.keyframe_type]
 
-    writer_func(fd, animation.keyframes)
+    writer_func(fd, animation.arrays)
 
 
 def read_anm_chunk(fd) -> RWAnmChunk:
@@ -162,11 +134,166 @@ def read_anm_chunk(fd) -> RWAnmChunk:
 
 
 @dataclass
-class Anm:
+class AnmChunkHeader:
+    offset: int
+    chunk_id: int
+    chunk_size: int
+    version: int
+    animation_version: int
+    keyframe_type: int
+    keyframes_num: int
+    flags: int
+    duration: float
+
+
+# Keyframe record size and the size of the data around the records of fixed size keyframe types
+ANM_KEYFRAME_BLOCK_SIZES = {
+    KeyframeType.UNCOMPRESSED: (UNCOMPRESSED_KEYFRAME_DTYPE.itemsize, 0),
+    KeyframeType.COMPRESSED: (COMPRESSED_KEYFRAME_DTYPE.itemsize, 24),
+    KeyframeType.AKI_COMPRESSED_ROT: (AKI_ROT_KEYFRAME_DTYPE.itemsize, 0),
+    KeyframeType.AKI_COMPRESSED_POS: (AKI_POS_KEYFRAME_DTYPE.itemsize, 24),
+    KeyframeType.TM_COMPRESSED_ROT: (TM_COMPRESSED_ROT_KEYFRAME_DTYPE.itemsize, 0),
+    KeyframeType.EIGHTING: (EIGHTING_KEYFRAME_DTYPE.itemsize, 0),
+    KeyframeType.CLIMAX: (CLIMAX_KEYFRAME_HEADER_DTYPE.itemsize + CLIMAX_KEYFRAME_DTYPE.itemsize, 24),
+}
+
+
+def get_anm_animation_size(keyframe_type, keyframes_num):
+    """Size of an animation with its header, None for keyframe types of variable or unknown size"""
+    block_sizes = ANM_KEYFRAME_BLOCK_SIZES.get(keyframe_type)
+    if block_sizes is None:
+        return None
+    record_size, extra_size = block_sizes
+    return 20 + record_size * keyframes_num + extra_size
+
+
+def is_chunk_size_valid(header: AnmChunkHeader) -> bool:
+    """Check the stored chunk size against the size of the keyframes, variable size keyframes are not checked"""
+    animation_size = get_anm_animation_size(header.keyframe_type, header.keyframes_num)
+    return animation_size is None or header.chunk_size == animation_size
+
+
+def read_anm_chunk_header(fd) -> AnmChunkHeader:
+    offset = fd.tell()
+    chunk_id, chunk_size, chunk_version = read_uint32(fd, 3)
+    if chunk_id == ANM_CHUNK_ID:
+        version, keyframe_type, keyframes_num, flags = read_uint32(fd, 4)
+        duration = read_float32(fd)
+        header = AnmChunkHeader(offset, chunk_id, chunk_size, chunk_version,
+                                version, keyframe_type, keyframes_num, flags, duration)
+    else:
+        header = None
+
+    fd.seek(offset + 12 + chunk_size, SEEK_SET)
+    return header
+
+
+class LazyRWAnmChunk(RWAnmChunk):
+    """Chunk that decodes its animation from the source buffer on first access"""
+
+    def __init__(self, fd, header: AnmChunkHeader):
+        self.chunk_id = header.chunk_id
+        self.version = header.version
+        self.header = header
+        self._fd = fd
+        self._animation = None
+
+    @property
+    def animation(self) -> AnmAnimation:
+        if self._animation is None:
+            self._fd.seek(self.header.offset + 12, SEEK_SET)
+            self._animation = read_anm_animation(self._fd)
+        return self._animation
+
+    @animation.setter
+    def animation(self, animation):
+        self._animation = animation
+
+    def is_loaded(self) -> bool:
+        return self._animation is not None
+
+    def release(self):
+        """Drop the decoded animation, it is decoded again on the next access"""
+        self._animation = None
+
+    def close(self):
+        """Close the source reader, animations that are not decoded yet can not be read afterwards"""
+        self._fd.close()
+
+
+def read_anm_animations(filepath, offsets) -> List[AnmAnimation]:
+    """Decode the animations of the chunks at offsets from a memory map of the file"""
+    with BinaryReader.open(filepath, True) as fd:
+        animations = []
+        for offset in offsets:
+            fd.seek(offset + 12, SEEK_SET)
+            animations.append(read_anm_animation(fd))
+        return animations
+
+
+def decode_chunks(filepath, chunks, workers=0):
+    """Decode the lazy chunks that are not loaded yet, workers set to 0 use all CPU cores.
+    A process pool is only used when every worker gets enough data, each worker maps the file itself"""
+    chunks = [chunk for chunk in chunks if isinstance(chunk, LazyRWAnmChunk) and not chunk.is_loaded()]
+    workers = get_workers_num(workers, [chunk.header.chunk_size for chunk in chunks])
+
+    if workers == 1:
+        for chunk in chunks:
+            chunk.animation
+        return
+
+    # A few batches per worker even out chunks of different size
+    sizes = np.cumsum([chunk.header.keyframes_num + 1 for chunk in chunks])
+    batch_ids = (sizes - sizes[0]) * (workers * 4) // sizes[-1]
+    batch_starts = np.flatnonzero(np.diff(batch_ids, prepend=-1)).tolist()
+    batches = [chunks[start:end] for start, end in zip(batch_starts, batch_starts[1:] + [len(chunks)])]
+
+    args_list = [(str(filepath), [chunk.header.offset for chunk in batch]) for batch in batches]
+    for batch, (animations, error) in zip(batches, run_tasks(read_anm_animations, args_list, workers)):
+        if error:
+            raise error
+        for chunk, animation in zip(batch, animations):
+            chunk.animation = animation
+
+
+@dataclass
+class AnmBank:
+    """Chunks of an ANM or TMO file, subclasses provide the classmethod read(fd, lazy=False).
+    Lazy chunks decode from a reader that stays open until close, the bank can be used as a context manager to close it"""
     chunks: List[RWAnmChunk]
 
     @classmethod
-    def read(cls, fd):
+    def load(cls, filepath, use_mmap=False, lazy=False, workers=1):
+        if workers != 1:
+            # Chunks are indexed here and decoded in worker processes
+            with BinaryReader.open(filepath, True) as fd:
+                bank = cls.read(fd, True)
+                decode_chunks(filepath, bank.chunks, workers)
+            return bank
+
+        if lazy:
+            # Lazy chunks keep the reader open to decode on demand
+            return cls.read(BinaryReader.open(filepath, use_mmap), True)
+
+        with BinaryReader.open(filepath, use_mmap) as fd:
+            return cls.read(fd)
+
+    def close(self):
+        for chunk in self.chunks:
+            if isinstance(chunk, LazyRWAnmChunk):
+                chunk.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@dataclass
+class Anm(AnmBank):
+    @classmethod
+    def read(cls, fd, lazy=False):
         fd.seek(0, SEEK_END)
         file_size = fd.tell()
         fd.seek(0, SEEK_SET)
@@ -174,23 +301,32 @@ class Anm:
         chunks: List[RWAnmChunk] = []
 
         while fd.tell() < file_size:
-            anm_chunk = read_anm_chunk(fd)
+            if lazy:
+                header = read_anm_chunk_header(fd)
+                anm_chunk = LazyRWAnmChunk(fd, header) if header else None
+                if header and not is_chunk_size_valid(header):
+                    # Earlier versions of the plugin wrote 20 + 36 bytes per keyframe as the size of every chunk,
+                    # such chunks are decoded in order and the next one starts where the animation ends
+                    fd.seek(header.offset + 12, SEEK_SET)
+                    anm_chunk.animation = read_anm_animation(fd)
+                    header.chunk_size = fd.tell() - header.offset - 12
+            else:
+                anm_chunk = read_anm_chunk(fd)
             if anm_chunk:
                 chunks.append(anm_chunk)
 
         return cls(chunks)
 
-    @classmethod
-    def load(cls, filepath):
-        with open(filepath, 'rb') as fd:
-            return cls.read(fd)
-
     def write(self, fd):
         for anm_chunk in self.chunks:
-            chunk_size = 20 + len(anm_chunk.animation.keyframes) * 36
-            write_uint32(fd, (anm_chunk.chunk_id, chunk_size, anm_chunk.version))
-            write_anm_animation(fd, anm_chunk.animation)
+            animation = BinaryWriter(20 + anm_chunk.animation.keyframes_num * 36 + 24)
+            write_anm_animation(animation, anm_chunk.animation)
+
+            write_uint32(fd, (anm_chunk.chunk_id, animation.tell(), anm_chunk.version))
+            fd.write(animation.getbuffer())
 
     def save(self, filepath):
-        with open(filepath, 'wb') as fd:
-            return self.write(fd)
+        fd = BinaryWriter(sum(32 + anm_chunk.animation.keyframes_num * 36 + 24 for anm_chunk in self.chunks))
+        self.write(fd)
+        with open(filepath, 'wb') as f:
+            f.write(fd.getbuffer())
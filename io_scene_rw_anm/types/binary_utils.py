@@ -1,13 +1,27 @@
+import math
+import mmap
+import numpy as np
 import struct
 
+from functools import lru_cache
+from os import SEEK_SET, SEEK_CUR, SEEK_END
+
+
+def _build_float16_table():
+    values = np.arange(0x10000, dtype=np.int32)
+    sign = np.where(values >> 15, -1.0, 1.0)
+    exponent = ((values >> 11) & 15) - 15
+    mantissa = (values & 0x07FF) / 0x800 + 1.0
+    return np.where(values & 0x7FFF, np.ldexp(sign * mantissa, exponent), sign * 0.0)
+
+
+# RenderWare float16 is not IEEE half: it has no denormals, infinities or NaNs
+FLOAT16_TABLE = _build_float16_table()
+_FLOAT16_VALUES = FLOAT16_TABLE.tolist()
+
 
 def decode_float16(value):
-    sign = -1.0 if (value >> 15) else 1.0
-    if (value & 0x7FFF) == 0:
-        return sign * 0.0
-    exponent = ((value >> 11) & 15) - 15
-    mantissa = (value & 0x07FF) / 0x800 + 1.0
-    return sign * mantissa * 2**exponent
+    return _FLOAT16_VALUES[value]
 
 
 def encode_float16(value):
@@ -20,81 +34,201 @@ def encode_float16(value):
     if value == 0:
         return sign << 15
 
-    exponent = 0
-    while value < 1.0 and exponent > -15:
-        value *= 2.0
-        exponent -= 1
-    exponent += 15
+    shift = min(max(1 - math.frexp(value)[1], 0), 15)
+    value = math.ldexp(value, shift)
+    exponent = 15 - shift
     mantissa = int((value - 1.0) * 0x800) & 0x07FF
     return (sign << 15) | (exponent << 11) | mantissa
 
 
+def decode_float16_array(values):
+    return FLOAT16_TABLE[np.asarray(values, dtype=np.uint16)]
+
+
+def encode_float16_array(values):
+    values = np.asarray(values, dtype=np.float64)
+    sign = (values < 0).astype(np.int64)
+    values = np.abs(values)
+
+    # Values below 1.0 are doubled up to 15 times, larger values keep the top exponent
+    shift = np.clip(1 - np.frexp(values)[1], 0, 15)
+    values = np.ldexp(values, shift)
+    with np.errstate(invalid='ignore'):
+        mantissa = np.trunc((values - 1.0) * 0x800)
+    # Integers from 2^52 up have no fractional bits left to keep
+    mantissa = np.where(values < 2.0**52, mantissa, 0.0).astype(np.int64) & 0x07FF
+
+    codes = (sign << 15) | ((15 - shift) << 11) | mantissa
+    return np.where(values == 0, sign << 15, codes).astype(np.uint16)
+
+
+@lru_cache(maxsize=None)
+def get_struct(en, num, code):
+    return struct.Struct('%s%d%s' % (en, num, code))
+
+
+class BinaryReader:
+    """File-like cursor over bytes, mmap or memoryview, unpacks with cached structs"""
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._size = len(buffer)
+        self._pos = 0
+
+    @classmethod
+    def open(cls, filepath, use_mmap=False):
+        with open(filepath, 'rb') as fd:
+            if use_mmap:
+                return cls(mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ))
+            return cls(fd.read())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._size
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=SEEK_SET):
+        if whence == SEEK_CUR:
+            offset += self._pos
+        elif whence == SEEK_END:
+            offset += self._size
+        self._pos = offset
+        return offset
+
+    def read(self, size=-1):
+        start = self._pos
+        end = self._size if size < 0 else min(start + size, self._size)
+        self._pos = max(start, end)
+        return bytes(self._buffer[start:end])
+
+    def unpack(self, st):
+        res = st.unpack_from(self._buffer, self._pos)
+        self._pos += st.size
+        return res
+
+
+class BinaryWriter:
+    """File-like writer into a preallocated bytearray, grows when the estimate is exceeded"""
+
+    def __init__(self, size=0):
+        self._buffer = bytearray(size)
+        self._pos = 0
+
+    def _reserve(self, size):
+        end = self._pos + size
+        if end > len(self._buffer):
+            self._buffer.extend(bytes(max(end - len(self._buffer), len(self._buffer))))
+        return end
+
+    def tell(self):
+        return self._pos
+
+    def write(self, data):
+        end = self._reserve(len(data))
+        self._buffer[self._pos:end] = data
+        self._pos = end
+
+    def pack(self, st, *vals):
+        end = self._reserve(st.size)
+        st.pack_into(self._buffer, self._pos, *vals)
+        self._pos = end
+
+    def getbuffer(self):
+        return memoryview(self._buffer)[:self._pos]
+
+
+def _unpack(fd, st):
+    if isinstance(fd, BinaryReader):
+        return fd.unpack(st)
+    return st.unpack(fd.read(st.size))
+
+
+def _pack(fd, st, data):
+    if isinstance(fd, BinaryWriter):
+        fd.pack(st, *data)
+    else:
+        fd.write(st.pack(*data))
+
+
 def read_string(fd, size):
     return fd.read(size).rstrip(b'\0').decode()
 
 
+def read_array(fd, dtype, num):
+    dtype = np.dtype(dtype)
+    return np.frombuffer(fd.read(dtype.itemsize * num), dtype=dtype, count=num)
+
+
+def write_array(fd, data):
+    fd.write(data.tobytes())
+
+
 def read_float16(fd, num=1, en='<'):
-    res = struct.unpack('%s%dH' % (en, num), fd.read(2 * num))
-    res = tuple(map(decode_float16, res))
+    res = tuple(map(decode_float16, _unpack(fd, get_struct(en, num, 'H'))))
     return res if num > 1 else res[0]
 
 
 def read_float32(fd, num=1, en='<'):
-    res = struct.unpack('%s%df' % (en, num), fd.read(4 * num))
+    res = _unpack(fd, get_struct(en, num, 'f'))
     return res if num > 1 else res[0]
 
 
 def read_uint8(fd, num=1):
-    res = struct.unpack('%dB' % num, fd.read(num))
+    res = _unpack(fd, get_struct('', num, 'B'))
     return res if num > 1 else res[0]
 
 
 def read_int16(fd, num=1, en='<'):
-    res = struct.unpack('%s%dh' % (en, num), fd.read(2 * num))
+    res = _unpack(fd, get_struct(en, num, 'h'))
     return res if num > 1 else res[0]
 
 
 def read_uint16(fd, num=1, en='<'):
-    res = struct.unpack('%s%dH' % (en, num), fd.read(2 * num))
+    res = _unpack(fd, get_struct(en, num, 'H'))
     return res if num > 1 else res[0]
 
 
 def read_uint32(fd, num=1, en='<'):
-    res = struct.unpack('%s%dI' % (en, num), fd.read(4 * num))
+    res = _unpack(fd, get_struct(en, num, 'I'))
     return res if num > 1 else res[0]
 
 
 def write_float16(fd, vals, en='<'):
-    data = vals if hasattr(vals, '__len__') else (vals, )
-    data = struct.pack('%s%dH' % (en, len(data)), *tuple(map(encode_float16, vals)))
-    fd.write(data)
+    data = encode_float16_array(tuple(vals) if hasattr(vals, '__len__') else (vals, ))
+    fd.write(data.astype('%su2' % en).tobytes())
 
 
 def write_float32(fd, vals, en='<'):
     data = vals if hasattr(vals, '__len__') else (vals, )
-    data = struct.pack('%s%df' % (en, len(data)), *data)
-    fd.write(data)
+    _pack(fd, get_struct(en, len(data), 'f'), data)
 
 
 def write_uint8(fd, vals):
     data = vals if hasattr(vals, '__len__') else (vals, )
-    data = struct.pack('%dB' % len(data), *data)
-    fd.write(data)
+    _pack(fd, get_struct('', len(data), 'B'), data)
 
 
 def write_int16(fd, vals, en='<'):
     data = vals if hasattr(vals, '__len__') else (vals, )
-    data = struct.pack('%s%dh' % (en, len(data)), *data)
-    fd.write(data)
+    _pack(fd, get_struct(en, len(data), 'h'), data)
 
 
 def write_uint16(fd, vals, en='<'):
     data = vals if hasattr(vals, '__len__') else (vals, )
-    data = struct.pack('%s%dH' % (en, len(data)), *data)
-    fd.write(data)
+    _pack(fd, get_struct(en, len(data), 'H'), data)
 
 
 def write_uint32(fd, vals, en='<'):
     data = vals if hasattr(vals, '__len__') else (vals, )
-    data = struct.pack('%s%dI' % (en, len(data)), *data)
-    fd.write(data)
+    _pack(fd, get_struct(en, len(data), 'I'), data)
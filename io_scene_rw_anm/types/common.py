@@ -1,11 +1,22 @@
+import numpy as np
+
 from enum import IntEnum
 from dataclasses import dataclass
-from mathutils import Quaternion, Vector
-from typing import List
+from typing import List, Optional, Union
+
+try:
+    from mathutils import Quaternion, Vector
+except ImportError:
+    # Parsing worker processes run without Blender modules and keep keyframes as columns
+    Quaternion = Vector = None
 
 KEYFRAME_PARENT_NONE_OFFSET = 0xFF30C9D8
 
 
+class KeyframeChainError(ValueError):
+    pass
+
+
 class KeyframeType(IntEnum):
     UNCOMPRESSED       = 0x1
     COMPRESSED         = 0x2
@@ -24,37 +35,179 @@ class AnmKeyframe:
     pos: Vector
     rot: Quaternion
 
-    def is_indexed_bones(self) -> bool:
+    @classmethod
+    def is_indexed_bones(cls) -> bool:
         return True
 
-    def is_pose_space(self) -> bool:
+    @classmethod
+    def is_pose_space(cls) -> bool:
         return False
 
 
+@dataclass
+class AnmKeyframeArrays:
+    """Keyframes as columns, rotations are stored as (w, x, y, z).
+    Rows without position or rotation are zero and cleared in has_pos or has_rot"""
+    times: np.ndarray
+    bone_ids: np.ndarray
+    pos: np.ndarray
+    rot: np.ndarray
+    has_pos: np.ndarray
+    has_rot: np.ndarray
+    keyframe_cls: type = AnmKeyframe
+
+    def __len__(self):
+        return len(self.times)
+
+    @classmethod
+    def from_columns(cls, times, bone_ids, pos=None, rot=None, keyframe_cls=AnmKeyframe):
+        keyframes_num = len(times)
+        has_pos = np.full(keyframes_num, pos is not None)
+        has_rot = np.full(keyframes_num, rot is not None)
+        pos = np.zeros((keyframes_num, 3), dtype=np.float32) if pos is None else np.array(pos, dtype=np.float32)
+        rot = np.zeros((keyframes_num, 4), dtype=np.float32) if rot is None else np.array(rot, dtype=np.float32)
+        return cls(np.array(times, dtype=np.float32), np.array(bone_ids, dtype=np.int32),
+                   pos, rot, has_pos, has_rot, keyframe_cls)
+
+    @classmethod
+    def from_keyframes(cls, keyframes: List[AnmKeyframe]):
+        keyframes_num = len(keyframes)
+        has_pos = np.fromiter((kf.pos is not None for kf in keyframes), dtype=bool, count=keyframes_num)
+        has_rot = np.fromiter((kf.rot is not None for kf in keyframes), dtype=bool, count=keyframes_num)
+
+        pos = np.zeros((keyframes_num, 3), dtype=np.float32)
+        pos[has_pos] = np.array([tuple(kf.pos) for kf in keyframes if kf.pos is not None], dtype=np.float32).reshape(-1, 3)
+        rot = np.zeros((keyframes_num, 4), dtype=np.float32)
+        rot[has_rot] = np.array([tuple(kf.rot) for kf in keyframes if kf.rot is not None], dtype=np.float32).reshape(-1, 4)
+
+        return cls(
+            np.fromiter((kf.time for kf in keyframes), dtype=np.float32, count=keyframes_num),
+            np.fromiter((kf.bone_id for kf in keyframes), dtype=np.int32, count=keyframes_num),
+            pos, rot, has_pos, has_rot,
+            type(keyframes[0]) if keyframes else AnmKeyframe,
+        )
+
+    def to_keyframes(self) -> List[AnmKeyframe]:
+        pos = [Vector(p) if has else None for p, has in zip(self.pos.tolist(), self.has_pos.tolist())]
+        rot = [Quaternion(r) if has else None for r, has in zip(self.rot.tolist(), self.has_rot.tolist())]
+        return list(map(self.keyframe_cls, self.times.tolist(), self.bone_ids.tolist(), pos, rot))
+
+    def take(self, indices):
+        return AnmKeyframeArrays(self.times[indices], self.bone_ids[indices], self.pos[indices], self.rot[indices],
+                                 self.has_pos[indices], self.has_rot[indices], self.keyframe_cls)
+
+    def concatenate(self, other):
+        return AnmKeyframeArrays(*(np.concatenate((a, b)) for a, b in (
+            (self.times, other.times), (self.bone_ids, other.bone_ids), (self.pos, other.pos),
+            (self.rot, other.rot), (self.has_pos, other.has_pos), (self.has_rot, other.has_rot))),
+            self.keyframe_cls)
+
+
+@dataclass
+class KeyframeBlock:
+    """Decoded columns of a keyframe block, rotations are stored as (w, x, y, z)"""
+    times: np.ndarray
+    prev_frame_offs: np.ndarray
+    rots: Optional[np.ndarray] = None
+    positions: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def to_arrays(self, bone_ids, keyframe_cls=AnmKeyframe) -> AnmKeyframeArrays:
+        return AnmKeyframeArrays.from_columns(self.times, bone_ids, self.positions, self.rots, keyframe_cls)
+
+
 @dataclass
 class AnmAnimation:
+    """Keyframes are held either as a list of AnmKeyframe or as AnmKeyframeArrays,
+    the keyframes and arrays properties convert between them on demand"""
     version: int
     keyframe_type: int
     flags: int
     duration: float
-    keyframes: List[AnmKeyframe]
+    keyframe_data: Union[List[AnmKeyframe], AnmKeyframeArrays]
+
+    @property
+    def keyframes(self) -> List[AnmKeyframe]:
+        if isinstance(self.keyframe_data, AnmKeyframeArrays):
+            self.keyframe_data = self.keyframe_data.to_keyframes()
+        return self.keyframe_data
+
+    @keyframes.setter
+    def keyframes(self, keyframes: List[AnmKeyframe]):
+        self.keyframe_data = keyframes
+
+    @property
+    def arrays(self) -> AnmKeyframeArrays:
+        if not isinstance(self.keyframe_data, AnmKeyframeArrays):
+            self.keyframe_data = AnmKeyframeArrays.from_keyframes(self.keyframe_data)
+        return self.keyframe_data
+
+    @arrays.setter
+    def arrays(self, arrays: AnmKeyframeArrays):
+        self.keyframe_data = arrays
+
+    @property
+    def keyframes_num(self) -> int:
+        return len(self.keyframe_data)
+
+    @property
+    def keyframe_cls(self) -> type:
+        if isinstance(self.keyframe_data, AnmKeyframeArrays):
+            return self.keyframe_data.keyframe_cls
+        return type(self.keyframe_data[0]) if self.keyframe_data else AnmKeyframe
+
+    def is_indexed_bones(self) -> bool:
+        return self.keyframe_cls.is_indexed_bones()
+
+    def is_pose_space(self) -> bool:
+        return self.keyframe_cls.is_pose_space()
 
     def is_mergable_with(self, other) -> bool:
         return sorted((self.keyframe_type, other.keyframe_type)) == [KeyframeType.AKI_COMPRESSED_ROT, KeyframeType.AKI_COMPRESSED_POS] \
             and self.duration == other.duration
 
     def merge_with(self, other):
-        for other_kf in other.keyframes:
-            merged_kf = next((kf for kf in self.keyframes if kf.time == other_kf.time and kf.bone_id == other_kf.bone_id), None)
-            if merged_kf:
-                if merged_kf.pos is None:
-                    merged_kf.pos = other_kf.pos
-                else:
-                    merged_kf.rot = other_kf.rot
+        """Fill the missing position or the rotation of keyframes from keyframes of other with the same time and bone.
+        Keyframes without a match are appended and can be matched by the following ones"""
+        arrays, other_arrays = self.arrays, other.arrays
+        keyframes_num = len(arrays)
+
+        # Hash join on (time, bone_id), the first keyframe with a key is its match
+        kf_ids = {}
+        for kf_id, key in enumerate(zip(arrays.times.tolist(), arrays.bone_ids.tolist())):
+            kf_ids.setdefault(key, kf_id)
+
+        targets = np.full(len(other_arrays), -1, dtype=np.int64)
+        appended = []
+        for other_id, key in enumerate(zip(other_arrays.times.tolist(), other_arrays.bone_ids.tolist())):
+            kf_id = kf_ids.get(key)
+            if kf_id is None:
+                kf_ids[key] = keyframes_num + len(appended)
+                appended.append(other_id)
             else:
-                self.keyframes.append(other_kf)
+                targets[other_id] = kf_id
 
-        self.keyframes.sort(key=lambda kf: (kf.time, kf.bone_id))
+        arrays = arrays.concatenate(other_arrays.take(appended))
+
+        # Keyframes matched several times are updated in rounds, in the order of other
+        other_ids = np.flatnonzero(targets >= 0)
+        other_ids = other_ids[np.argsort(targets[other_ids], kind='stable')]
+        group_starts = np.flatnonzero(np.diff(targets[other_ids], prepend=-1))
+        ranks = np.arange(len(other_ids)) - np.repeat(group_starts, np.diff(np.append(group_starts, len(other_ids))))
+
+        for rank in range(int(ranks.max()) + 1 if len(ranks) else 0):
+            src = other_ids[ranks == rank]
+            dst = targets[src]
+            fill_pos = ~arrays.has_pos[dst]
+
+            arrays.pos[dst[fill_pos]] = other_arrays.pos[src[fill_pos]]
+            arrays.has_pos[dst[fill_pos]] = other_arrays.has_pos[src[fill_pos]]
+            arrays.rot[dst[~fill_pos]] = other_arrays.rot[src[~fill_pos]]
+            arrays.has_rot[dst[~fill_pos]] = other_arrays.has_rot[src[~fill_pos]]
+
+        self.arrays = arrays.take(np.lexsort((arrays.bone_ids, arrays.times)))
 
 
 @dataclass
@@ -64,6 +217,53 @@ class RWAnmChunk:
     animation: AnmAnimation
 
 
+def resolve_bone_ids(times, prev_frame_offs, roots, stride=1, frame_offs=None, relative=False,
+                     first_bone_id=0, restart_bone_id=0) -> List[int]:
+    """Assign bone ids to keyframes by following their previous keyframe offsets.
+
+    A root keyframe at time 0 starts the next bone, other root keyframes restart
+    from restart_bone_id. Any other keyframe inherits the bone of the keyframe
+    it refers to. Offsets are mapped to keyframe indices by stride arithmetic,
+    or through the ascending frame_offs for records of variable size. With relative offsets
+    the previous keyframe is counted back from the current one.
+    """
+    keyframes_num = len(times)
+    times = np.asarray(times)
+    roots = np.asarray(roots, dtype=bool)
+    prev_frame_offs = np.asarray(prev_frame_offs, dtype=np.int64)
+    kf_ids = np.arange(keyframes_num)
+
+    if frame_offs is not None:
+        frame_offs = np.asarray(frame_offs, dtype=np.int64)
+        prev_kf_ids = np.searchsorted(frame_offs, prev_frame_offs)
+        prev_kf_ids[prev_kf_ids >= keyframes_num] = -1
+        prev_kf_ids[frame_offs[prev_kf_ids] != prev_frame_offs] = -1
+    else:
+        prev_kf_ids = prev_frame_offs // stride
+        if relative:
+            prev_kf_ids = kf_ids - prev_kf_ids
+        else:
+            prev_kf_ids[prev_frame_offs % stride != 0] = -1
+
+    dangling = ~roots & ((prev_kf_ids < 0) | (prev_kf_ids >= kf_ids))
+    if dangling.any():
+        kf_id = int(np.argmax(dangling))
+        raise KeyframeChainError("Keyframe %d refers to unknown previous keyframe offset 0x%X" %
+                                 (kf_id, prev_frame_offs[kf_id]))
+
+    bone_ids = []
+    bone_id = first_bone_id - 1
+
+    for root, time, prev_kf_id in zip(roots.tolist(), times.tolist(), prev_kf_ids.tolist()):
+        if root:
+            bone_id = bone_id + 1 if time == 0.0 else restart_bone_id
+        else:
+            bone_id = bone_ids[prev_kf_id]
+        bone_ids.append(bone_id)
+
+    return bone_ids
+
+
 def unpack_rw_lib_id(version):
     v = (version >> 14 & 0x3ff00) + 0x30000 | (version >> 16 & 0x3f)
     bin_ver = v & 0x3f
@@ -98,3 +298,77 @@ def calculate_linear_scale(data, unsigned=False):
         offset = (min_val + max_val) / 2
         scale = max((abs(min_val), abs(max_val))) - abs(offset)
     return offset, scale
+
+
+def calculate_linear_scale_array(values, unsigned=False):
+    """calculate_linear_scale for each column of values"""
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return np.zeros(values.shape[1]), np.ones(values.shape[1])
+
+    min_vals, max_vals = values.min(axis=0), values.max(axis=0)
+    if unsigned:
+        offset = min_vals
+        scale = max_vals - offset
+    else:
+        offset = (min_vals + max_vals) / 2
+        scale = np.maximum(np.abs(min_vals), np.abs(max_vals)) - np.abs(offset)
+
+    constant = max_vals == min_vals
+    return np.where(constant, 0.0, offset), np.where(constant, max_vals, scale)
+
+
+def quantize_linear(values, offset, scale):
+    """Map float32 values into offset and scale as float32 offset, scale and result.
+    The subtraction is done in float32 and the division in float64"""
+    offset = offset.astype(np.float32)
+    scale = scale.astype(np.float32)
+
+    diff = (np.asarray(values, dtype=np.float32) - offset).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = diff / scale
+    # Zero scale is only written for columns that are zero everywhere
+    res[:, scale == 0.0] = 0.0
+
+    return res.astype(np.float32), offset, scale
+
+
+def get_rw_keyframe_order(times, bone_ids):
+    """Return the keyframe order of RW files, keyframes are sorted by the time of the previous keyframe
+    of their bone, so the previous keyframe of each bone precedes it. First keyframes get one time unit before"""
+    times = np.asarray(times)
+    bone_ids = np.asarray(bone_ids)
+    by_bone = np.lexsort((times, bone_ids))
+    bone_times = times[by_bone]
+
+    # Time of the previous keyframe of the same bone
+    prev_times = bone_times - 1.0
+    same_bone = bone_ids[by_bone][1:] == bone_ids[by_bone][:-1]
+    prev_times[1:][same_bone] = bone_times[:-1][same_bone]
+
+    return by_bone[np.lexsort((bone_times, bone_ids[by_bone], prev_times))]
+
+
+def get_prev_frame_offs(bone_ids, stride, relative=False, cyclic=False):
+    """Offsets of the previous keyframe of the same bone for each keyframe.
+    The first keyframe of a bone gets KEYFRAME_PARENT_NONE_OFFSET or, if cyclic, the last keyframe of the bone.
+    Relative offsets are counted back from the keyframe itself"""
+    bone_ids = np.asarray(bone_ids)
+    keyframes_num = len(bone_ids)
+
+    order = np.argsort(bone_ids, kind='stable')
+    firsts = np.ones(keyframes_num, dtype=bool)
+    firsts[1:] = bone_ids[order][1:] != bone_ids[order][:-1]
+
+    prev_ids = np.empty(keyframes_num, dtype=np.int64)
+    prev_ids[order[1:]] = order[:-1]
+    if cyclic and keyframes_num:
+        starts = np.flatnonzero(firsts)
+        prev_ids[order[starts]] = order[np.append(starts[1:], keyframes_num) - 1]
+
+    kf_ids = np.arange(keyframes_num, dtype=np.int64)
+    offs = (kf_ids - prev_ids if relative else prev_ids) * stride
+    if not cyclic:
+        offs[order[firsts]] = KEYFRAME_PARENT_NONE_OFFSET
+
+    return offs.astype(np.uint32)
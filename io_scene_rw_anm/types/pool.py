@@ -0,0 +1,59 @@
+import multiprocessing
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from os import path
+
+# Least input in bytes each worker process has to get to be worth its start-up time
+MIN_WORKER_SIZE = 4 << 20
+
+
+def can_start_workers():
+    """Workers are started from sys.executable, before Blender 2.91 it is the Blender binary"""
+    return path.basename(sys.executable).lower().startswith("python")
+
+
+def get_workers_num(workers, sizes):
+    """Number of processes for inputs of sizes in bytes, workers set to 0 use all CPU cores.
+    Every worker gets at least one input and MIN_WORKER_SIZE bytes"""
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(sizes), sum(sizes) // MIN_WORKER_SIZE)
+    if workers > 1 and not can_start_workers():
+        return 1
+    return max(workers, 1)
+
+
+def run_tasks(func, args_list, workers=1):
+    """Yield (result, error) of func for each args in the order of args_list as soon as each is ready.
+    More than one worker runs func in a process pool, the remaining tasks are run here
+    if the pool can not be started or breaks"""
+    done_num = 0
+
+    if workers > 1:
+        try:
+            # Forking Blender is not safe, workers are started as new interpreters
+            with ProcessPoolExecutor(workers, multiprocessing.get_context('spawn')) as executor:
+                futures = [executor.submit(func, *args) for args in args_list]
+                for future in futures:
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        raise
+                    except Exception as e:
+                        yield None, e
+                    else:
+                        yield result, None
+                    done_num += 1
+        except (BrokenProcessPool, OSError) as e:
+            print("WARNING: Process pool failed (%s), reading serially" % e)
+
+    for args in args_list[done_num:]:
+        try:
+            result = func(*args)
+        except Exception as e:
+            yield None, e
+        else:
+            yield result, None
@@ -1,47 +1,37 @@
+import numpy as np
+
 from dataclasses import dataclass
-from mathutils import Quaternion, Vector
 
 from . binary_utils import *
-from . common import AnmAnimation, AnmKeyframe, KEYFRAME_PARENT_NONE_OFFSET
-
-
-def read_keyframes_ska(fd, keyframes_num):
-    keyframes = []
-    frame_offs = []
-    bone_id = -1
+from . common import AnmAnimation, AnmKeyframeArrays, KeyframeBlock, get_prev_frame_offs, resolve_bone_ids
 
-    for kf_id in range(keyframes_num):
-        frame_offs.append(kf_id * 36)
-        rot = read_float32(fd, 4)
-        rot = Quaternion((-rot[3], rot[0], rot[1], rot[2]))
-        pos = Vector(read_float32(fd, 3))
-        time = read_float32(fd)
-        prev_frame_off = read_uint32(fd)
+SKA_KEYFRAME_DTYPE = np.dtype([
+    ('rot', '<f4', 4),
+    ('pos', '<f4', 3),
+    ('time', '<f4'),
+    ('prev_frame_off', '<u4'),
+])
 
-        if prev_frame_off & 0x3F000000:
-            bone_id = bone_id + 1 if time == 0.0 else 0
-        else:
-            prev_kf_id = frame_offs.index(prev_frame_off)
-            bone_id = keyframes[prev_kf_id].bone_id
 
-        keyframes.append(AnmKeyframe(time, bone_id, pos, rot))
+def read_keyframes_ska(fd, keyframes_num) -> AnmKeyframeArrays:
+    data = read_array(fd, SKA_KEYFRAME_DTYPE, keyframes_num)
+    rots = data['rot'][:, (3, 0, 1, 2)] * np.array((-1.0, 1.0, 1.0, 1.0), dtype=np.float32)
+    block = KeyframeBlock(data['time'], data['prev_frame_off'], rots, data['pos'])
 
-    return keyframes
+    roots = (block.prev_frame_offs & 0x3F000000) != 0
+    bone_ids = resolve_bone_ids(block.times, block.prev_frame_offs, roots, 36)
 
+    return block.to_arrays(bone_ids)
 
-def write_keyframes_ska(fd, keyframes):
-    prev_frame_offs = {}
 
-    for kf_id, kf in enumerate(keyframes):
-        write_float32(fd, (kf.rot.x, kf.rot.y, kf.rot.z, -kf.rot.w))
-        write_float32(fd, kf.pos)
-        write_float32(fd, kf.time)
+def write_keyframes_ska(fd, keyframes: AnmKeyframeArrays):
+    data = np.empty(len(keyframes), dtype=SKA_KEYFRAME_DTYPE)
+    data['rot'] = keyframes.rot[:, (1, 2, 3, 0)] * np.array((1.0, 1.0, 1.0, -1.0), dtype=np.float32)
+    data['pos'] = keyframes.pos
+    data['time'] = keyframes.times
+    data['prev_frame_off'] = get_prev_frame_offs(keyframes.bone_ids, 36)
 
-        if kf.bone_id not in prev_frame_offs:
-            write_uint32(fd, KEYFRAME_PARENT_NONE_OFFSET)
-        else:
-            write_uint32(fd, prev_frame_offs[kf.bone_id])
-        prev_frame_offs[kf.bone_id] = kf_id * 36
+    write_array(fd, data)
 
 
 def read_ska_animation(fd):
@@ -53,9 +43,9 @@ def read_ska_animation(fd):
 
 
 def write_ska_animation(fd, animation: AnmAnimation):
-    write_uint32(fd, (len(animation.keyframes), animation.flags))
+    write_uint32(fd, (animation.keyframes_num, animation.flags))
     write_float32(fd, animation.duration)
-    write_keyframes_ska(fd, animation.keyframes)
+    write_keyframes_ska(fd, animation.arrays)
 
 
 @dataclass
@@ -68,13 +58,15 @@ class Ska:
         return cls(animation)
 
     @classmethod
-    def load(cls, filepath):
-        with open(filepath, 'rb') as fd:
+    def load(cls, filepath, use_mmap=False):
+        with BinaryReader.open(filepath, use_mmap) as fd:
             return cls.read(fd)
 
     def write(self, fd):
         write_ska_animation(fd, self.animation)
 
     def save(self, filepath):
-        with open(filepath, 'wb') as fd:
-            return self.write(fd)
+        fd = BinaryWriter(12 + self.animation.keyframes_num * 36)
+        self.write(fd)
+        with open(filepath, 'wb') as f:
+            f.write(fd.getbuffer())
@@ -2,17 +2,15 @@ from dataclasses import dataclass
 from os import SEEK_SET, SEEK_CUR
 from typing import List
 
-from . anm import read_anm_chunk
+from . anm import AnmBank, LazyRWAnmChunk, read_anm_chunk, read_anm_chunk_header
 from . binary_utils import read_uint32
 from . common import RWAnmChunk
 
 
 @dataclass
-class Tmo:
-    chunks: List[RWAnmChunk]
-
+class Tmo(AnmBank):
     @classmethod
-    def read(cls, fd):
+    def read(cls, fd, lazy=False):
         chunks: List[RWAnmChunk] = []
 
         chunks_num = read_uint32(fd)
@@ -24,13 +22,12 @@ class Tmo:
             next_chunk_pos = fd.tell() + chunk_size
 
             if chunk_size > 0:
-                chunks.append(read_anm_chunk(fd))
+                if lazy:
+                    header = read_anm_chunk_header(fd)
+                    chunks.append(LazyRWAnmChunk(fd, header) if header else None)
+                else:
+                    chunks.append(read_anm_chunk(fd))
 
             fd.seek(next_chunk_pos, SEEK_SET)
 
         return cls(chunks)
-
-    @classmethod
-    def load(cls, filepath):
-        with open(filepath, 'rb') as fd:
-            return cls.read(fd)
@@ -1,94 +1,62 @@
-from mathutils import Quaternion, Vector
-from typing import List
+import numpy as np
 
 from .. binary_utils import *
 from .. common import *
 
+AKI_ROT_KEYFRAME_DTYPE = np.dtype([
+    ('time', '<f4'),
+    ('prev_frame_off', '<u4'),
+    ('rot', '<u2', 4),
+])
 
-def read_keyframes_aki_compressed_rot(fd, keyframes_num) -> List[AnmKeyframe]:
-    keyframes: List[AnmKeyframe] = []
-    frame_offs = []
-    bone_id = -1
+# Stored as 14 bytes, keyframe offsets use the 16-byte stride of rotation keyframes
+AKI_POS_KEYFRAME_DTYPE = np.dtype([
+    ('time', '<f4'),
+    ('prev_frame_off', '<u4'),
+    ('pos', '<u2', 3),
+])
 
-    for kf_id in range(keyframes_num):
-        frame_offs.append(kf_id * 16)
-        time = read_float32(fd)
-        prev_frame_off = read_uint32(fd)
-        rot = read_float16(fd, 4)
-        rot = Quaternion((rot[3], rot[0], rot[1], rot[2]))
 
-        if time == 0.0:
-            bone_id = bone_id + 1
-        else:
-            prev_kf_id = frame_offs.index(prev_frame_off)
-            bone_id = keyframes[prev_kf_id].bone_id
+def read_keyframes_aki_compressed_rot(fd, keyframes_num) -> AnmKeyframeArrays:
+    data = read_array(fd, AKI_ROT_KEYFRAME_DTYPE, keyframes_num)
+    rots = decode_float16_array(data['rot'][:, (3, 0, 1, 2)])
+    block = KeyframeBlock(data['time'], data['prev_frame_off'], rots=rots)
 
-        keyframes.append(AnmKeyframe(time, bone_id, None, rot))
+    bone_ids = resolve_bone_ids(block.times, block.prev_frame_offs, block.times == 0.0, 16)
 
-    return keyframes
+    return block.to_arrays(bone_ids)
 
 
-def read_keyframes_aki_compressed_pos(fd, keyframes_num) -> List[AnmKeyframe]:
-    keyframes: List[AnmKeyframe] = []
-    frame_offs = []
-    bone_id = -1
+def read_keyframes_aki_compressed_pos(fd, keyframes_num) -> AnmKeyframeArrays:
+    data = read_array(fd, AKI_POS_KEYFRAME_DTYPE, keyframes_num)
+    pos_offset = np.array(read_float32(fd, 3), dtype=np.float32)
+    pos_scale = np.array(read_float32(fd, 3), dtype=np.float32)
 
-    for kf_id in range(keyframes_num):
-        frame_offs.append(kf_id * 16)
-        time = read_float32(fd)
-        prev_frame_off = read_uint32(fd)
-        pos = Vector(read_float16(fd, 3))
+    positions = decode_float16_array(data['pos']).astype(np.float32) * pos_scale + pos_offset
+    block = KeyframeBlock(data['time'], data['prev_frame_off'], positions=positions)
 
-        if time == 0.0:
-            bone_id = bone_id + 1
-        else:
-            prev_kf_id = frame_offs.index(prev_frame_off)
-            bone_id = keyframes[prev_kf_id].bone_id
+    bone_ids = resolve_bone_ids(block.times, block.prev_frame_offs, block.times == 0.0, 16)
 
-        keyframes.append(AnmKeyframe(time, bone_id, pos, None))
+    return block.to_arrays(bone_ids)
 
-    pos_offset = Vector(read_float32(fd, 3))
-    pos_scale = Vector(read_float32(fd, 3))
-    for kf in keyframes:
-        kf.pos *= pos_scale
-        kf.pos += pos_offset
 
-    return keyframes
+def write_keyframes_aki_compressed_rot(fd, keyframes: AnmKeyframeArrays):
+    data = np.empty(len(keyframes), dtype=AKI_ROT_KEYFRAME_DTYPE)
+    data['time'] = keyframes.times
+    data['prev_frame_off'] = get_prev_frame_offs(keyframes.bone_ids, 16, cyclic=True)
+    data['rot'] = encode_float16_array(keyframes.rot[:, (1, 2, 3, 0)])
 
+    write_array(fd, data)
 
-def write_keyframes_aki_compressed_rot(fd, keyframes: List[AnmKeyframe]):
-    prev_frame_offs = {}
 
-    for kf_id, kf in enumerate(keyframes):
-        prev_frame_offs[kf.bone_id] = kf_id * 16
+def write_keyframes_aki_compressed_pos(fd, keyframes: AnmKeyframeArrays):
+    positions, pos_offset, pos_scale = quantize_linear(keyframes.pos, *calculate_linear_scale_array(keyframes.pos))
 
-    for kf_id, kf in enumerate(keyframes):
-        write_float32(fd, kf.time)
-        write_uint32(fd, prev_frame_offs[kf.bone_id])
-        write_float16(fd, (kf.rot.x, kf.rot.y, kf.rot.z, kf.rot.w))
+    data = np.empty(len(keyframes), dtype=AKI_POS_KEYFRAME_DTYPE)
+    data['time'] = keyframes.times
+    data['prev_frame_off'] = get_prev_frame_offs(keyframes.bone_ids, 16, cyclic=True)
+    data['pos'] = encode_float16_array(positions)
 
-        prev_frame_offs[kf.bone_id] = kf_id * 16
-
-
-def write_keyframes_aki_compressed_pos(fd, keyframes: List[AnmKeyframe]):
-    prev_frame_offs = {}
-
-    for kf_id, kf in enumerate(keyframes):
-        prev_frame_offs[kf.bone_id] = kf_id * 16
-
-    pos_offset_x, pos_scale_x = calculate_linear_scale(tuple(kf.pos.x for kf in keyframes))
-    pos_offset_y, pos_scale_y = calculate_linear_scale(tuple(kf.pos.y for kf in keyframes))
-    pos_offset_z, pos_scale_z = calculate_linear_scale(tuple(kf.pos.z for kf in keyframes))
-
-    pos_offset = Vector((pos_offset_x, pos_offset_y, pos_offset_z))
-    pos_scale = Vector((pos_scale_x, pos_scale_y, pos_scale_z))
-
-    for kf_id, kf in enumerate(keyframes):
-        write_float32(fd, kf.time)
-        write_uint32(fd, prev_frame_offs[kf.bone_id])
-        write_float16(fd, Vector((v1/v2 for v1, v2 in zip(kf.pos - pos_offset, pos_scale))))
-
-        prev_frame_offs[kf.bone_id] = kf_id * 16
-
-    write_float32(fd, pos_offset)
-    write_float32(fd, pos_scale)
+    write_array(fd, data)
+    write_float32(fd, pos_offset.tolist())
+    write_float32(fd, pos_scale.tolist())
@@ -1,76 +1,73 @@
-from mathutils import Quaternion, Vector
-from typing import List
+import numpy as np
 
 from .. binary_utils import *
 from .. common import *
 
+CLIMAX_KEYFRAME_HEADER_DTYPE = np.dtype([
+    ('prev_frame_off', '<u4'),
+    ('time', '<f4'),
+])
 
-def read_keyframes_climax(fd, keyframes_num) -> List[AnmKeyframe]:
-    keyframes: List[AnmKeyframe] = []
-    bone_id = -1
+CLIMAX_KEYFRAME_DTYPE = np.dtype([
+    ('compressed1', '<u4'),
+    ('compressed2', '<u2'),
+    ('pos', '<u2', 3),
+])
 
-    pos_offset = Vector(read_float32(fd, 3))
-    pos_scale = Vector(read_float32(fd, 3))
 
-    for kf_id in range(keyframes_num):
-        prev_frame = read_uint32(fd)
-        time = read_float32(fd)
+def decode_climax_rotations(compressed1, compressed2):
+    """Unpack 12-bit quaternion components to (w, x, y, z)"""
+    compressed1 = compressed1.astype(np.int64)
+    compressed2 = compressed2.astype(np.int64)
 
-        if prev_frame & 0x3F000000:
-            bone_id = bone_id + 1 if time == 0.0 else 0
-        else:
-            bone_id = keyframes[kf_id - prev_frame // 20].bone_id
+    q = np.empty((len(compressed1), 4), dtype=np.int64)
+    q[:, 1] = compressed1 >> 20
+    q[:, 2] = (compressed1 >> 8) & 0xFFF
+    q[:, 3] = ((compressed1 * 16) & 0xFFF) | (compressed2 >> 12)
+    q[:, 0] = compressed2 & 0xFFF
 
-        keyframes.append(AnmKeyframe(time, bone_id, Vector(), Quaternion()))
+    return (q - 2048.0) / 2047.0
 
-    for kf_id in range(keyframes_num):
-        compressed1 = read_uint32(fd)
-        compressed2 = read_uint16(fd)
 
-        qx = ((compressed1 >> 20) - 2048.0) / 2047.0
-        qy = (((compressed1 >> 8) & 0xFFF) - 2048.0) / 2047.0
-        qz = ((((compressed1 * 16) & 0xFFF) | (compressed2 >> 12)) - 2048.0) / 2047.0
-        qw = ((compressed2 & 0xFFF) - 2048.0 ) / 2047.0
+def encode_climax_rotations(rots):
+    """Pack (w, x, y, z) quaternions to 12-bit components"""
+    qw, qx, qy, qz = np.round(np.asarray(rots, dtype=np.float64) * 2047.0 + 2048.0).astype(np.int64).T
 
-        keyframes[kf_id].pos = Vector(read_uint16(fd, 3)) / 65535.0 * pos_scale + pos_offset
-        keyframes[kf_id].rot = Quaternion((qw, qx, qy, qz))
+    compressed1 = (qx << 20) | (qy << 8) | ((qz & 0xFFF0) >> 4)
+    compressed2 = ((qz & 0x0F) << 12) | (qw & 0xFFF)
+    return compressed1, compressed2
 
-    return keyframes
 
+def read_keyframes_climax(fd, keyframes_num) -> AnmKeyframeArrays:
+    pos_offset = np.array(read_float32(fd, 3), dtype=np.float32)
+    pos_scale = np.array(read_float32(fd, 3), dtype=np.float32)
 
-def write_keyframes_climax(fd, keyframes: List[AnmKeyframe]):
-    prev_frame_offs = {}
+    headers = read_array(fd, CLIMAX_KEYFRAME_HEADER_DTYPE, keyframes_num)
+    data = read_array(fd, CLIMAX_KEYFRAME_DTYPE, keyframes_num)
 
-    pos_offset_x, pos_scale_x = calculate_linear_scale(tuple(kf.pos.x for kf in keyframes), True)
-    pos_offset_y, pos_scale_y = calculate_linear_scale(tuple(kf.pos.y for kf in keyframes), True)
-    pos_offset_z, pos_scale_z = calculate_linear_scale(tuple(kf.pos.z for kf in keyframes), True)
+    rots = decode_climax_rotations(data['compressed1'], data['compressed2'])
+    # Division by 65535 is done as float32 multiplication by its reciprocal
+    positions = data['pos'].astype(np.float32) * (np.float32(1.0) / np.float32(65535.0)) * pos_scale + pos_offset
+    block = KeyframeBlock(headers['time'], headers['prev_frame_off'], rots, positions)
 
-    pos_offset = Vector((pos_offset_x, pos_offset_y, pos_offset_z))
-    pos_scale = Vector((pos_scale_x, pos_scale_y, pos_scale_z))
+    roots = (block.prev_frame_offs & 0x3F000000) != 0
+    bone_ids = resolve_bone_ids(block.times, block.prev_frame_offs, roots, 20, relative=True)
 
-    write_float32(fd, pos_offset)
-    write_float32(fd, pos_scale)
+    return block.to_arrays(bone_ids)
 
-    for kf_id, kf in enumerate(keyframes):
-        if kf.bone_id not in prev_frame_offs:
-            write_uint32(fd, KEYFRAME_PARENT_NONE_OFFSET)
-        else:
-            write_uint32(fd, (kf_id - prev_frame_offs[kf.bone_id]) * 20)
-        prev_frame_offs[kf.bone_id] = kf_id
 
-        write_float32(fd, kf.time)
+def write_keyframes_climax(fd, keyframes: AnmKeyframeArrays):
+    positions, pos_offset, pos_scale = quantize_linear(keyframes.pos, *calculate_linear_scale_array(keyframes.pos, True))
 
-    for kf in keyframes:
-        qx = round((kf.rot.x * 2047.0) + 2048.0)
-        qy = round((kf.rot.y * 2047.0) + 2048.0)
-        qz = round((kf.rot.z * 2047.0) + 2048.0)
-        qw = round((kf.rot.w * 2047.0) + 2048.0)
+    write_float32(fd, pos_offset.tolist())
+    write_float32(fd, pos_scale.tolist())
 
-        compressed1 = (qx << 20) | (qy << 8) | ((qz & 0xFFF0) >> 4)
-        compressed2 = ((qz & 0x0F) << 12) | (qw & 0xFFF)
+    headers = np.empty(len(keyframes), dtype=CLIMAX_KEYFRAME_HEADER_DTYPE)
+    headers['prev_frame_off'] = get_prev_frame_offs(keyframes.bone_ids, 20, relative=True)
+    headers['time'] = keyframes.times
+    write_array(fd, headers)
 
-        write_uint32(fd, compressed1)
-        write_uint16(fd, compressed2)
-
-        pos = Vector((v1/v2 for v1, v2 in zip(kf.pos - pos_offset, pos_scale)))
-        write_uint16(fd, (round(pos.x * 65535), round(pos.y * 65535), round(pos.z * 65535)))
+    data = np.empty(len(keyframes), dtype=CLIMAX_KEYFRAME_DTYPE)
+    data['compressed1'], data['compressed2'] = encode_climax_rotations(keyframes.rot)
+    data['pos'] = np.round(positions.astype(np.float64) * 65535)
+    write_array(fd, data)
@@ -1,51 +1,43 @@
-from mathutils import Quaternion, Vector
-from typing import List
+import numpy as np
 
 from .. binary_utils import *
 from .. common import *
 
+EIGHTING_KEYFRAME_DTYPE = np.dtype([
+    ('rot', '<i2', 4),
+    ('pos', '<i2', 3),
+    ('bone_id', '<u2'),
+    ('time', '<f4'),
+    ('prev_frame_off', '<u4'),
+])
+
 
 class Anm8ingKeyframe(AnmKeyframe):
-    def is_indexed_bones(self) -> bool:
+    @classmethod
+    def is_indexed_bones(cls) -> bool:
         return False
 
-    def is_pose_space(self) -> bool:
+    @classmethod
+    def is_pose_space(cls) -> bool:
         return True
 
 
-def read_keyframes_8ing(fd, keyframes_num) -> List[Anm8ingKeyframe]:
-    keyframes: List[Anm8ingKeyframe] = []
-
-    for _ in range(keyframes_num):
-        rot = read_int16(fd, 4)
-        rot = Quaternion((rot[3] / 8192, rot[0] / 8192, rot[1] / 8192, rot[2] / 8192))
-        pos = Vector(v / 8192 for v in read_int16(fd, 3))
-        bone_id = read_uint16(fd)
-        time = read_float32(fd)
-        prev_frame_off = read_uint32(fd)
-
-        keyframes.append(Anm8ingKeyframe(time, bone_id, pos, rot))
-
-    return keyframes
-
+def read_keyframes_8ing(fd, keyframes_num) -> AnmKeyframeArrays:
+    data = read_array(fd, EIGHTING_KEYFRAME_DTYPE, keyframes_num)
+    rots = data['rot'][:, (3, 0, 1, 2)] / 8192
+    positions = data['pos'] / 8192
+    block = KeyframeBlock(data['time'], data['prev_frame_off'], rots, positions)
 
-def write_keyframes_8ing(fd, keyframes: List[AnmKeyframe]):
-    prev_frame_offs = {}
+    return block.to_arrays(data['bone_id'], Anm8ingKeyframe)
 
-    for kf_id, kf in enumerate(keyframes):
-        write_int16(fd, (
-            int(kf.rot.x * 8192),
-            int(kf.rot.y * 8192),
-            int(kf.rot.z * 8192),
-            int(kf.rot.w * 8192))
-        )
-        write_int16(fd, (int(v * 8192) for v in kf.pos))
-        write_uint16(fd, kf.bone_id)
-        write_float32(fd, kf.time)
 
-        if kf.time == 0.0:
-            write_uint32(fd, KEYFRAME_PARENT_NONE_OFFSET)
-        else:
-            write_uint32(fd, prev_frame_offs[kf.bone_id])
+def write_keyframes_8ing(fd, keyframes: AnmKeyframeArrays):
+    data = np.empty(len(keyframes), dtype=EIGHTING_KEYFRAME_DTYPE)
+    data['rot'] = np.trunc(keyframes.rot[:, (1, 2, 3, 0)].astype(np.float64) * 8192)
+    data['pos'] = np.trunc(keyframes.pos.astype(np.float64) * 8192)
+    data['bone_id'] = keyframes.bone_ids
+    data['time'] = keyframes.times
+    data['prev_frame_off'] = np.where(keyframes.times == 0.0, KEYFRAME_PARENT_NONE_OFFSET,
+                                      get_prev_frame_offs(keyframes.bone_ids, 24))
 
-        prev_frame_offs[kf.bone_id] = kf_id * 24
+    write_array(fd, data)
@@ -1,98 +1,128 @@
-from mathutils import Quaternion, Vector
-from typing import List
+import numpy as np
 
 from .. binary_utils import *
 from .. common import *
 
+TM_ROT_KEYFRAME_DTYPE = np.dtype([
+    ('kf_type', 'u1'),
+    ('time', '<f4'),
+    ('rot', '<u2', 4),
+    ('prev_frame_off', '<u4'),
+])
+
+TM_HALF_POS_KEYFRAME_DTYPE = np.dtype([
+    ('kf_type', 'u1'),
+    ('time', '<f4'),
+    ('rot', '<u2', 4),
+    ('pos', '<u2', 3),
+    ('prev_frame_off', '<u4'),
+])
+
+TM_FLOAT_POS_KEYFRAME_DTYPE = np.dtype([
+    ('kf_type', 'u1'),
+    ('time', '<f4'),
+    ('rot', '<u2', 4),
+    ('pos', '<f4', 3),
+    ('prev_frame_off', '<u4'),
+])
+
+# Record of each keyframe type
+TM_KEYFRAME_DTYPES = (TM_ROT_KEYFRAME_DTYPE, TM_HALF_POS_KEYFRAME_DTYPE, TM_FLOAT_POS_KEYFRAME_DTYPE)
+
+# Sizes of the records at runtime, used by keyframe offsets
+TM_KEYFRAME_FRAME_SIZES = np.array((18, 24, 30), dtype=np.int64)
+
+TM_COMPRESSED_ROT_KEYFRAME_DTYPE = np.dtype([
+    ('time', '<f4'),
+    ('rot', '<i2', 4),
+    ('prev_frame_off', '<u4'),
+])
+
+
+def scan_keyframes_tm(data, keyframes_num):
+    """First pass over variable size records: read only the type bytes and return
+    the types with the record offsets in data"""
+    kf_types = bytearray(keyframes_num)
+    record_offs = np.empty(keyframes_num, dtype=np.int64)
+    record_sizes = tuple(dtype.itemsize for dtype in TM_KEYFRAME_DTYPES)
+
+    record_off = 0
+    for kf_id in range(keyframes_num):
+        kf_type = data[record_off]
+        if kf_type >= len(record_sizes):
+            raise ValueError("Unknown TrashMasters keyframe type %d at keyframe %d" % (kf_type, kf_id))
+        kf_types[kf_id] = kf_type
+        record_offs[kf_id] = record_off
+        record_off += record_sizes[kf_type]
+
+    return np.frombuffer(kf_types, dtype=np.uint8), record_offs, record_off
 
-def read_keyframes_tm(fd, keyframes_num) -> List[AnmKeyframe]:
-    keyframes: List[AnmKeyframe] = []
-    frame_offs = []
-    bone_id = -1
-    next_frame_off = 0
 
+def read_keyframes_tm(fd, keyframes_num) -> AnmKeyframeArrays:
     keyframes_with_pos_num = read_uint32(fd)
     flag = read_uint8(fd)
 
     if flag & 1:
         start_bone_id = read_uint32(fd)
         start_bone_name = read_string(fd, 64)
-        bone_id += start_bone_id
     else:
         start_bone_id = 0
 
-    pos_scale = Vector(read_float32(fd, 3))
-    pos_offset = Vector(read_float32(fd, 3))
-
-    for _ in range(keyframes_num):
-        frame_offs.append(next_frame_off)
-        kf_type = read_uint8(fd)
-        time = read_float32(fd)
-        rot = read_float16(fd, 4)
-        rot = Quaternion((rot[3], rot[0], rot[1], rot[2]))
-
-        if kf_type == 0:
-            pos = None
-            next_frame_off += 18
-
-        elif kf_type == 1:
-            pos = Vector(read_float16(fd, 3)) * pos_scale + pos_offset
-            next_frame_off += 24
-
+    pos_scale = np.array(read_float32(fd, 3), dtype=np.float32)
+    pos_offset = np.array(read_float32(fd, 3), dtype=np.float32)
+
+    # Records are at most 29 bytes, the reader is moved back to the actual end after the scan
+    block_start = fd.tell()
+    raw_data = fd.read(keyframes_num * TM_FLOAT_POS_KEYFRAME_DTYPE.itemsize)
+    kf_types, record_offs, block_size = scan_keyframes_tm(raw_data, keyframes_num)
+    data = np.frombuffer(raw_data, dtype=np.uint8)
+    fd.seek(block_start + block_size, SEEK_SET)
+
+    times = np.empty(keyframes_num, dtype=np.float32)
+    prev_frame_offs = np.empty(keyframes_num, dtype=np.uint32)
+    rots = np.empty((keyframes_num, 4), dtype=np.float32)
+    positions = np.zeros((keyframes_num, 3), dtype=np.float32)
+
+    for kf_type, dtype in enumerate(TM_KEYFRAME_DTYPES):
+        kf_ids = np.flatnonzero(kf_types == kf_type)
+        records = data[record_offs[kf_ids, np.newaxis] + np.arange(dtype.itemsize)].view(dtype)[:, 0]
+
+        times[kf_ids] = records['time']
+        prev_frame_offs[kf_ids] = records['prev_frame_off']
+        rots[kf_ids] = decode_float16_array(records['rot'][:, (3, 0, 1, 2)])
+        if kf_type == 1:
+            positions[kf_ids] = decode_float16_array(records['pos']).astype(np.float32) * pos_scale + pos_offset
         elif kf_type == 2:
-            pos = read_float32(fd, 3)
-            next_frame_off += 30
+            positions[kf_ids] = records['pos']
 
-        prev_frame_off = read_uint32(fd)
+    # Keyframe offsets are counted with the runtime record sizes
+    frame_offs = np.zeros(keyframes_num, dtype=np.int64)
+    np.cumsum(TM_KEYFRAME_FRAME_SIZES[kf_types][:-1], out=frame_offs[1:])
 
-        if prev_frame_off == 0:
-            bone_id = bone_id + 1 if time == 0.0 else start_bone_id
-        else:
-            prev_kf_id = frame_offs.index(prev_frame_off)
-            bone_id = keyframes[prev_kf_id].bone_id
-
-        keyframes.append(AnmKeyframe(time, bone_id, pos, rot))
+    roots = prev_frame_offs == 0
+    bone_ids = resolve_bone_ids(times, prev_frame_offs, roots, frame_offs=frame_offs,
+                                first_bone_id=start_bone_id, restart_bone_id=start_bone_id)
 
+    keyframes = AnmKeyframeArrays.from_columns(times, bone_ids, positions, rots)
+    keyframes.has_pos = kf_types != 0
     return keyframes
 
 
-def read_keyframes_tm_compressed_rot(fd, keyframes_num) -> List[AnmKeyframe]:
-    keyframes: List[AnmKeyframe] = []
-    frame_offs = []
-    bone_id = -1
-
-    for kf_id in range(keyframes_num):
-        frame_offs.append(kf_id * 16)
-        time = read_float32(fd)
-        rot = read_int16(fd, 4)
-        rot = Quaternion((rot[3] / 32767, rot[0] / 32767, rot[1] / 32767, rot[2] / 32767))
-        prev_frame_off = read_uint32(fd)
-
-        if prev_frame_off & 0x3F000000:
-            bone_id = bone_id + 1 if time == 0.0 else 0
-        else:
-            prev_kf_id = frame_offs.index(prev_frame_off)
-            bone_id = keyframes[prev_kf_id].bone_id
-
-        keyframes.append(AnmKeyframe(time, bone_id, None, rot))
+def read_keyframes_tm_compressed_rot(fd, keyframes_num) -> AnmKeyframeArrays:
+    data = read_array(fd, TM_COMPRESSED_ROT_KEYFRAME_DTYPE, keyframes_num)
+    rots = data['rot'][:, (3, 0, 1, 2)] / 32767
+    block = KeyframeBlock(data['time'], data['prev_frame_off'], rots=rots)
 
-    return keyframes
+    roots = (block.prev_frame_offs & 0x3F000000) != 0
+    bone_ids = resolve_bone_ids(block.times, block.prev_frame_offs, roots, 16)
 
+    return block.to_arrays(bone_ids)
 
-def write_keyframes_tm_compressed_rot(fd, keyframes: List[AnmKeyframe]):
-    prev_frame_offs = {}
 
-    for kf_id, kf in enumerate(keyframes):
-        write_float32(fd, kf.time)
-        write_int16(fd, (
-            int(kf.rot.x * 32767),
-            int(kf.rot.y * 32767),
-            int(kf.rot.z * 32767),
-            int(kf.rot.w * 32767))
-        )
+def write_keyframes_tm_compressed_rot(fd, keyframes: AnmKeyframeArrays):
+    data = np.empty(len(keyframes), dtype=TM_COMPRESSED_ROT_KEYFRAME_DTYPE)
+    data['time'] = keyframes.times
+    data['rot'] = np.trunc(keyframes.rot[:, (1, 2, 3, 0)].astype(np.float64) * 32767)
+    data['prev_frame_off'] = get_prev_frame_offs(keyframes.bone_ids, 16)
 
-        if kf.bone_id not in prev_frame_offs:
-            write_uint32(fd, KEYFRAME_PARENT_NONE_OFFSET)
-        else:
-            write_uint32(fd, prev_frame_offs[kf.bone_id])
-        prev_frame_offs[kf.bone_id] = kf_id * 16
+    write_array(fd, data)
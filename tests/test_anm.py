@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from io_scene_rw_anm.types.anm import ANM_CHUNK_ID, ANM_ANIMATION_VERSION, Anm, write_anm_animation
+from io_scene_rw_anm.types.binary_utils import BinaryReader, BinaryWriter, write_uint32
+from io_scene_rw_anm.types.common import AnmAnimation, AnmKeyframeArrays, KeyframeType, RWAnmChunk
+
+RW_VERSION = 0x1803FFFF
+
+
+def make_animation(keyframe_type, bones_num, frames_num, seed=0):
+    rng = np.random.default_rng(seed)
+    times = np.repeat(np.arange(frames_num, dtype=np.float32) / 30, bones_num)
+    bone_ids = np.tile(np.arange(bones_num), frames_num)
+    rots = rng.standard_normal((len(times), 4))
+    rots /= np.linalg.norm(rots, axis=1, keepdims=True)
+    pos = rng.uniform(-2.0, 2.0, (len(times), 3))
+    arrays = AnmKeyframeArrays.from_columns(times, bone_ids, pos, rots)
+    return AnmAnimation(ANM_ANIMATION_VERSION, keyframe_type, 0, float(times[-1]), arrays)
+
+
+def write_old_anm(animations):
+    """Chunks with the size field of the earlier plugin writer, 20 + 36 bytes per keyframe for every type"""
+    fd = BinaryWriter()
+    for animation in animations:
+        write_uint32(fd, (ANM_CHUNK_ID, 20 + animation.keyframes_num * 36, RW_VERSION))
+        write_anm_animation(fd, animation)
+    return bytes(fd.getbuffer())
+
+
+def assert_arrays_equal(arrays, expected):
+    for name in ('times', 'bone_ids', 'pos', 'rot', 'has_pos', 'has_rot'):
+        np.testing.assert_array_equal(getattr(arrays, name), getattr(expected, name), err_msg=name)
+
+
+@pytest.mark.parametrize("keyframe_type", [KeyframeType.COMPRESSED, KeyframeType.TM_COMPRESSED_ROT, KeyframeType.CLIMAX])
+def test_lazy_read_old_chunk_size(keyframe_type):
+    animations = [make_animation(keyframe_type, 3, 5, 0), make_animation(keyframe_type, 4, 7, 1)]
+    data = write_old_anm(animations)
+
+    expected = Anm.read(BinaryReader(data))
+    anm = Anm.read(BinaryReader(data), True)
+
+    assert len(expected.chunks) == len(anm.chunks) == 2
+    for chunk, expected_chunk in zip(anm.chunks, expected.chunks):
+        assert chunk.version == RW_VERSION
+        assert_arrays_equal(chunk.animation.arrays, expected_chunk.animation.arrays)
+
+    # Released chunks are decoded again from their offset
+    anm.chunks[1].release()
+    assert_arrays_equal(anm.chunks[1].animation.arrays, expected.chunks[1].animation.arrays)
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+from io_scene_rw_anm.types.common import KEYFRAME_PARENT_NONE_OFFSET, KeyframeChainError, resolve_bone_ids
+
+
+# Bone chain resolution of the scalar readers, kept as the reference
+def reference_resolve_bone_ids(times, prev_frame_offs, roots, frame_offs, first_bone_id=0, restart_bone_id=0):
+    bone_ids = []
+    bone_id = first_bone_id - 1
+    for kf_id, (time, prev_frame_off, root) in enumerate(zip(times, prev_frame_offs, roots)):
+        if root:
+            bone_id = bone_id + 1 if time == 0.0 else restart_bone_id
+        else:
+            bone_id = bone_ids[frame_offs[:kf_id].index(prev_frame_off)]
+        bone_ids.append(bone_id)
+    return bone_ids
+
+
+def reference_resolve_relative_bone_ids(times, prev_frame_offs, roots, stride):
+    bone_ids = []
+    bone_id = -1
+    for kf_id, (time, prev_frame_off, root) in enumerate(zip(times, prev_frame_offs, roots)):
+        if root:
+            bone_id = bone_id + 1 if time == 0.0 else 0
+        else:
+            bone_id = bone_ids[kf_id - prev_frame_off // stride]
+        bone_ids.append(bone_id)
+    return bone_ids
+
+
+def make_chain(rng, bones_num, frames_num, restarts_num=0):
+    """Times and previous keyframe indices where each keyframe follows the previous one of its bone,
+    -1 marks roots. Bones start at time 0, restarts_num later keyframes are roots at a later time"""
+    times, prev_ids = [], []
+    last_ids = {}
+    pending = [bone_id for bone_id in range(bones_num) for _ in range(frames_num - 1)]
+    rng.shuffle(pending)
+
+    for bone_id in list(range(bones_num)) + pending:
+        prev_id = last_ids.get(bone_id, -1)
+        times.append(0.0 if prev_id < 0 else times[prev_id] + float(rng.integers(1, 4)) / 30)
+        prev_ids.append(prev_id)
+        last_ids[bone_id] = len(times) - 1
+
+    prev_ids = np.array(prev_ids)
+    if restarts_num and len(pending):
+        prev_ids[bones_num + rng.choice(len(pending), min(restarts_num, len(pending)), replace=False)] = -1
+    return np.array(times, dtype=np.float32), prev_ids
+
+
+@pytest.mark.parametrize("stride", [16, 24, 36])
+@pytest.mark.parametrize("seed", range(5))
+def test_stride_offsets(stride, seed):
+    rng = np.random.default_rng(seed)
+    times, prev_ids = make_chain(rng, int(rng.integers(1, 10)), int(rng.integers(1, 10)), int(rng.integers(0, 4)))
+    roots = prev_ids < 0
+    prev_frame_offs = np.where(roots, KEYFRAME_PARENT_NONE_OFFSET, prev_ids * stride)
+
+    expected = reference_resolve_bone_ids(times.tolist(), prev_frame_offs.tolist(), roots.tolist(),
+                                          [kf_id * stride for kf_id in range(len(times))])
+    assert resolve_bone_ids(times, prev_frame_offs, roots, stride) == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_relative_offsets(seed):
+    rng = np.random.default_rng(seed)
+    times, prev_ids = make_chain(rng, int(rng.integers(1, 10)), int(rng.integers(1, 10)), int(rng.integers(0, 4)))
+    roots = prev_ids < 0
+    prev_frame_offs = np.where(roots, KEYFRAME_PARENT_NONE_OFFSET, (np.arange(len(times)) - prev_ids) * 20)
+
+    expected = reference_resolve_relative_bone_ids(times.tolist(), prev_frame_offs.tolist(), roots.tolist(), 20)
+    assert resolve_bone_ids(times, prev_frame_offs, roots, 20, relative=True) == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_variable_frame_offsets(seed):
+    rng = np.random.default_rng(seed)
+    times, prev_ids = make_chain(rng, int(rng.integers(1, 10)), int(rng.integers(1, 10)), int(rng.integers(0, 4)))
+    roots = prev_ids < 0
+    frame_offs = np.zeros(len(times), dtype=np.int64)
+    np.cumsum(rng.choice((18, 24, 30), len(times) - 1), out=frame_offs[1:])
+    prev_frame_offs = np.where(roots, 0, frame_offs[prev_ids])
+    start_bone_id = int(rng.integers(0, 5))
+
+    expected = reference_resolve_bone_ids(times.tolist(), prev_frame_offs.tolist(), roots.tolist(), frame_offs.tolist(),
+                                          start_bone_id, start_bone_id)
+    assert resolve_bone_ids(times, prev_frame_offs, roots, frame_offs=frame_offs,
+                            first_bone_id=start_bone_id, restart_bone_id=start_bone_id) == expected
+
+
+def test_roots_by_time():
+    # AKI keyframes are roots when their time is 0, whatever their offset
+    times = np.array([0.0, 0.0, 0.5, 0.5, 1.0], dtype=np.float32)
+    prev_frame_offs = np.array([64, 16, 16, 0, 32])
+
+    assert resolve_bone_ids(times, prev_frame_offs, times == 0.0, 16) == [0, 1, 1, 0, 1]
+
+
+@pytest.mark.parametrize("prev_frame_off", [
+    40,  # past the keyframe itself
+    32,  # the keyframe itself
+    17,  # not on a keyframe boundary
+])
+def test_dangling_offset(prev_frame_off):
+    times = np.array([0.0, 0.0, 0.5], dtype=np.float32)
+    roots = np.array([True, True, False])
+
+    with pytest.raises(KeyframeChainError):
+        resolve_bone_ids(times, np.array([KEYFRAME_PARENT_NONE_OFFSET] * 2 + [prev_frame_off]), roots, 16)
+
+
+def test_dangling_variable_offset():
+    times = np.array([0.0, 0.5], dtype=np.float32)
+
+    with pytest.raises(KeyframeChainError):
+        resolve_bone_ids(times, np.array([0, 10]), np.array([True, False]), frame_offs=np.array([0, 18]))
+
+
+def test_empty():
+    assert resolve_bone_ids(np.zeros(0, dtype=np.float32), np.zeros(0), np.zeros(0, dtype=bool), 36) == []
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from io_scene_rw_anm.cli import main
+from io_scene_rw_anm.parse_rw_anm import read_rw_animations
+from io_scene_rw_anm.types.anm import ANM_CHUNK_ID, ANM_ANIMATION_VERSION
+from io_scene_rw_anm.types.binary_utils import BinaryWriter, write_float32, write_uint32
+from io_scene_rw_anm.types.common import AnmKeyframeArrays, KeyframeType, get_rw_keyframe_order
+from io_scene_rw_anm.types.vendors.aki import write_keyframes_aki_compressed_pos, write_keyframes_aki_compressed_rot
+
+RW_VERSION = 0x1803FFFF
+
+
+def make_aki_arrays(rng, bones_num, frames_num):
+    """Keyframes in RW order where every bone has its own times, values are exact in float16"""
+    times = np.concatenate([np.cumsum(np.append(0, rng.integers(1, 4, frames_num - 1))) for _ in range(bones_num)]) / 32
+    bone_ids = np.repeat(np.arange(bones_num), frames_num)
+    order = get_rw_keyframe_order(times, bone_ids)
+
+    pos = rng.integers(-64, 64, (len(times), 3)) / 16
+    rots = rng.integers(-16, 16, (len(times), 4)) / 16
+    return AnmKeyframeArrays.from_columns(times, bone_ids, pos, rots).take(order)
+
+
+def write_aki_anm(filepath, arrays, duration):
+    """Rotation chunk followed by the position chunk, as AKI games store them"""
+    fd = BinaryWriter()
+    for keyframe_type, writer_func in ((KeyframeType.AKI_COMPRESSED_ROT, write_keyframes_aki_compressed_rot),
+                                       (KeyframeType.AKI_COMPRESSED_POS, write_keyframes_aki_compressed_pos)):
+        animation = BinaryWriter()
+        write_uint32(animation, (ANM_ANIMATION_VERSION, keyframe_type, len(arrays), 0))
+        write_float32(animation, duration)
+        writer_func(animation, arrays)
+
+        write_uint32(fd, (ANM_CHUNK_ID, animation.tell(), RW_VERSION))
+        fd.write(animation.getbuffer())
+
+    with open(filepath, 'wb') as f:
+        f.write(fd.getbuffer())
+
+
+@pytest.mark.parametrize("output_format, ext", [("uncompressed", ".anm"), ("ska", ".ska")])
+def test_convert_merged_aki(tmp_path, output_format, ext):
+    arrays = make_aki_arrays(np.random.default_rng(0), 4, 6)
+    duration = float(arrays.times.max())
+    write_aki_anm(tmp_path / "walk.anm", arrays, duration)
+
+    # Merged keyframes are sorted by time and bone, not in the order of RW blocks
+    merged, _ = read_rw_animations(str(tmp_path / "walk.anm"))
+    assert len(merged) == 1
+    merged = merged[0].arrays
+    assert merged.bone_ids.tolist() != arrays.bone_ids.tolist()
+
+    assert main(["-j", "1", "convert", str(tmp_path / "walk.anm"), "-o", str(tmp_path / "out"),
+                 "-f", output_format]) == 0
+
+    rw_animations, _ = read_rw_animations(str(tmp_path / "out" / ("walk" + ext)))
+    assert len(rw_animations) == 1
+    assert rw_animations[0].duration == duration
+
+    # Keyframes are written back in the order of the source blocks with the merged values
+    converted = rw_animations[0].arrays
+    np.testing.assert_array_equal(converted.times, arrays.times)
+    np.testing.assert_array_equal(converted.bone_ids, arrays.bone_ids)
+
+    expected = merged.take(get_rw_keyframe_order(merged.times, merged.bone_ids))
+    for name in ('times', 'bone_ids', 'pos', 'rot', 'has_pos', 'has_rot'):
+        np.testing.assert_array_equal(getattr(converted, name), getattr(expected, name), err_msg=name)
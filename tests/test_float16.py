@@ -0,0 +1,74 @@
+import numpy as np
+
+from io_scene_rw_anm.types.binary_utils import (
+    decode_float16,
+    decode_float16_array,
+    encode_float16,
+    encode_float16_array,
+)
+
+ALL_CODES = np.arange(0x10000, dtype=np.uint16)
+
+
+# Scalar codec the table and array versions replaced, kept as the reference
+def reference_decode_float16(value):
+    sign = -1.0 if (value >> 15) else 1.0
+    if (value & 0x7FFF) == 0:
+        return sign * 0.0
+    exponent = ((value >> 11) & 15) - 15
+    mantissa = (value & 0x07FF) / 0x800 + 1.0
+    return sign * mantissa * 2**exponent
+
+
+def reference_encode_float16(value):
+    if value < 0:
+        sign = 1
+        value = -value
+    else:
+        sign = 0
+
+    if value == 0:
+        return sign << 15
+
+    exponent = 0
+    while value < 1.0 and exponent > -15:
+        value *= 2.0
+        exponent -= 1
+    exponent += 15
+    mantissa = int((value - 1.0) * 0x800) & 0x07FF
+    return (sign << 15) | (exponent << 11) | mantissa
+
+
+def float64_bits(values):
+    return np.asarray(values, dtype=np.float64).view(np.uint64)
+
+
+def test_decode_all_codes():
+    expected = float64_bits([reference_decode_float16(code) for code in ALL_CODES.tolist()])
+
+    np.testing.assert_array_equal(float64_bits(decode_float16_array(ALL_CODES)), expected)
+    np.testing.assert_array_equal(float64_bits([decode_float16(code) for code in ALL_CODES.tolist()]), expected)
+
+
+def check_encode(values):
+    expected = np.array([reference_encode_float16(value) for value in values.tolist()], dtype=np.uint16)
+
+    np.testing.assert_array_equal(encode_float16_array(values), expected)
+    np.testing.assert_array_equal(np.array([encode_float16(value) for value in values.tolist()], dtype=np.uint16), expected)
+
+
+def test_encode_all_codes():
+    decoded = decode_float16_array(ALL_CODES)
+    check_encode(decoded)
+
+    # Values halfway to the next code truncate to the lower one
+    check_encode((decoded[:-1] + decoded[1:]) / 2)
+
+
+def test_encode_random_values():
+    rng = np.random.default_rng(0)
+    check_encode(np.concatenate((
+        rng.uniform(-1.0, 1.0, 100000),
+        rng.uniform(-2.0**16, 2.0**16, 100000),
+        rng.standard_normal(100000) * 2.0**rng.integers(-30, 30, 100000),
+    )))
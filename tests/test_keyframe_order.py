@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from io_scene_rw_anm.types.common import get_rw_keyframe_order
+
+
+# Export keyframe sort with Python tuples, kept as the reference
+def reference_keyframe_order(times, bone_ids):
+    sorted_s1 = sorted(zip(bone_ids.tolist(), times.tolist(), range(len(times))))
+    curr_bone_id = sorted_s1[0][0]
+    prev_time = sorted_s1[0][1] - 1.0
+
+    sorted_s2 = []
+    for bone_id, time, idx in sorted_s1:
+        if bone_id != curr_bone_id:
+            curr_bone_id = bone_id
+            prev_time = time - 1.0
+
+        sorted_s2.append((prev_time, bone_id, time, idx))
+        prev_time = time
+
+    return [idx for _, _, _, idx in sorted(sorted_s2)]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    keyframes_num = int(rng.integers(1, 300))
+    # Frame times of exported keyframes, bones are sampled at shared and at their own frames
+    times = rng.integers(0, 40, keyframes_num).astype(np.float64) + rng.choice((0.0, 0.5), keyframes_num)
+    bone_ids = rng.integers(0, 12, keyframes_num)
+
+    order = get_rw_keyframe_order(times, bone_ids)
+    assert order.tolist() == reference_keyframe_order(times, bone_ids)
+
+
+def test_previous_keyframe_precedes():
+    rng = np.random.default_rng(0)
+    times = rng.uniform(0.0, 2.0, 500).astype(np.float32)
+    bone_ids = rng.integers(0, 20, 500)
+
+    order = get_rw_keyframe_order(times, bone_ids)
+    assert sorted(order.tolist()) == list(range(500))
+
+    # Keyframes of each bone appear by time, ordered by the time of the keyframe before them
+    ordered_times, ordered_bones = times[order], bone_ids[order]
+    for bone_id in np.unique(bone_ids):
+        bone_times = ordered_times[ordered_bones == bone_id]
+        assert np.all(np.diff(bone_times) >= 0)
+
+
+def test_first_keyframes_lead():
+    times = np.array([1.0, 0.0, 2.0, 0.0, 1.0])
+    bone_ids = np.array([0, 0, 0, 1, 1])
+
+    assert get_rw_keyframe_order(times, bone_ids).tolist() == [1, 3, 0, 4, 2]
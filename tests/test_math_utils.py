@@ -0,0 +1,175 @@
+import math
+
+import numpy as np
+import pytest
+
+from io_scene_rw_anm.math_utils import (
+    find_needed_keys,
+    interpolate_keys,
+    make_quaternions_continuous,
+    position_errors,
+    quaternion_inverted,
+    quaternion_multiply,
+    quaternion_slerp,
+    rotation_errors,
+    transform_points,
+)
+
+
+def random_quaternions(rng, num):
+    quats = rng.standard_normal((num, 4))
+    return quats / np.linalg.norm(quats, axis=1, keepdims=True)
+
+
+# Scalar Quaternion methods of mathutils the per bone array math replaced, kept as the reference
+def reference_multiply(a, b):
+    aw, ax, ay, az = a
+    bw, bx, by, bz = b
+    return (
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+    )
+
+
+def reference_rotation_difference(a, b):
+    length_sq = sum(v * v for v in a)
+    return reference_multiply((a[0] / length_sq, -a[1] / length_sq, -a[2] / length_sq, -a[3] / length_sq), b)
+
+
+def reference_angle(q):
+    w = q[0] / math.sqrt(sum(v * v for v in q))
+    return 2.0 * math.acos(min(max(w, -1.0), 1.0))
+
+
+def reference_make_continuous(quats):
+    """Sign correction of the per keyframe import"""
+    result = []
+    prev_rot = None
+    for rot in quats:
+        if prev_rot is not None:
+            alt_rot = tuple(-v for v in rot)
+            if reference_angle(reference_rotation_difference(rot, prev_rot)) > \
+                    reference_angle(reference_rotation_difference(alt_rot, prev_rot)):
+                rot = alt_rot
+        prev_rot = rot
+        result.append(rot)
+    return result
+
+
+def test_quaternion_multiply():
+    rng = np.random.default_rng(0)
+    a, b = rng.standard_normal((2, 100, 4))
+
+    expected = [reference_multiply(qa, qb) for qa, qb in zip(a.tolist(), b.tolist())]
+    np.testing.assert_allclose(quaternion_multiply(a, b), expected, rtol=0, atol=1e-12)
+
+    # A single quaternion broadcasts over an array, as the rest rotation of a bone does
+    np.testing.assert_allclose(quaternion_multiply(tuple(a[0]), b), [reference_multiply(a[0], qb) for qb in b],
+                               rtol=0, atol=1e-12)
+
+
+def test_rotation_difference():
+    rng = np.random.default_rng(1)
+    local_rot = random_quaternions(rng, 1)[0] * 1.5
+    rots = random_quaternions(rng, 100)
+
+    expected = [reference_rotation_difference(tuple(local_rot), rot) for rot in rots.tolist()]
+    np.testing.assert_allclose(quaternion_multiply(quaternion_inverted(local_rot), rots), expected, rtol=0, atol=1e-12)
+
+
+def test_transform_points():
+    rng = np.random.default_rng(2)
+    matrix = np.vstack((rng.standard_normal((3, 4)), (0.0, 0.0, 0.0, 1.0)))
+    points = rng.standard_normal((100, 3))
+
+    # Translation part of matrix @ Matrix.Translation(point)
+    expected = [(matrix @ np.vstack((np.hstack((np.eye(3), np.reshape(point, (3, 1)))), (0, 0, 0, 1))))[:3, 3]
+                for point in points]
+    np.testing.assert_allclose(transform_points(matrix, points), expected, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_make_quaternions_continuous(seed):
+    rng = np.random.default_rng(seed)
+    # Small steps with random signs, the hemisphere test has to undo the flips
+    quats = np.cumsum(rng.standard_normal((200, 4)) * 0.2, axis=0) + (1.0, 0.0, 0.0, 0.0)
+    quats /= np.linalg.norm(quats, axis=1, keepdims=True)
+    quats *= rng.choice((-1.0, 1.0), (len(quats), 1))
+
+    expected = reference_make_continuous([tuple(q) for q in quats.tolist()])
+    np.testing.assert_array_equal(make_quaternions_continuous(quats), expected)
+
+
+def test_make_quaternions_continuous_short():
+    assert make_quaternions_continuous(np.zeros((0, 4))).shape == (0, 4)
+    np.testing.assert_array_equal(make_quaternions_continuous([(-1.0, 0.0, 0.0, 0.0)]), [(-1.0, 0.0, 0.0, 0.0)])
+
+
+def test_find_needed_keys_linear():
+    times = np.arange(10, dtype=np.float64)
+    values = np.outer(times, (1.0, -2.0, 0.5))
+
+    assert np.flatnonzero(find_needed_keys(times, values, 1e-6, position_errors)).tolist() == [0, 9]
+
+
+@pytest.mark.parametrize("keys_num", [1, 2, 3, 10])
+def test_find_needed_keys_ends(keys_num):
+    # Constant keys reproduce each other, only the first and the last key are left
+    times = np.arange(keys_num, dtype=np.float64)
+    keep = find_needed_keys(times, np.ones((keys_num, 3)), 1.0, position_errors)
+
+    assert np.flatnonzero(keep).tolist() == sorted({0, keys_num - 1})
+
+
+def test_find_needed_keys_repeated_times():
+    # A step at time 1 is kept on both sides, even though linear values would drop the keys around it
+    times = np.array([0.0, 1.0, 1.0, 2.0, 3.0, 3.0])
+    values = np.array([(0.0,), (1.0,), (1.0,), (2.0,), (3.0,), (3.0,)])
+
+    assert find_needed_keys(times, values, 1.0, position_errors).tolist() == [True, True, True, False, True, True]
+
+
+@pytest.mark.parametrize("tolerance, kept", [(0.5, False), (0.4999, True)])
+def test_find_needed_keys_tolerance_limit(tolerance, kept):
+    # Middle key is 0.5 away from the line between its neighbours, an error equal to tolerance is accepted
+    times = np.array([0.0, 1.0, 2.0])
+    values = np.array([(0.0, 0.0), (0.5, 0.0), (0.0, 0.0)])
+
+    assert find_needed_keys(times, values, tolerance, position_errors).tolist() == [True, kept, True]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_find_needed_keys_positions(seed):
+    rng = np.random.default_rng(seed)
+    times = np.cumsum(rng.integers(0, 3, 200)).astype(np.float64)
+    values = np.cumsum(rng.standard_normal((200, 3)) * 0.1, axis=0)
+    tolerance = 0.05
+
+    keep = find_needed_keys(times, values, tolerance, position_errors)
+    assert keep[0] and keep[-1]
+    assert np.count_nonzero(keep) < len(times)
+    assert np.all(position_errors(interpolate_keys(times, values, keep), values) <= tolerance)
+
+    repeated = np.diff(times) == 0.0
+    assert np.all(keep[1:][repeated]) and np.all(keep[:-1][repeated])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_find_needed_keys_rotations(seed):
+    rng = np.random.default_rng(seed)
+    times = np.arange(200, dtype=np.float64)
+    # Swing around a random axis with a little noise, signs are flipped as in imported keyframes
+    angles = np.sin(times / 20)[:, np.newaxis]
+    axis = rng.standard_normal(3)
+    quats = np.hstack((np.cos(angles / 2), np.sin(angles / 2) * axis / np.linalg.norm(axis)))
+    quats += rng.standard_normal(quats.shape) * 1e-3
+    quats /= np.linalg.norm(quats, axis=1, keepdims=True)
+    quats *= rng.choice((-1.0, 1.0), (len(quats), 1))
+    tolerance = math.radians(1.0)
+
+    keep = find_needed_keys(times, quats, tolerance, rotation_errors, quaternion_slerp)
+    assert keep[0] and keep[-1]
+    assert np.count_nonzero(keep) < len(times)
+    assert np.all(rotation_errors(interpolate_keys(times, quats, keep, quaternion_slerp), quats) <= tolerance)
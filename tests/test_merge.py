@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from io_scene_rw_anm.types.common import AnmAnimation, AnmKeyframeArrays, KeyframeType
+
+
+# Merge of AnmKeyframe lists with a linear search, kept as the reference. Keyframes are [time, bone_id, pos, rot]
+def reference_merge(keyframes, other_keyframes):
+    keyframes = [list(kf) for kf in keyframes]
+    for other_kf in other_keyframes:
+        merged_kf = next((kf for kf in keyframes if kf[0] == other_kf[0] and kf[1] == other_kf[1]), None)
+        if merged_kf:
+            if merged_kf[2] is None:
+                merged_kf[2] = other_kf[2]
+            else:
+                merged_kf[3] = other_kf[3]
+        else:
+            keyframes.append(list(other_kf))
+
+    keyframes.sort(key=lambda kf: (kf[0], kf[1]))
+    return keyframes
+
+
+def to_keyframes(arrays):
+    return [[time, bone_id, pos if has_pos else None, rot if has_rot else None]
+            for time, bone_id, pos, rot, has_pos, has_rot in zip(
+                arrays.times.tolist(), arrays.bone_ids.tolist(), arrays.pos.tolist(), arrays.rot.tolist(),
+                arrays.has_pos.tolist(), arrays.has_rot.tolist())]
+
+
+def make_arrays(rng, keyframes_num, has_pos, has_rot):
+    """Keyframes on a small grid of times and bones so that keys repeat, channels are present with the given odds"""
+    arrays = AnmKeyframeArrays.from_columns(rng.integers(0, 4, keyframes_num) / 30, rng.integers(0, 3, keyframes_num),
+                                            rng.standard_normal((keyframes_num, 3)),
+                                            rng.standard_normal((keyframes_num, 4)))
+    arrays.has_pos = rng.random(keyframes_num) < has_pos
+    arrays.has_rot = rng.random(keyframes_num) < has_rot
+    # Missing channels are zero rows, as the readers leave them
+    arrays.pos[~arrays.has_pos] = 0.0
+    arrays.rot[~arrays.has_rot] = 0.0
+    return arrays
+
+
+def make_animation(keyframe_type, arrays):
+    return AnmAnimation(0x100, keyframe_type, 0, 1.0, arrays)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_merge_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    rot_arrays = make_arrays(rng, int(rng.integers(0, 30)), 0.3, 1.0)
+    pos_arrays = make_arrays(rng, int(rng.integers(0, 30)), 1.0, 0.3)
+    expected = reference_merge(to_keyframes(rot_arrays), to_keyframes(pos_arrays))
+
+    animation = make_animation(KeyframeType.AKI_COMPRESSED_ROT, rot_arrays)
+    animation.merge_with(make_animation(KeyframeType.AKI_COMPRESSED_POS, pos_arrays))
+
+    assert to_keyframes(animation.arrays) == expected
+
+
+def test_merge_repeated_keys():
+    # The first pos keyframe fills the missing position, the next ones with the same key replace the rotation
+    rot_arrays = AnmKeyframeArrays.from_columns([0.0], [0], rot=[(1.0, 0.0, 0.0, 0.0)])
+    pos_arrays = AnmKeyframeArrays.from_columns([0.0, 0.0, 0.0], [0, 0, 0], [(1.0, 0.0, 0.0)] * 3,
+                                                [(0.0, 1.0, 0.0, 0.0), (0.0, 0.0, 1.0, 0.0), (0.0, 0.0, 0.0, 1.0)])
+
+    animation = make_animation(KeyframeType.AKI_COMPRESSED_ROT, rot_arrays)
+    animation.merge_with(make_animation(KeyframeType.AKI_COMPRESSED_POS, pos_arrays))
+
+    assert to_keyframes(animation.arrays) == [[0.0, 0, [1.0, 0.0, 0.0], [0.0, 0.0, 0.0, 1.0]]]
+
+
+def test_merge_appended_keys_match():
+    # Keyframes without a match are appended, later keyframes of other with the same key merge into them
+    rot_arrays = AnmKeyframeArrays.from_columns([0.0], [1], rot=[(1.0, 0.0, 0.0, 0.0)])
+    pos_arrays = AnmKeyframeArrays.from_columns([0.5, 0.5, 0.0], [0, 0, 0], [(1.0, 0.0, 0.0), (2.0, 0.0, 0.0),
+                                                                           (3.0, 0.0, 0.0)])
+
+    animation = make_animation(KeyframeType.AKI_COMPRESSED_ROT, rot_arrays)
+    animation.merge_with(make_animation(KeyframeType.AKI_COMPRESSED_POS, pos_arrays))
+
+    assert to_keyframes(animation.arrays) == reference_merge(to_keyframes(rot_arrays), to_keyframes(pos_arrays))
+    assert animation.arrays.times.tolist() == [0.0, 0.0, 0.5]
+    assert animation.arrays.bone_ids.tolist() == [0, 1, 0]
@@ -0,0 +1,363 @@
+import io
+import struct
+
+import numpy as np
+import pytest
+
+from io_scene_rw_anm.types.anm import read_keyframes_compressed, read_keyframes_uncompressed
+from io_scene_rw_anm.types.binary_utils import BinaryReader, decode_float16
+from io_scene_rw_anm.types.common import KEYFRAME_PARENT_NONE_OFFSET
+from io_scene_rw_anm.types.ska import read_keyframes_ska
+from io_scene_rw_anm.types.vendors.aki import read_keyframes_aki_compressed_pos, read_keyframes_aki_compressed_rot
+from io_scene_rw_anm.types.vendors.climax import read_keyframes_climax
+from io_scene_rw_anm.types.vendors.eighting import read_keyframes_8ing
+from io_scene_rw_anm.types.vendors.trashmasters import read_keyframes_tm, read_keyframes_tm_compressed_rot
+
+
+def make_chain(rng, bones_num, frames_num):
+    """Times, bone ids and previous keyframe indices in a random order where each keyframe follows
+    the previous one of its bone. Bones start with a root keyframe at time 0"""
+    times, bone_ids, prev_ids = [], [], []
+    last_ids = {}
+    pending = [bone_id for bone_id in range(bones_num) for _ in range(frames_num - 1)]
+    rng.shuffle(pending)
+
+    for bone_id in list(range(bones_num)) + pending:
+        prev_id = last_ids.get(bone_id, -1)
+        times.append(0.0 if prev_id < 0 else times[prev_id] + float(rng.integers(1, 4)) / 30)
+        bone_ids.append(bone_id)
+        prev_ids.append(prev_id)
+        last_ids[bone_id] = len(times) - 1
+
+    return np.array(times, dtype=np.float32), np.array(bone_ids), np.array(prev_ids)
+
+
+def get_prev_frame_offs(prev_ids, stride):
+    return [KEYFRAME_PARENT_NONE_OFFSET if prev_id < 0 else prev_id * stride for prev_id in prev_ids.tolist()]
+
+
+def get_relative_prev_frame_offs(prev_ids, stride):
+    return [KEYFRAME_PARENT_NONE_OFFSET if prev_id < 0 else (kf_id - prev_id) * stride
+            for kf_id, prev_id in enumerate(prev_ids.tolist())]
+
+
+def pack_records(fmt, rows):
+    return b''.join(struct.pack(fmt, *row) for row in rows)
+
+
+def random_float16_codes(rng, shape):
+    return rng.integers(0, 0x10000, shape).tolist()
+
+
+# Scalar readers the array versions replaced, kept as the reference.
+# Vector and Quaternion of mathutils store float32, float32 arithmetic is done with numpy scalars
+
+def f32(values):
+    return np.array(values, dtype=np.float32)
+
+
+def read(fd, fmt):
+    return struct.unpack(fmt, fd.read(struct.calcsize(fmt)))
+
+
+def read_float16(fd, num):
+    return tuple(map(decode_float16, read(fd, '<%dH' % num)))
+
+
+def resolve_bone_id(keyframes, frame_offs, prev_frame_off, time, bone_id):
+    if prev_frame_off & 0x3F000000:
+        return bone_id + 1 if time == 0.0 else 0
+    return keyframes[frame_offs.index(prev_frame_off)][1]
+
+
+def reference_read_uncompressed(fd, keyframes_num):
+    keyframes, frame_offs, bone_id = [], [], -1
+    for kf_id in range(keyframes_num):
+        frame_offs.append(kf_id * 36)
+        time, rx, ry, rz, rw, px, py, pz, prev_frame_off = read(fd, '<8fI')
+        bone_id = resolve_bone_id(keyframes, frame_offs, prev_frame_off, time, bone_id)
+        keyframes.append((time, bone_id, f32((px, py, pz)), f32((rw, rx, ry, rz))))
+    return keyframes
+
+
+def reference_read_compressed(fd, keyframes_num):
+    keyframes, frame_offs, bone_id = [], [], -1
+    for kf_id in range(keyframes_num):
+        frame_offs.append(kf_id * 24)
+        time, = read(fd, '<f')
+        rot = read_float16(fd, 4)
+        pos = f32(read_float16(fd, 3))
+        prev_frame_off, = read(fd, '<I')
+        bone_id = resolve_bone_id(keyframes, frame_offs, prev_frame_off, time, bone_id)
+        keyframes.append((time, bone_id, pos, f32((rot[3], rot[0], rot[1], rot[2]))))
+
+    pos_offset = f32(read(fd, '<3f'))
+    pos_scale = f32(read(fd, '<3f'))
+    return [(time, bone_id, pos * pos_scale + pos_offset, rot) for time, bone_id, pos, rot in keyframes]
+
+
+def reference_read_ska(fd, keyframes_num):
+    keyframes, frame_offs, bone_id = [], [], -1
+    for kf_id in range(keyframes_num):
+        frame_offs.append(kf_id * 36)
+        rx, ry, rz, rw, px, py, pz, time, prev_frame_off = read(fd, '<8fI')
+        bone_id = resolve_bone_id(keyframes, frame_offs, prev_frame_off, time, bone_id)
+        keyframes.append((time, bone_id, f32((px, py, pz)), f32((-rw, rx, ry, rz))))
+    return keyframes
+
+
+def reference_read_aki_rot(fd, keyframes_num):
+    keyframes, frame_offs, bone_id = [], [], -1
+    for kf_id in range(keyframes_num):
+        frame_offs.append(kf_id * 16)
+        time, prev_frame_off = read(fd, '<fI')
+        rot = read_float16(fd, 4)
+        bone_id = bone_id + 1 if time == 0.0 else keyframes[frame_offs.index(prev_frame_off)][1]
+        keyframes.append((time, bone_id, None, f32((rot[3], rot[0], rot[1], rot[2]))))
+    return keyframes
+
+
+def reference_read_aki_pos(fd, keyframes_num):
+    keyframes, frame_offs, bone_id = [], [], -1
+    for kf_id in range(keyframes_num):
+        frame_offs.append(kf_id * 16)
+        time, prev_frame_off = read(fd, '<fI')
+        pos = f32(read_float16(fd, 3))
+        bone_id = bone_id + 1 if time == 0.0 else keyframes[frame_offs.index(prev_frame_off)][1]
+        keyframes.append((time, bone_id, pos, None))
+
+    pos_offset = f32(read(fd, '<3f'))
+    pos_scale = f32(read(fd, '<3f'))
+    return [(time, bone_id, pos * pos_scale + pos_offset, rot) for time, bone_id, pos, rot in keyframes]
+
+
+def reference_read_8ing(fd, keyframes_num):
+    keyframes = []
+    for _ in range(keyframes_num):
+        rx, ry, rz, rw, px, py, pz, bone_id, time, prev_frame_off = read(fd, '<7hHfI')
+        keyframes.append((time, bone_id, f32([v / 8192 for v in (px, py, pz)]),
+                          f32((rw / 8192, rx / 8192, ry / 8192, rz / 8192))))
+    return keyframes
+
+
+def reference_read_tm_compressed_rot(fd, keyframes_num):
+    keyframes, frame_offs, bone_id = [], [], -1
+    for kf_id in range(keyframes_num):
+        frame_offs.append(kf_id * 16)
+        time, rx, ry, rz, rw, prev_frame_off = read(fd, '<f4hI')
+        bone_id = resolve_bone_id(keyframes, frame_offs, prev_frame_off, time, bone_id)
+        keyframes.append((time, bone_id, None, f32((rw / 32767, rx / 32767, ry / 32767, rz / 32767))))
+    return keyframes
+
+
+def reference_read_climax(fd, keyframes_num):
+    keyframes, bone_id = [], -1
+    pos_offset = f32(read(fd, '<3f'))
+    pos_scale = f32(read(fd, '<3f'))
+
+    for kf_id in range(keyframes_num):
+        prev_frame_off, time = read(fd, '<If')
+        if prev_frame_off & 0x3F000000:
+            bone_id = bone_id + 1 if time == 0.0 else 0
+        else:
+            bone_id = keyframes[kf_id - prev_frame_off // 20][1]
+        keyframes.append((time, bone_id))
+
+    result = []
+    for time, bone_id in keyframes:
+        compressed1, compressed2, *pos = read(fd, '<IH3H')
+        qx = ((compressed1 >> 20) - 2048.0) / 2047.0
+        qy = (((compressed1 >> 8) & 0xFFF) - 2048.0) / 2047.0
+        qz = ((((compressed1 * 16) & 0xFFF) | (compressed2 >> 12)) - 2048.0) / 2047.0
+        qw = ((compressed2 & 0xFFF) - 2048.0) / 2047.0
+        # Vector division by a scalar multiplies by its float32 reciprocal
+        pos = f32(pos) * (np.float32(1.0) / np.float32(65535.0)) * pos_scale + pos_offset
+        result.append((time, bone_id, pos, f32((qw, qx, qy, qz))))
+    return result
+
+
+def reference_read_tm(fd, keyframes_num):
+    keyframes, frame_offs = [], []
+    bone_id = -1
+    next_frame_off = 0
+
+    keyframes_with_pos_num, flag = read(fd, '<IB')
+    if flag & 1:
+        start_bone_id, _ = read(fd, '<I64s')
+        bone_id += start_bone_id
+    else:
+        start_bone_id = 0
+
+    pos_scale = f32(read(fd, '<3f'))
+    pos_offset = f32(read(fd, '<3f'))
+
+    for _ in range(keyframes_num):
+        frame_offs.append(next_frame_off)
+        kf_type, time = read(fd, '<Bf')
+        rot = read_float16(fd, 4)
+
+        if kf_type == 0:
+            pos = None
+            next_frame_off += 18
+        elif kf_type == 1:
+            pos = f32(read_float16(fd, 3)) * pos_scale + pos_offset
+            next_frame_off += 24
+        elif kf_type == 2:
+            pos = f32(read(fd, '<3f'))
+            next_frame_off += 30
+
+        prev_frame_off, = read(fd, '<I')
+        if prev_frame_off == 0:
+            bone_id = bone_id + 1 if time == 0.0 else start_bone_id
+        else:
+            bone_id = keyframes[frame_offs.index(prev_frame_off)][1]
+        keyframes.append((time, bone_id, pos, f32((rot[3], rot[0], rot[1], rot[2]))))
+    return keyframes
+
+
+def make_uncompressed_data(rng, times, prev_offs):
+    values = rng.standard_normal((len(times), 7)).astype(np.float32).tolist()
+    return pack_records('<8fI', [(t, *v, p) for t, v, p in zip(times.tolist(), values, prev_offs)])
+
+
+def make_compressed_data(rng, times, prev_offs):
+    codes = random_float16_codes(rng, (len(times), 7))
+    return pack_records('<f7HI', [(t, *c, p) for t, c, p in zip(times.tolist(), codes, prev_offs)]) + \
+        struct.pack('<6f', *rng.uniform(-5.0, 5.0, 6).tolist())
+
+
+def make_ska_data(rng, times, prev_offs):
+    values = rng.standard_normal((len(times), 7)).astype(np.float32).tolist()
+    return pack_records('<8fI', [(*v, t, p) for t, v, p in zip(times.tolist(), values, prev_offs)])
+
+
+def make_aki_rot_data(rng, times, prev_offs):
+    codes = random_float16_codes(rng, (len(times), 4))
+    return pack_records('<fI4H', [(t, p, *c) for t, c, p in zip(times.tolist(), codes, prev_offs)])
+
+
+def make_aki_pos_data(rng, times, prev_offs):
+    codes = random_float16_codes(rng, (len(times), 3))
+    return pack_records('<fI3H', [(t, p, *c) for t, c, p in zip(times.tolist(), codes, prev_offs)]) + \
+        struct.pack('<6f', *rng.uniform(-5.0, 5.0, 6).tolist())
+
+
+def make_8ing_data(rng, times, prev_offs):
+    values = rng.integers(-0x8000, 0x8000, (len(times), 7)).tolist()
+    bone_ids = rng.integers(0, 0x10000, len(times)).tolist()
+    return pack_records('<7hHfI', [(*v, b, t, p) for t, v, b, p in zip(times.tolist(), values, bone_ids, prev_offs)])
+
+
+def make_climax_data(rng, times, prev_offs):
+    compressed1 = rng.integers(0, 1 << 32, len(times)).tolist()
+    codes = rng.integers(0, 0x10000, (len(times), 4)).tolist()
+    return struct.pack('<6f', *rng.uniform(-5.0, 5.0, 6).tolist()) + \
+        pack_records('<If', zip(prev_offs, times.tolist())) + \
+        pack_records('<IH3H', [(c1, *c) for c1, c in zip(compressed1, codes)])
+
+
+def make_tm_data(rng, times, prev_ids, start_bone_id=None):
+    """Header and records of random types, offsets count the runtime size of each type"""
+    kf_types = rng.integers(0, 3, len(times)).tolist()
+    frame_offs = np.zeros(len(times), dtype=np.int64)
+    np.cumsum([(18, 24, 30)[kf_type] for kf_type in kf_types[:-1]], out=frame_offs[1:])
+
+    if start_bone_id is None:
+        data = struct.pack('<IB', len(times), 0)
+    else:
+        data = struct.pack('<IBI64s', len(times), 1, start_bone_id, b'Root')
+    data += struct.pack('<6f', *rng.uniform(-5.0, 5.0, 6).tolist())
+
+    for kf_type, time, prev_id in zip(kf_types, times.tolist(), prev_ids.tolist()):
+        data += struct.pack('<Bf4H', kf_type, time, *random_float16_codes(rng, 4))
+        if kf_type == 1:
+            data += struct.pack('<3H', *random_float16_codes(rng, 3))
+        elif kf_type == 2:
+            data += struct.pack('<3f', *rng.standard_normal(3).tolist())
+        data += struct.pack('<I', 0 if prev_id < 0 else int(frame_offs[prev_id]))
+    return data
+
+
+def make_tm_compressed_rot_data(rng, times, prev_offs):
+    values = rng.integers(-0x8000, 0x8000, (len(times), 4)).tolist()
+    return pack_records('<f4hI', [(t, *v, p) for t, v, p in zip(times.tolist(), values, prev_offs)])
+
+
+FORMATS = {
+    "uncompressed": (read_keyframes_uncompressed, reference_read_uncompressed, make_uncompressed_data, 36),
+    "compressed": (read_keyframes_compressed, reference_read_compressed, make_compressed_data, 24),
+    "ska": (read_keyframes_ska, reference_read_ska, make_ska_data, 36),
+    "aki_rot": (read_keyframes_aki_compressed_rot, reference_read_aki_rot, make_aki_rot_data, 16),
+    "aki_pos": (read_keyframes_aki_compressed_pos, reference_read_aki_pos, make_aki_pos_data, 16),
+    "8ing": (read_keyframes_8ing, reference_read_8ing, make_8ing_data, 24),
+    "tm_compressed_rot": (read_keyframes_tm_compressed_rot, reference_read_tm_compressed_rot,
+                          make_tm_compressed_rot_data, 16),
+    "climax": (read_keyframes_climax, reference_read_climax, make_climax_data, 20),
+}
+RELATIVE_FORMATS = {"climax"}
+
+
+def assert_keyframes_equal(arrays, keyframes):
+    """Compare columns with reference keyframes bit for bit, missing channels are zero rows"""
+    np.testing.assert_array_equal(arrays.times.view(np.uint32), f32([kf[0] for kf in keyframes]).view(np.uint32))
+    np.testing.assert_array_equal(arrays.bone_ids, [kf[1] for kf in keyframes])
+
+    for column, has_column, kf_idx, size in ((arrays.pos, arrays.has_pos, 2, 3), (arrays.rot, arrays.has_rot, 3, 4)):
+        np.testing.assert_array_equal(has_column, [kf[kf_idx] is not None for kf in keyframes])
+        expected = f32([np.zeros(size) if kf[kf_idx] is None else kf[kf_idx] for kf in keyframes])
+        np.testing.assert_array_equal(column.view(np.uint32), expected.reshape(-1, size).view(np.uint32))
+
+
+def check_reader(reader, reference_reader, data, keyframes_num):
+    fd = BinaryReader(data)
+    arrays = reader(fd, keyframes_num)
+    reference_fd = io.BytesIO(data)
+    keyframes = reference_reader(reference_fd, keyframes_num)
+
+    assert fd.tell() == reference_fd.tell() == len(data)
+    assert_keyframes_equal(arrays, keyframes)
+
+
+@pytest.mark.parametrize("name", FORMATS)
+@pytest.mark.parametrize("seed", range(3))
+def test_reader_matches_reference(name, seed):
+    reader, reference_reader, make_data, stride = FORMATS[name]
+    rng = np.random.default_rng(seed)
+    times, _, prev_ids = make_chain(rng, int(rng.integers(1, 8)), int(rng.integers(1, 12)))
+    # Climax offsets count back from the keyframe itself
+    prev_offs = get_relative_prev_frame_offs(prev_ids, stride) if name in RELATIVE_FORMATS else \
+        get_prev_frame_offs(prev_ids, stride)
+
+    check_reader(reader, reference_reader, make_data(rng, times, prev_offs), len(times))
+
+
+@pytest.mark.parametrize("name", FORMATS)
+def test_reader_empty(name):
+    reader, reference_reader, make_data, stride = FORMATS[name]
+    data = make_data(np.random.default_rng(0), np.zeros(0, dtype=np.float32), [])
+
+    check_reader(reader, reference_reader, data, 0)
+
+
+@pytest.mark.parametrize("start_bone_id", [None, 0, 3])
+@pytest.mark.parametrize("seed", range(3))
+def test_tm_reader_matches_reference(start_bone_id, seed):
+    rng = np.random.default_rng(seed)
+    times, _, prev_ids = make_chain(rng, int(rng.integers(1, 8)), int(rng.integers(1, 12)))
+
+    check_reader(read_keyframes_tm, reference_read_tm, make_tm_data(rng, times, prev_ids, start_bone_id), len(times))
+
+
+def test_tm_reader_empty():
+    data = make_tm_data(np.random.default_rng(0), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64))
+
+    check_reader(read_keyframes_tm, reference_read_tm, data, 0)
+
+
+def test_tm_reader_unknown_type():
+    times, _, prev_ids = make_chain(np.random.default_rng(0), 2, 3)
+    data = bytearray(make_tm_data(np.random.default_rng(0), times, prev_ids))
+    data[struct.calcsize('<IB6f')] = 3
+
+    with pytest.raises(ValueError):
+        read_keyframes_tm(BinaryReader(bytes(data)), len(times))
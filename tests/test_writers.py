@@ -0,0 +1,278 @@
+import struct
+
+import numpy as np
+import pytest
+
+from io_scene_rw_anm.types.anm import (
+    ANM_CHUNK_ID,
+    Anm,
+    get_anm_animation_size,
+    read_anm_animation,
+    read_keyframes_compressed,
+    read_keyframes_uncompressed,
+    write_anm_animation,
+    write_keyframes_compressed,
+    write_keyframes_uncompressed,
+)
+from io_scene_rw_anm.types.binary_utils import BinaryReader, BinaryWriter, encode_float16, read_uint32
+from io_scene_rw_anm.types.common import (
+    KEYFRAME_PARENT_NONE_OFFSET,
+    AnmAnimation,
+    AnmKeyframeArrays,
+    KeyframeType,
+    RWAnmChunk,
+    calculate_linear_scale,
+)
+from io_scene_rw_anm.types.ska import Ska, read_keyframes_ska, write_keyframes_ska
+from io_scene_rw_anm.types.vendors.aki import (
+    read_keyframes_aki_compressed_pos,
+    read_keyframes_aki_compressed_rot,
+    write_keyframes_aki_compressed_pos,
+    write_keyframes_aki_compressed_rot,
+)
+from io_scene_rw_anm.types.vendors.climax import read_keyframes_climax, write_keyframes_climax
+from io_scene_rw_anm.types.vendors.eighting import Anm8ingKeyframe, read_keyframes_8ing, write_keyframes_8ing
+from io_scene_rw_anm.types.vendors.trashmasters import read_keyframes_tm_compressed_rot, write_keyframes_tm_compressed_rot
+
+RW_VERSION = 0x1803FFFF
+
+
+def make_keyframes(rng, bones_num, frames_num, keyframe_cls=None, pos_range=5.0):
+    """Keyframes where each bone starts at time 0 and its keyframes follow each other in a shuffled order"""
+    pending = [bone_id for bone_id in range(bones_num) for _ in range(frames_num - 1)]
+    rng.shuffle(pending)
+    bone_ids = np.array(list(range(bones_num)) + pending, dtype=np.int64)
+
+    times = np.zeros(len(bone_ids), dtype=np.float32)
+    last_times = np.zeros(bones_num, dtype=np.float32)
+    for kf_id in range(bones_num, len(bone_ids)):
+        last_times[bone_ids[kf_id]] += np.float32(rng.integers(1, 4) / 30)
+        times[kf_id] = last_times[bone_ids[kf_id]]
+
+    rots = rng.standard_normal((len(times), 4))
+    rots /= np.linalg.norm(rots, axis=1, keepdims=True)
+    pos = rng.uniform(-pos_range, pos_range, (len(times), 3))
+
+    arrays = AnmKeyframeArrays.from_columns(times, bone_ids, pos, rots)
+    if keyframe_cls:
+        arrays.keyframe_cls = keyframe_cls
+    return arrays
+
+
+# Scalar writers the array versions replaced, kept as the reference. They take columns instead of
+# AnmKeyframe lists, Vector and Quaternion of mathutils store float32, numpy scalars keep that precision
+
+def pack(fmt, *values):
+    return struct.pack(fmt, *values)
+
+
+def f32(values):
+    return np.array(values, dtype=np.float32)
+
+
+def get_linear_scale(pos, unsigned=False):
+    offset, scale = zip(*(calculate_linear_scale(tuple(pos[:, i].tolist()), unsigned) for i in range(3)))
+    return f32(offset), f32(scale)
+
+
+def get_scaled_positions(pos, pos_offset, pos_scale):
+    # Vector((v1/v2 for v1, v2 in zip(kf.pos - pos_offset, pos_scale)))
+    return [f32([float(v1) / float(v2) for v1, v2 in zip(p - pos_offset, pos_scale)]) for p in pos]
+
+
+def get_prev_frame_off(prev_frame_offs, bone_id):
+    return prev_frame_offs.get(bone_id, KEYFRAME_PARENT_NONE_OFFSET)
+
+
+def reference_write_uncompressed(arrays):
+    data, prev_frame_offs = b'', {}
+    for kf_id, (time, bone_id, pos, rot) in enumerate(zip(arrays.times, arrays.bone_ids.tolist(), arrays.pos, arrays.rot)):
+        data += pack('<8fI', time, rot[1], rot[2], rot[3], rot[0], *pos, get_prev_frame_off(prev_frame_offs, bone_id))
+        prev_frame_offs[bone_id] = kf_id * 36
+    return data
+
+
+def reference_write_compressed(arrays):
+    pos_offset, pos_scale = get_linear_scale(arrays.pos)
+    positions = get_scaled_positions(arrays.pos, pos_offset, pos_scale)
+
+    data, prev_frame_offs = b'', {}
+    for kf_id, (time, bone_id, pos, rot) in enumerate(zip(arrays.times, arrays.bone_ids.tolist(), positions, arrays.rot)):
+        data += pack('<f7HI', time, *(encode_float16(float(v)) for v in (rot[1], rot[2], rot[3], rot[0], *pos)),
+                     get_prev_frame_off(prev_frame_offs, bone_id))
+        prev_frame_offs[bone_id] = kf_id * 24
+    return data + pack('<6f', *pos_offset, *pos_scale)
+
+
+def reference_write_ska(arrays):
+    data, prev_frame_offs = b'', {}
+    for kf_id, (time, bone_id, pos, rot) in enumerate(zip(arrays.times, arrays.bone_ids.tolist(), arrays.pos, arrays.rot)):
+        data += pack('<8fI', rot[1], rot[2], rot[3], -rot[0], *pos, time, get_prev_frame_off(prev_frame_offs, bone_id))
+        prev_frame_offs[bone_id] = kf_id * 36
+    return data
+
+
+def get_cyclic_prev_frame_offs(bone_ids):
+    return {bone_id: kf_id * 16 for kf_id, bone_id in enumerate(bone_ids)}
+
+
+def reference_write_aki_rot(arrays):
+    bone_ids = arrays.bone_ids.tolist()
+    data, prev_frame_offs = b'', get_cyclic_prev_frame_offs(bone_ids)
+    for kf_id, (time, bone_id, rot) in enumerate(zip(arrays.times, bone_ids, arrays.rot)):
+        data += pack('<fI4H', time, prev_frame_offs[bone_id],
+                     *(encode_float16(float(v)) for v in (rot[1], rot[2], rot[3], rot[0])))
+        prev_frame_offs[bone_id] = kf_id * 16
+    return data
+
+
+def reference_write_aki_pos(arrays):
+    bone_ids = arrays.bone_ids.tolist()
+    pos_offset, pos_scale = get_linear_scale(arrays.pos)
+    positions = get_scaled_positions(arrays.pos, pos_offset, pos_scale)
+
+    data, prev_frame_offs = b'', get_cyclic_prev_frame_offs(bone_ids)
+    for kf_id, (time, bone_id, pos) in enumerate(zip(arrays.times, bone_ids, positions)):
+        data += pack('<fI3H', time, prev_frame_offs[bone_id], *(encode_float16(float(v)) for v in pos))
+        prev_frame_offs[bone_id] = kf_id * 16
+    return data + pack('<6f', *pos_offset, *pos_scale)
+
+
+def reference_write_tm_compressed_rot(arrays):
+    data, prev_frame_offs = b'', {}
+    for kf_id, (time, bone_id, rot) in enumerate(zip(arrays.times, arrays.bone_ids.tolist(), arrays.rot)):
+        data += pack('<f4hI', time, *(int(float(v) * 32767) for v in (rot[1], rot[2], rot[3], rot[0])),
+                     get_prev_frame_off(prev_frame_offs, bone_id))
+        prev_frame_offs[bone_id] = kf_id * 16
+    return data
+
+
+def reference_write_climax(arrays):
+    pos_offset, pos_scale = get_linear_scale(arrays.pos, True)
+    positions = get_scaled_positions(arrays.pos, pos_offset, pos_scale)
+
+    data, prev_frame_offs = pack('<6f', *pos_offset, *pos_scale), {}
+    for kf_id, (time, bone_id) in enumerate(zip(arrays.times, arrays.bone_ids.tolist())):
+        prev_frame_off = KEYFRAME_PARENT_NONE_OFFSET if bone_id not in prev_frame_offs else \
+            (kf_id - prev_frame_offs[bone_id]) * 20
+        data += pack('<If', prev_frame_off, time)
+        prev_frame_offs[bone_id] = kf_id
+
+    for rot, pos in zip(arrays.rot, positions):
+        qw, qx, qy, qz = (round(float(v) * 2047.0 + 2048.0) for v in rot)
+        compressed1 = (qx << 20) | (qy << 8) | ((qz & 0xFFF0) >> 4)
+        compressed2 = ((qz & 0x0F) << 12) | (qw & 0xFFF)
+        data += pack('<IH3H', compressed1, compressed2, *(round(float(v) * 65535) for v in pos))
+    return data
+
+
+def reference_write_8ing(arrays):
+    data, prev_frame_offs = b'', {}
+    for kf_id, (time, bone_id, pos, rot) in enumerate(zip(arrays.times, arrays.bone_ids.tolist(), arrays.pos, arrays.rot)):
+        prev_frame_off = KEYFRAME_PARENT_NONE_OFFSET if time == 0.0 else prev_frame_offs[bone_id]
+        data += pack('<7hHfI', *(int(float(v) * 8192) for v in (rot[1], rot[2], rot[3], rot[0], *pos)),
+                     bone_id, time, prev_frame_off)
+        prev_frame_offs[bone_id] = kf_id * 24
+    return data
+
+
+# Writer, reader, reference writer, largest position and rotation error of the round trip,
+# None for channels the keyframe type does not store
+FORMATS = {
+    "uncompressed": (write_keyframes_uncompressed, read_keyframes_uncompressed, reference_write_uncompressed, 0.0, 0.0),
+    "compressed": (write_keyframes_compressed, read_keyframes_compressed, reference_write_compressed, 5e-3, 1e-3),
+    "ska": (write_keyframes_ska, read_keyframes_ska, reference_write_ska, 0.0, 0.0),
+    "aki_rot": (write_keyframes_aki_compressed_rot, read_keyframes_aki_compressed_rot, reference_write_aki_rot,
+                None, 1e-3),
+    "aki_pos": (write_keyframes_aki_compressed_pos, read_keyframes_aki_compressed_pos, reference_write_aki_pos,
+                5e-3, None),
+    "tm_compressed_rot": (write_keyframes_tm_compressed_rot, read_keyframes_tm_compressed_rot,
+                          reference_write_tm_compressed_rot, None, 1e-4),
+    "climax": (write_keyframes_climax, read_keyframes_climax, reference_write_climax, 2e-4, 5e-4),
+    "8ing": (write_keyframes_8ing, read_keyframes_8ing, reference_write_8ing, 2e-4, 2e-4),
+}
+
+
+def write_bytes(writer, arrays):
+    fd = BinaryWriter()
+    writer(fd, arrays)
+    return bytes(fd.getbuffer())
+
+
+@pytest.mark.parametrize("name", FORMATS)
+@pytest.mark.parametrize("seed", range(3))
+def test_writer_matches_reference(name, seed):
+    writer, reader, reference_writer, pos_error, rot_error = FORMATS[name]
+    rng = np.random.default_rng(seed)
+    keyframe_cls = Anm8ingKeyframe if name == "8ing" else None
+    arrays = make_keyframes(rng, int(rng.integers(1, 8)), int(rng.integers(1, 10)), keyframe_cls,
+                            3.0 if name == "8ing" else 5.0)
+
+    data = write_bytes(writer, arrays)
+    assert data == reference_writer(arrays)
+
+    fd = BinaryReader(data)
+    decoded = reader(fd, len(arrays))
+    assert fd.tell() == len(data)
+
+    np.testing.assert_array_equal(decoded.times, arrays.times)
+    np.testing.assert_array_equal(decoded.bone_ids, arrays.bone_ids)
+    if pos_error is not None:
+        np.testing.assert_allclose(decoded.pos, arrays.pos, rtol=0, atol=pos_error)
+    if rot_error is not None:
+        np.testing.assert_allclose(decoded.rot, arrays.rot, rtol=0, atol=rot_error)
+
+
+def test_compressed_constant_column():
+    # A zero scale column quantizes to zero instead of raising ZeroDivisionError
+    arrays = make_keyframes(np.random.default_rng(0), 3, 4)
+    arrays.pos[:, 1] = 0.0
+
+    decoded = read_keyframes_compressed(BinaryReader(write_bytes(write_keyframes_compressed, arrays)), len(arrays))
+    np.testing.assert_array_equal(decoded.pos[:, 1], 0.0)
+
+
+@pytest.mark.parametrize("keyframe_type", [KeyframeType.UNCOMPRESSED, KeyframeType.COMPRESSED,
+                                           KeyframeType.TM_COMPRESSED_ROT, KeyframeType.CLIMAX])
+def test_anm_chunk_size(keyframe_type):
+    rng = np.random.default_rng(0)
+    animations = [AnmAnimation(0x100, keyframe_type, 0, 1.0, make_keyframes(rng, bones_num, frames_num))
+                  for bones_num, frames_num in ((3, 4), (5, 2))]
+
+    fd = BinaryWriter()
+    Anm([RWAnmChunk(ANM_CHUNK_ID, RW_VERSION, animation) for animation in animations]).write(fd)
+    data = bytes(fd.getbuffer())
+
+    reader = BinaryReader(data)
+    for animation in animations:
+        chunk_id, chunk_size, version = read_uint32(reader, 3)
+        start = reader.tell()
+        assert (chunk_id, version) == (ANM_CHUNK_ID, RW_VERSION)
+        assert chunk_size == get_anm_animation_size(keyframe_type, animation.keyframes_num)
+
+        read_anm_animation(reader)
+        assert reader.tell() - start == chunk_size
+
+        animation_data = BinaryWriter()
+        write_anm_animation(animation_data, animation)
+        assert data[start:start + chunk_size] == bytes(animation_data.getbuffer())
+    assert reader.tell() == len(data)
+
+    # Chunks indexed by their size decode the same as chunks read in order
+    for lazy_chunk, chunk in zip(Anm.read(BinaryReader(data), True).chunks, Anm.read(BinaryReader(data)).chunks):
+        np.testing.assert_array_equal(lazy_chunk.animation.arrays.pos, chunk.animation.arrays.pos)
+        np.testing.assert_array_equal(lazy_chunk.animation.arrays.rot, chunk.animation.arrays.rot)
+
+
+def test_ska_file():
+    arrays = make_keyframes(np.random.default_rng(0), 4, 3)
+    animation = AnmAnimation(0, 0, 0x3, 0.25, arrays)
+
+    fd = BinaryWriter()
+    Ska(animation).write(fd)
+    data = bytes(fd.getbuffer())
+    assert data == pack('<2If', len(arrays), 0x3, 0.25) + reference_write_ska(arrays)
+
+    decoded = Ska.read(BinaryReader(data)).animation
+    assert (decoded.flags, decoded.duration) == (0x3, 0.25)
+    np.testing.assert_array_equal(decoded.arrays.rot, arrays.rot)